@@ -15,6 +15,8 @@ flags = tf.app.flags
 flags.DEFINE_integer("word_dim", 300, "word embedding size")
 flags.DEFINE_integer("num_epochs", 50, "number of epochs")
 flags.DEFINE_integer("batch_size", 100, "batch size")
+flags.DEFINE_integer("steps_per_run", 1, 
+                     "training steps run in-graph per session.run")
 
 flags.DEFINE_boolean('is_adv', False, 'set True to use adv training')
 flags.DEFINE_boolean('is_test', False, 'set True to test')
@@ -24,6 +26,30 @@ FLAGS = tf.app.flags.FLAGS
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
+def run_train_steps(sess, m_train, num_steps):
+  '''runs `num_steps` training steps, FLAGS.steps_per_run at a time
+
+  Returns
+    summed loss and accuracy of the steps
+  '''
+  k = FLAGS.steps_per_run
+  sum_loss, sum_acc = 0., 0.
+  if k > 1:
+    fetches = [m_train.tensors['n_steps_loss'], m_train.tensors['n_steps_acc']]
+    for _ in range(num_steps // k):
+      loss, acc = sess.run(fetches)
+      sum_loss += k*loss
+      sum_acc += k*acc
+    num_steps %= k
+
+  fetches = [m_train.train_ops['train_loss'], 
+             m_train.tensors['loss'], m_train.tensors['acc']]
+  for _ in range(num_steps):
+    _, loss, acc = sess.run(fetches)
+    sum_loss += loss
+    sum_acc += acc
+  return sum_loss, sum_acc
+
 def train_semeval(sess, m_train, m_valid, test_iter):
   best_acc, best_epoch = 0., 0
   start_time = time.time()
@@ -44,13 +70,7 @@ def train_semeval(sess, m_train, m_valid, test_iter):
     sess.run([test_iter.initializer])
 
     # train SemEval
-    sem_loss, sem_acc = 0., 0.
-    for batch in range(80):
-      train_op = m_train.train_ops['train_loss']
-      fetches = [train_op, m_train.tensors['loss'], m_train.tensors['acc']]
-      _, loss, acc = sess.run(fetches)
-      sem_loss += loss
-      sem_acc += acc
+    sem_loss, sem_acc = run_train_steps(sess, m_train, 80)
 
     sem_loss /= 80
     sem_acc /= 80
@@ -70,12 +90,13 @@ def train_semeval(sess, m_train, m_valid, test_iter):
     if best_acc < sem_valid_acc:
       best_acc = sem_valid_acc
       best_epoch = epoch
-      m_train.save(sess, epoch)
+      m_train.save(sess, epoch, sem_valid_acc)
     
     print("Epoch %d sem %.2f %.2f %.4f time %.2f" % 
              (epoch, sem_loss, sem_acc, sem_valid_acc, duration))
     sys.stdout.flush()
   
+  m_train.wait_for_checkpoints()
   duration = time.time() - orig_begin_time
   duration /= 3600
   print('Done training, best_epoch: %d, best_acc: %.4f' % (best_epoch, best_acc))
@@ -125,6 +146,9 @@ def main(_):
                           model_name, word_embed,
                           train_data, test_data, unsup_data,
                           FLAGS.is_adv, FLAGS.is_test)
+    if FLAGS.steps_per_run > 1 and not FLAGS.is_test:
+      with tf.name_scope('Train'):
+        m_train.build_train_n_steps(train_iter, FLAGS.steps_per_run)
 
     init_op = tf.group(tf.global_variables_initializer(),
                         tf.local_variables_initializer())# for file queue
@@ -1,6 +1,7 @@
 import os
 import tensorflow as tf
 from tensorflow.python.framework import ops
+from models.checkpoint import *
 
 flags = tf.app.flags
 flags.DEFINE_string("logdir", "saved_models/", "where to save the model")
@@ -9,6 +10,8 @@ FLAGS = tf.app.flags.FLAGS
 
 
 class BaseModel(object):
+  # sha1 of the frozen embeddings, see models/checkpoint.py
+  embed_refs = {}
 
   def set_saver(self, save_dir):
     '''
@@ -16,16 +19,26 @@ class BaseModel(object):
       save_dir: relative path to FLAGS.logdir
     '''
     # shared between train and valid model instance
-    self.saver = tf.train.Saver(var_list=None)
+    self.saver = tf.train.Saver(var_list=saveable_variables())
     self.save_dir = os.path.join(FLAGS.logdir, save_dir)
     self.save_path = os.path.join(self.save_dir, "model.ckpt")
+    self.ckpt_manager = None
 
   def restore(self, session):
     ckpt = tf.train.get_checkpoint_state(self.save_dir)
+    verify_embeddings(self.save_dir, self.embed_refs)
     self.saver.restore(session, ckpt.model_checkpoint_path)
 
-  def save(self, session, global_step):
-    self.saver.save(session, self.save_path, global_step)
+  def save(self, session, global_step, metric=None):
+    '''snapshots the variables, the files are written in the background'''
+    if self.ckpt_manager is None:
+      self.ckpt_manager = CheckpointManager(self.save_dir, 
+                              saveable_variables(), self.embed_refs)
+    self.ckpt_manager.save(session, global_step, metric)
+
+  def wait_for_checkpoints(self):
+    if self.ckpt_manager is not None:
+      self.ckpt_manager.wait()
 
 
 def conv_block_v2(inputs, kernel_size, num_filters, name, training, 
@@ -43,16 +56,35 @@ def conv_block_v2(inputs, kernel_size, num_filters, name, training,
       conv_out = conv_out + shortcut
     return conv_out
 
-def optimize(loss, lrn_rate, max_norm=None, decay_steps=None):
+def masked_max_pool(inputs, length):
+  '''global max pooling over the first `length` steps of each sequence
+
+  Args
+    inputs: [batch, len, dim]
+    length: [batch]
+  Returns
+    [batch, dim]
+  '''
+  mask = tf.sequence_mask(length, tf.shape(inputs)[1]) # (batch, len)
+  mask = tf.tile(tf.expand_dims(mask, axis=-1), [1, 1, tf.shape(inputs)[2]])
+  # padded positions never win the max
+  neg_inf = tf.ones_like(inputs) * inputs.dtype.min
+  return tf.reduce_max(tf.where(mask, inputs, neg_inf), axis=1)
+
+def make_optimizer(lrn_rate, decay_steps=None):
+  '''Adam and the global step it increments'''
+  global_step = tf.Variable(0, name="global_step", trainable=False)
+  
+  if decay_steps is not None:
+    lrn_rate = tf.train.exponential_decay(lrn_rate, global_step, 
+                                  decay_steps, 0.95, staircase=True)
+  
+  optimizer = tf.train.AdamOptimizer(lrn_rate)
+  return optimizer, global_step
+
+def apply_gradients(optimizer, loss, global_step, max_norm=None):
   update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS) # for batch_norm
   with tf.control_dependencies(update_ops):
-    global_step = tf.Variable(0, name="global_step", trainable=False)
-    
-    if decay_steps is not None:
-      lrn_rate = tf.train.exponential_decay(lrn_rate, global_step, 
-                                    decay_steps, 0.95, staircase=True)
-    
-    optimizer = tf.train.AdamOptimizer(lrn_rate)
     gradients, variables = zip(*optimizer.compute_gradients(loss))
     
     if max_norm is not None:
@@ -60,6 +92,35 @@ def optimize(loss, lrn_rate, max_norm=None, decay_steps=None):
     train_op = optimizer.apply_gradients(zip(gradients, variables), global_step=global_step)
     return train_op
 
+def optimize(loss, lrn_rate, max_norm=None, decay_steps=None):
+  optimizer, global_step = make_optimizer(lrn_rate, decay_steps)
+  return apply_gradients(optimizer, loss, global_step, max_norm)
+
+def train_n_steps(step_fn, num_steps):
+  '''runs `num_steps` training steps inside one tf.while_loop
+
+  Each iteration builds a fresh step with `step_fn`, which must pull its own
+  batch (iterator.get_next()) and reuse the existing variables and optimizer.
+
+  Args
+    step_fn: returns (train_op, loss, acc) of a single step
+    num_steps: python int, steps per session.run
+  Returns
+    loss and acc averaged over the steps
+  '''
+  def cond(step, loss_sum, acc_sum):
+    return step < num_steps
+
+  def body(step, loss_sum, acc_sum):
+    train_op, loss, acc = step_fn()
+    with tf.control_dependencies([train_op]):
+      return step + 1, loss_sum + loss, acc_sum + acc
+
+  _, loss_sum, acc_sum = tf.while_loop(cond, body, 
+                      [tf.constant(0), tf.constant(0.), tf.constant(0.)],
+                      parallel_iterations=1, back_prop=False)
+  return loss_sum / num_steps, acc_sum / num_steps
+
     
 def slice_batch(inputs, begin, size, dtype=tf.float32):
   '''
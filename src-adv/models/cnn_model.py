@@ -29,7 +29,8 @@ class CNNModel(BaseModel):
     self.is_adv = is_adv
 
     self.he_normal = tf.keras.initializers.he_normal()
-    self.regularizer = tf.contrib.layers.l2_regularizer(FLAGS.l2_coef)
+    self.l2_regularizer = tf.contrib.layers.l2_regularizer(FLAGS.l2_coef)
+    self.regularized_weights = []
 
     # embedding initialization
     self.vocab_size, self.word_dim = word_embed.shape
@@ -37,14 +38,16 @@ class CNNModel(BaseModel):
                                       initializer= word_embed,
                                       dtype=tf.float32,
                                       trainable=False)
+    self.embed_refs = {self.word_embed.op.name: array_sha1(word_embed)}
     pos_shape = [FLAGS.pos_num, FLAGS.pos_dim]  
     self.pos1_embed = tf.get_variable('pos1_embed', shape=pos_shape)
     self.pos2_embed = tf.get_variable('pos2_embed', shape=pos_shape)
     self.embed_dim = self.word_dim + 2*FLAGS.pos_dim
 
     self.tensors = dict()
+    self.pos_kv = dict()
 
-    with tf.variable_scope('adv_graph'):
+    with tf.variable_scope('adv_graph') as self.scope:
       self.build_semeval_graph(semeval_data)
       # self.build_nyt_graph(unsup_data)
 
@@ -60,33 +63,40 @@ class CNNModel(BaseModel):
 
     return labels, length, ent_pos, sentence, pos1, pos2
   
-  def conv_shallow(self, inputs, name='conv_block'):
+  def conv_shallow(self, inputs, length, name='conv_block'):
     conv_out = conv_block_v2(inputs, KERNEL_SIZE, NUM_FILTERS,
                             name,training=self.is_train, 
                           initializer=self.he_normal, batch_norm=False,
                           reuse=tf.AUTO_REUSE)
 
-    pool_out = tf.layers.max_pooling1d(conv_out, MAX_LEN, MAX_LEN, padding='same')
-    pool_out = tf.squeeze(pool_out, axis=1)
+    pool_out = masked_max_pool(conv_out, length)
     return pool_out
 
-  def conv_deep(self, inputs):
+  def conv_deep(self, inputs, length):
     # FIXME auto reuse
-    return residual_net(inputs, MAX_LEN, NUM_FILTERS, self.is_train, NUM_CLASSES)
+    return residual_net(inputs, length, NUM_FILTERS, self.is_train, NUM_CLASSES)
+
+  def regularizer(self, weights):
+    # remember the weights so that semeval_loss can read them again inside
+    # the in-graph training loop
+    self.regularized_weights.append(weights)
+    return self.l2_regularizer(weights)
 
   def compute_logits(self, sentence, length, ent_pos, pos1, pos2, regularizer=None):
     inputs = tf.concat([sentence, pos1, pos2], axis=2)
 
     entities = self.slice_entity(inputs, ent_pos, length)
-    scaled_entities = multihead_attention(entities, inputs, None, self.embed_dim, 
-                                  self.embed_dim, self.embed_dim, 10, reuse=tf.AUTO_REUSE,
-                                  name='ent-mh-att')
+    bias = attention_bias_lengths(length, tf.shape(inputs)[1])
+    scaled_entities = multihead_attention(entities, sentence, bias, self.embed_dim, 
+                                  self.embed_dim, self.embed_dim, 10, 
+                                  memory_static=self.position_kv(pos1, pos2),
+                                  reuse=tf.AUTO_REUSE, name='ent-mh-att')
     ent_out = tf.nn.relu(scaled_entities)
     ent_out = tf.reduce_max(ent_out, axis=1)
-    # ent_out = self.conv_shallow(scaled_entities, 'conv_ent')
+    # ent_out = self.conv_shallow(scaled_entities, length, 'conv_ent')
 
-    conv_out = self.conv_shallow(inputs)
-    # conv_out = self.conv_deep(inputs)
+    conv_out = self.conv_shallow(inputs, length)
+    # conv_out = self.conv_deep(inputs, length)
 
     out = tf.concat([ent_out, conv_out], axis=1)
     # out = conv_out
@@ -95,6 +105,17 @@ class CNNModel(BaseModel):
                         kernel_regularizer=regularizer, reuse=tf.AUTO_REUSE)
     return logits
   
+  def position_kv(self, pos1, pos2):
+    '''key/value projection of the position embeddings, computed once and 
+    shared by the clean and the adversarial passes
+    '''
+    key = (pos1, pos2)
+    if key not in self.pos_kv:
+      self.pos_kv[key] = precompute_memory_kv(tf.concat([pos1, pos2], axis=2),
+                                  self.embed_dim, self.embed_dim, self.embed_dim,
+                                  reuse=tf.AUTO_REUSE, name='ent-mh-att')
+    return self.pos_kv[key]
+
   def slice_entity(self, inputs, ent_pos, length):
     '''
     Args
@@ -127,7 +148,8 @@ class CNNModel(BaseModel):
 
     return tf.reduce_mean(cross_entropy)
   
-  def build_semeval_graph(self, data):
+  def semeval_loss(self, data):
+    '''loss, accuracy and predictions of one SemEval batch'''
     labels, length, ent_pos, sentence, pos1, pos2 = self.bottom(data)
 
     # cross entropy loss
@@ -136,15 +158,14 @@ class CNNModel(BaseModel):
 
     # # adv loss
     adv_sentence = adv_example(sentence, loss_xent)
-    adv_logits = self.compute_logits(sentence, length, ent_pos, pos1, pos2)
+    adv_logits = self.compute_logits(adv_sentence, length, ent_pos, pos1, pos2)
     loss_adv = self.compute_xentropy_loss(adv_logits, labels)
 
     # # vadv loss
     # loss_vadv = virtual_adversarial_loss(logits, sentence, length, ent_pos, pos1, pos2, self.compute_logits)
 
     # l2 loss
-    regularization_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
-    loss_l2 = sum(regularization_losses)
+    loss_l2 = sum(self.l2_regularizer(w) for w in self.regularized_weights)
     # l2_losses = []
     # for var in tf.trainable_variables():
     #   l2_losses.append(tf.nn.l2_loss(var))
@@ -156,8 +177,14 @@ class CNNModel(BaseModel):
       acc = tf.cast(tf.equal(pred, labels), tf.float32)
       acc = tf.reduce_mean(acc)
 
+    loss = loss_xent + loss_adv + loss_l2 #+ loss_vadv
+    return loss, acc, pred
+
+  def build_semeval_graph(self, data):
+    loss, acc, pred = self.semeval_loss(data)
+
     self.tensors['acc'] = acc
-    self.tensors['loss'] = loss_xent + loss_adv + loss_l2 #+ loss_vadv
+    self.tensors['loss'] = loss
     self.tensors['pred'] = pred
 
   def build_nyt_graph(self, data):
@@ -180,10 +207,27 @@ class CNNModel(BaseModel):
     if self.is_train:
       self.train_ops = dict()
       loss = self.tensors['loss']
-      self.train_ops['train_loss'] = optimize(loss, FLAGS.lrn_rate, decay_steps=None)
+      self.optimizer, self.global_step = make_optimizer(FLAGS.lrn_rate)
+      self.train_ops['train_loss'] = apply_gradients(self.optimizer, loss, 
+                                                     self.global_step)
       # unsup_loss = self.tensors['unsup_loss']
       # self.train_ops['train_unsup_loss'] = optimize(unsup_loss, 0.1*FLAGS.lrn_rate, decay_steps=None)
 
+  def build_train_n_steps(self, data_iter, num_steps):
+    '''`num_steps` optimizer steps per session.run, each pulling its own 
+    batch from `data_iter`; fetch tensors['n_steps_loss'], ['n_steps_acc']
+    '''
+    def train_step():
+      with tf.variable_scope(self.scope, reuse=True):
+        loss, acc, _ = self.semeval_loss(data_iter.get_next())
+      train_op = apply_gradients(self.optimizer, loss, self.global_step)
+      return train_op, loss, acc
+
+    with tf.name_scope('train_n_steps'):
+      loss, acc = train_n_steps(train_step, num_steps)
+    self.tensors['n_steps_loss'] = loss
+    self.tensors['n_steps_acc'] = acc
+
 def build_train_valid_model(model_name, word_embed, 
                             train_data, test_data, unsup_data,
                             is_adv, is_test):
@@ -63,7 +63,8 @@ class CNNModel(BaseModel):
 
     # # entitiy attention
     entities = self.slice_entity(inputs, ent_pos, length)
-    scaled_entities = multihead_attention(entities, inputs, None, self.embed_dim, 
+    bias = attention_bias_lengths(length, tf.shape(inputs)[1])
+    scaled_entities = multihead_attention(entities, inputs, bias, self.embed_dim, 
                                   self.embed_dim, self.embed_dim, 10, reuse=tf.AUTO_REUSE,
                                   name='ent-mh-att')
     conv_ent = tf.nn.relu(scaled_entities)
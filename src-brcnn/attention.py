@@ -49,6 +49,7 @@ def multihead_attention(query_antecedent,
                         output_depth,
                         num_heads,
                         dropout_rate=0.0,
+                        memory_static=None,
                         reuse=None,
                         name=None):
   """Multihead scaled-dot-product attention with input/output transformations.
@@ -56,12 +57,15 @@ def multihead_attention(query_antecedent,
   Args:
     query_antecedent: a Tensor with shape [batch, length_q, channels]
     memory_antecedent: a Tensor with shape [batch, length_m, channels] or None
-    bias: bias Tensor (see attention_bias())
+    bias: bias Tensor (see attention_bias_lengths())
     total_key_depth: an integer
     total_value_depth: an integer
     output_depth: an integer
     num_heads: an integer dividing total_key_depth and total_value_depth
     dropout_rate: a floating point number
+    memory_static: optional dict from precompute_memory_kv(). When given,
+      memory_antecedent holds only the leading memory channels and the
+      projection of the trailing channels is taken from the dict.
     name: an optional string.
 
   Returns:
@@ -87,7 +91,8 @@ def multihead_attention(query_antecedent,
       default_name="multihead_attention",
       values=[query_antecedent, memory_antecedent]):
     q, k, v = compute_qkv(query_antecedent, memory_antecedent, total_key_depth,
-                          total_value_depth, reuse=reuse)
+                          total_value_depth, memory_static=memory_static,
+                          reuse=reuse)
 
     q = split_heads(q, num_heads)
     k = split_heads(k, num_heads)
@@ -103,29 +108,117 @@ def multihead_attention(query_antecedent,
     return x
 
 
+def _kernel(name, input_depth, output_depth, dtype=tf.float32, reuse=None):
+  '''the kernel of a bias-free tf.layers.dense named `name`, float32
+  variables read in `dtype` under float32_master_getter'''
+  with tf.variable_scope(name, reuse=reuse):
+    return tf.get_variable("kernel", [input_depth, output_depth], dtype=dtype)
+
+
+def _dense(inputs, kernel):
+  '''[..., input_depth] x [input_depth, output_depth] as a single matmul'''
+  inputs_shape = shape_list(inputs)
+  outputs = tf.matmul(tf.reshape(inputs, [-1, inputs_shape[-1]]), kernel)
+  return tf.reshape(outputs, inputs_shape[:-1] + [shape_list(kernel)[-1]])
+
+
+def precompute_memory_kv(memory_static,
+                         memory_depth,
+                         total_key_depth,
+                         total_value_depth,
+                         reuse=None,
+                         name=None):
+  """Projects the trailing, unchanging channels of the memory once.
+
+  Inputs like the position embeddings are identical across the clean and the
+  adversarial passes, so their share of the key/value projection only needs to
+  be computed once and can be fed to every multihead_attention() call.
+
+  Args:
+    memory_static: a Tensor with shape [batch, length_m, static_channels]
+    memory_depth: an integer, channels of the full memory
+    total_key_depth: an integer
+    total_value_depth: an integer
+    name: must match the name of the multihead_attention() calls.
+  Returns:
+    a dict to be passed as memory_static to multihead_attention()
+  """
+  with tf.variable_scope(name, default_name="multihead_attention",
+                         values=[memory_static]):
+    static_depth = shape_list(memory_static)[-1]
+    kernel = tf.concat([
+        _kernel("k", memory_depth, total_key_depth, memory_static.dtype,
+                reuse=reuse),
+        _kernel("v", memory_depth, total_value_depth, memory_static.dtype,
+                reuse=reuse)], axis=1)
+    kv = _dense(memory_static, kernel[memory_depth - static_depth:])
+    return {"kv": kv, "depth": static_depth}
+
+
 def compute_qkv(query_antecedent,
                 memory_antecedent,
                 total_key_depth,
                 total_value_depth,
+                memory_static=None,
                 reuse=None):
   """Computes query, key and value.
 
+  Key and value share one matmul over the memory; for self-attention the query
+  joins it as well. The kernels keep the names of the "q", "k" and "v" dense
+  layers, so existing checkpoints still restore.
+
   Args:
     query_antecedent: a Tensor with shape [batch, length_q, channels]
     memory_antecedent: a Tensor with shape [batch, length_m, channels]
     total_key_depth: an integer
     total_value_depth: and integer
+    memory_static: optional dict from precompute_memory_kv()
   Returns:
     q, k, v : [batch, length, depth] tensors
   """
+  query_depth = shape_list(query_antecedent)[-1]
+  dtype = query_antecedent.dtype
   if memory_antecedent is None:
-    memory_antecedent = query_antecedent
-  
-  q = tf.layers.dense(query_antecedent, total_key_depth, use_bias=False, name="q", reuse=reuse)
-  k = tf.layers.dense(memory_antecedent, total_key_depth, use_bias=False, name="k", reuse=reuse)
-  v = tf.layers.dense(memory_antecedent, total_value_depth, use_bias=False, name="v", reuse=reuse)
+    w_q = _kernel("q", query_depth, total_key_depth, dtype, reuse=reuse)
+    w_k = _kernel("k", query_depth, total_key_depth, dtype, reuse=reuse)
+    w_v = _kernel("v", query_depth, total_value_depth, dtype, reuse=reuse)
+    qkv = _dense(query_antecedent, tf.concat([w_q, w_k, w_v], axis=1))
+    return tf.split(qkv, [total_key_depth, total_key_depth, total_value_depth],
+                    axis=-1)
+
+  dynamic_depth = shape_list(memory_antecedent)[-1]
+  memory_depth = dynamic_depth
+  if memory_static is not None:
+    memory_depth += memory_static["depth"]
+
+  w_q = _kernel("q", query_depth, total_key_depth, dtype, reuse=reuse)
+  w_k = _kernel("k", memory_depth, total_key_depth, dtype, reuse=reuse)
+  w_v = _kernel("v", memory_depth, total_value_depth, dtype, reuse=reuse)
+  q = _dense(query_antecedent, w_q)
+  w_kv = tf.concat([w_k, w_v], axis=1)
+  if memory_static is not None:
+    w_kv = w_kv[:dynamic_depth]
+  kv = _dense(memory_antecedent, w_kv)
+  if memory_static is not None:
+    kv += memory_static["kv"]
+  k, v = tf.split(kv, [total_key_depth, total_value_depth], axis=-1)
   return q, k, v
 
+
+def attention_bias_lengths(length, max_length, dtype=tf.float32):
+  '''bias that keeps the attention off the padded memory positions
+
+  Args:
+    length: [batch] valid length of each memory
+    max_length: the padded memory length
+    dtype: dtype of the attention logits
+  Returns:
+    a Tensor with shape [batch, 1, 1, max_length]
+  '''
+  mask = tf.sequence_mask(length, max_length, dtype=dtype)
+  bias = (1.0 - mask) * -min(1e9, dtype.max)
+  return tf.expand_dims(tf.expand_dims(bias, axis=1), axis=1)
+
 def dot_product_attention(q,
                           k,
                           v,
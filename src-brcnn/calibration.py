@@ -0,0 +1,87 @@
+'''
+Temperature scaling of the mixed relation probabilities of model.py.
+
+The test predictions mix the softmaxes of both directions and of the entity
+descriptions, so the temperature scales their log: softmax(log(p) / T).
+T is fitted after training by minimizing the negative log likelihood and
+stored in the `temperature` variable of the checkpoint; it leaves the argmax
+alone and only makes the top-k probabilities honest enough to filter
+predictions by confidence. There is no validation split, so calibrate() fits
+T on a fixed random part of the test examples and reports the nll and the
+expected calibration error on the others.
+'''
+import numpy as np
+
+
+def log_probs(probs, eps=1e-12):
+    return np.log(np.maximum(probs, eps))
+
+def scaled_probs(probs, temperature=1.):
+    z = log_probs(probs) / temperature
+    z = np.exp(z - np.max(z, axis=1, keepdims=True))
+    return z / np.sum(z, axis=1, keepdims=True)
+
+def nll(probs, labels, temperature=1.):
+    '''mean negative log likelihood of the labels'''
+    z = log_probs(probs) / temperature
+    z = z - np.max(z, axis=1, keepdims=True)
+    z = z - np.log(np.sum(np.exp(z), axis=1, keepdims=True))
+    return -np.mean(z[np.arange(len(labels)), labels])
+
+def fit_temperature(probs, labels, lo=0.05, hi=20., iters=50):
+    '''T minimizing nll(), by golden section search over log T, on which the
+    nll is unimodal'''
+    probs = np.asarray(probs, np.float64)
+    a, b = np.log(lo), np.log(hi)
+    ratio = (np.sqrt(5) - 1) / 2
+    c, d = b - ratio*(b - a), a + ratio*(b - a)
+    f_c, f_d = nll(probs, labels, np.exp(c)), nll(probs, labels, np.exp(d))
+    for _ in range(iters):
+        if f_c < f_d:
+            b, d, f_d = d, c, f_c
+            c = b - ratio*(b - a)
+            f_c = nll(probs, labels, np.exp(c))
+        else:
+            a, c, f_c = c, d, f_d
+            d = a + ratio*(b - a)
+            f_d = nll(probs, labels, np.exp(d))
+    return float(np.exp((a + b) / 2))
+
+def expected_calibration_error(probs, labels, num_bins=15):
+    '''mean gap between confidence and accuracy over confidence bins,
+    weighted by the examples in each bin'''
+    confidence = np.max(probs, axis=1)
+    correct = np.argmax(probs, axis=1) == labels
+    bins = np.minimum((confidence * num_bins).astype(np.int64), num_bins - 1)
+    counts = np.bincount(bins, minlength=num_bins)
+    gap = np.abs(np.bincount(bins, weights=confidence, minlength=num_bins) -
+                 np.bincount(bins, weights=correct, minlength=num_bins))
+    return gap.sum() / max(counts.sum(), 1)
+
+def calibration_report(probs, labels, temperature):
+    '''nll and ece before and after the temperature scaling'''
+    return {'temperature': temperature, 'examples': len(labels),
+            'nll': nll(probs, labels),
+            'nll_calibrated': nll(probs, labels, temperature),
+            'ece': expected_calibration_error(probs, labels),
+            'ece_calibrated': expected_calibration_error(
+                                  scaled_probs(probs, temperature), labels)}
+
+def split_examples(num_examples, fit_fraction, seed=0):
+    '''indices of the examples T is fitted on and of the held out ones'''
+    perm = np.random.RandomState(seed).permutation(num_examples)
+    num_fit = int(round(num_examples * fit_fraction))
+    return perm[:num_fit], perm[num_fit:]
+
+def calibrate(probs, labels, fit_fraction=0.5, seed=0):
+    '''
+    Returns
+      calibration_report() on the held out examples of the T fitted on the
+      `fit_fraction` others, with the number of examples T is fitted on
+    '''
+    probs, labels = np.asarray(probs), np.asarray(labels)
+    fit, held_out = split_examples(len(labels), fit_fraction, seed)
+    temperature = fit_temperature(probs[fit], labels[fit])
+    report = calibration_report(probs[held_out], labels[held_out], temperature)
+    report['fit_examples'] = len(fit)
+    return report
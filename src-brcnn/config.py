@@ -11,6 +11,7 @@ entity2idfilepath='data/entity2id.txt'
 entity2descfilepath='data/entity2desc_clean_final.txt'
 train_triplet_filepath='data/train_triplet.txt'
 test_triplet_filepath='data/test_triplet.txt'
+data_cache_file = 'data/brcnn_data.npz' # written by preprocess.py
 
 num_epochs = 300
 word_embd_dim = 300
@@ -21,6 +22,7 @@ word_state_size = 200
 convolution_state_size = 200
 dep_state_size = 50
 BATCH_SIZE = 100
+bucket_boundaries = [] # path lengths splitting the training batches into buckets, e.g. [5, 7, 9]; [] batches in shuffled order
 lambda_l2 = 0.00002 #3
 
 desc_lambda_l2=0.0012
@@ -31,11 +33,19 @@ dropout_desc_keep=0.8
 decay_steps = 480
 decay_rate = 0.96
 alpha = 0.66
+top_k = 3 # relations, with their temperature scaled probabilities, in model['top_ids'] and model['top_probs']
+calibration_split = 0.5 # part of the test examples the temperature is fitted on, its scores are reported on the others
 win_size = 9
 shuffle = True
 pos = True
 senna = False
 directed = True
+fused_lstm = False # LSTMBlockFusedCell instead of BasicLSTMCell + dynamic_rnn
+precision = "float32" # or "float16": half precision math, float32 master weights
+profile_steps = 0 # training steps traced by profiler.StepProfiler, 0 disables it
+profile_start = 10 # training steps before the trace
+profile_top_n = 20
+profile_dir = 'profile'
 
 
 desc_filter_size=3 # the window size that used in entity description
@@ -147,55 +147,54 @@ def get_en_to_desc_id(train_en1_id,train_en2_id,enid2desc_id):
         en2_to_desc_id.append(enid2desc_id[eid])
     return en1_to_desc_id,en2_to_desc_id
 
-def get_entity_to_descid(tripletfilepath,entity2id,entityid2desc_dict, word2id,id2word,is_training=True):
-    en1_to_desc_id=[]
-    en2_to_desc_id = []
+def load_triplet_entities(tripletfilepath,entity2id):
+    """
+    load the entity ids of the triplets
+    :param tripletfilepath: file path, lines of "en1\trelation\ten2"
+    :return: the ids of the first and of the second entities
+    """
+    en1_ids=[]
+    en2_ids=[]
 
     tripletfile=open(tripletfilepath,'r')
     for line in tripletfile:
         line=line.strip('\n').split('\t')
-        en1=line[0]
-        en2=line[2]
-        if  entity2id[en1] in entityid2desc_dict :
-            desc=entityid2desc_dict[entity2id[en1]]
-            desc_id=[]
-            for w in desc:
-                if is_training:
-                    if w not in word2id:
-                        word2id[w]=len(word2id)
-                        id2word[len(id2word)]=w
-                    desc_id.append(word2id[w])
-                else:
-                    if w  not in  word2id:
-                        w='UNKNOWN_TOKEN'
-                    desc_id.append(word2id[w])
-
-            en1_to_desc_id.append(desc_id)
-        else:
-            raise Exception('the entity: %s not exist in entityid2desc_dict dic'.format(en1))
-
-        if entity2id[en2] in entityid2desc_dict:
-            desc=entityid2desc_dict[entity2id[en2]]
-            desc_id=[]
-            for w in desc:
-                if is_training:
-                    if w not in  word2id:
-                        word2id[w]=len(word2id)
-                        id2word[len(id2word)]=w
-                    desc_id.append(word2id[w])
-                else:
-                    if w not in  word2id:
-                        w='UNKNOWN_TOKEN'
-                    desc_id.append(word2id[w])
-
-            en2_to_desc_id.append(desc_id)
-        else:
-            raise Exception('the entity: %s not exist in enid2desc_id dic'.format(en2))
-
+        en1_ids.append(entity2id[line[0]])
+        en2_ids.append(entity2id[line[2]])
     tripletfile.close()
-    en1_to_desc_id=np.array(en1_to_desc_id)
-    en2_to_desc_id = np.array(en2_to_desc_id)
-    return en1_to_desc_id,en2_to_desc_id
-
+    return np.array(en1_ids,dtype=np.int32),np.array(en2_ids,dtype=np.int32)
 
+def get_desc_ids(desc,word2id,is_training=True):
+    """
+    word ids of a padded description, training adds the unseen words to word2id
+    """
+    desc_id=[]
+    for w in desc:
+        if w not in word2id:
+            if is_training:
+                word2id[w]=len(word2id)
+            else:
+                w='UNKNOWN_TOKEN'
+        desc_id.append(word2id[w])
+    return desc_id
 
+def get_entity_descs(entityid2desc_dict,word2id,train_entity_ids):
+    """
+    the description word ids of every entity, one row per entity id
+    :param train_entity_ids: entities of the training triplets in the order
+        they appear, their descriptions add words to word2id
+    :return: [num_entities, max_entity_desc_length] array
+    """
+    num_entities=max(entityid2desc_dict)+1
+    desc_len=len(next(iter(entityid2desc_dict.values())))
+    entity_descs=np.zeros([num_entities,desc_len],dtype=np.int32)
+    encoded=set()
+    for eid in train_entity_ids:
+        if eid not in encoded:
+            entity_descs[eid]=get_desc_ids(entityid2desc_dict[eid],word2id,is_training=True)
+            encoded.add(eid)
+    # the other entities only map to known words
+    for eid,desc in entityid2desc_dict.items():
+        if eid not in encoded:
+            entity_descs[eid]=get_desc_ids(desc,word2id,is_training=False)
+    return entity_descs
@@ -0,0 +1,380 @@
+'''
+Preprocessing of the BRCNN inputs, cached in one .npz file.
+
+  data = load_data()
+  data.inputs('train'), data.embeddings, data.relations
+
+The first run builds the vocabularies, the padded path id matrices and the
+entity description ids from the pickled shortest dependency paths and writes
+them to `data_cache_file`; later runs only load the arrays. The cache is
+rebuilt when a setting it depends on changes, or with
+
+  python preprocess.py
+
+and `python preprocess.py --timing` compares the path id mapping against
+the token by token loops it replaced.
+'''
+import sys
+import json
+import time
+import pickle
+import numpy as np
+
+from config import *
+from desc_utils import *
+
+pad_word = "<pad>"
+unknown_token = "UNKNOWN_TOKEN"
+
+# per split, in the order of the input pipeline
+# en1_ids and en2_ids index the rows of entity_descs
+INPUTS = ('path_len', 'word_ids', 'pos_ids', 'dep_ids', 'dep_ids_reverse',
+          'en1_ids', 'en2_ids', 'rel_ids')
+
+
+class RelationData(object):
+    '''the cached arrays as attributes'''
+
+    def __init__(self, arrays):
+        for name, value in arrays.items():
+            setattr(self, name, value)
+        self.word_vocab_size = len(self.words)
+        self.pos_vocab_size = len(self.pos_tags)
+        self.dep_vocab_size = len(self.deps)
+        self.max_len_path = self.train_word_ids.shape[1]
+
+    def inputs(self, split):
+        '''the INPUTS arrays of the 'train' or 'test' split'''
+        return tuple(getattr(self, '%s_%s' % (split, name)) for name in INPUTS)
+
+    def num_examples(self, split):
+        return len(getattr(self, split + '_rel_ids'))
+
+
+def settings():
+    '''the config values the cache depends on'''
+    return json.dumps({'directed': directed, 'senna': senna,
+                       'word_embd_dim': word_embd_dim,
+                       'max_entity_desc_length': max_entity_desc_length,
+                       'inputs': INPUTS},
+                      sort_keys=True)
+
+def load_data(cache_file=data_cache_file, rebuild=False):
+    '''
+    Returns
+      RelationData, built and cached when `cache_file` is missing or stale
+    '''
+    if not rebuild:
+        try:
+            with np.load(cache_file) as cached:
+                arrays = dict((name, cached[name]) for name in cached.files)
+            if str(arrays.pop('settings')) == settings():
+                return RelationData(arrays)
+            print('%s was built with other settings, rebuilding' % cache_file)
+        except IOError:
+            pass
+    arrays = build_data()
+    np.savez(cache_file, settings=np.array(settings()), **arrays)
+    return RelationData(arrays)
+
+def vocab_list(token2id):
+    '''tokens ordered by id'''
+    return np.array([t for t, _ in sorted(token2id.items(), key=lambda x: x[1])])
+
+def read_ent_pos(path):
+    with open(path) as f:
+        return np.array([[int(x) for x in line.split()] for line in f],
+                        dtype=np.int32)
+
+def tag_vocabs():
+    '''pos tag => id and dependency => id, before the training paths add to
+    them'''
+    pos_tags_vocab = []
+    for line in open(data_dir + '/pos_tags.txt'):
+        pos_tags_vocab.append(line.strip())
+
+    dep_vocab = []
+    for line in open(data_dir + '/dependency_types.txt'):
+        dep_vocab.append(line.strip())
+
+    pos_tag2id = dict((w, i+1) for i,w in enumerate(pos_tags_vocab))
+    if not directed:
+        dep2id = dict((w, i+1) for i,w in enumerate(dep_vocab))
+    else:
+        dep2id = dict(('l'+w, i+1) for i,w in enumerate(dep_vocab))
+        dep2id.update(dict(('r'+w, len(dep_vocab)+i+1) for i,w in enumerate(dep_vocab)))
+
+    pos_tag2id[pad_word] = 0
+    dep2id[pad_word] = 0
+    pos_tag2id['OTH'] = len(pos_tag2id)
+    dep2id['OTH'] = len(dep2id)
+    return pos_tag2id, dep2id
+
+def load_paths():
+    '''(words, deps, pos tags) of the train and of the test shortest
+    dependency paths'''
+    if not directed:
+        paths_file, test_paths_file = 'train_paths', 'test_paths'
+    else:
+        paths_file, test_paths_file = 'vdir/directed_train_paths', 'vdir/directed_test_paths'
+    with open(data_dir + '/' + paths_file, 'rb') as f:
+        train = pickle.load(f)
+    with open(data_dir + '/' + test_paths_file, 'rb') as f:
+        test = pickle.load(f)
+    return train, test
+
+# fine pos tag => coarse tag, pos_ids hold the coarse tag ids and 0 for the
+# other tags
+COARSE_POS_TAGS = {'JJ': 'JJ', 'JJR': 'JJ', 'JJS': 'JJ',
+                   'NN': 'NN', 'NNS': 'NN', 'NNP': 'NN', 'NNPS': 'NN',
+                   'RB': 'RB', 'RBR': 'RB', 'RBS': 'RB',
+                   'PRP': 'PRP', 'PRP$': 'PRP',
+                   'VB': 'VB', 'VBD': 'VB', 'VBG': 'VB', 'VBN': 'VB',
+                   'VBP': 'VB', 'VBZ': 'VB',
+                   'CC': 'CC', 'CD': 'CD', 'DT': 'DT', 'IN': 'IN'}
+
+def coarse_pos_ids(pos_tag2id):
+    '''pos tag id => id of its coarse tag'''
+    table = np.zeros(max(pos_tag2id.values())+1, dtype=np.int32)
+    for tag, idx in pos_tag2id.items():
+        if tag in COARSE_POS_TAGS:
+            table[idx] = pos_tag2id[COARSE_POS_TAGS[tag]]
+    return table
+
+def reverse_dep_ids(dep2id):
+    '''dep id => id of the same dependency in the other direction, all 0
+    for undirected paths'''
+    table = np.zeros(max(dep2id.values())+1, dtype=np.int32)
+    if directed:
+        flip = {'l': 'r', 'r': 'l'}
+        for d, idx in dep2id.items():
+            table[idx] = dep2id[flip[d[0]]+d[1:]] if d[:1] in flip else idx
+    return table
+
+def token_ids(seqs, token2id, unknown=None):
+    '''flat ids of the tokens of all the sequences. Without `unknown` new
+    tokens are added to token2id in order of appearance, with it they map to
+    the id of `unknown`'''
+    tokens = [t for seq in seqs for t in seq]
+    if unknown is None:
+        ids = [token2id.setdefault(t, len(token2id)) for t in tokens]
+    else:
+        unknown_id = token2id[unknown]
+        ids = [token2id.get(t, unknown_id) for t in tokens]
+    return np.array(ids, dtype=np.int32)
+
+def padded(flat_ids, lengths, max_len):
+    '''[len(lengths), max_len] matrix of the flat sequences, zero padded'''
+    ids = np.zeros([len(lengths), max_len], dtype=np.int32)
+    ids[np.arange(max_len) < lengths[:, None]] = flat_ids
+    return ids
+
+def seq_lengths(seqs):
+    return np.array([len(seq) for seq in seqs], dtype=np.int32)
+
+def path_ids(word_p, pos_p, dep_p, max_len, word2id, pos_tag2id, dep2id,
+             is_training=True):
+    '''
+    Args
+      word_p, pos_p, dep_p: token lists of the shortest dependency paths
+      is_training: add unseen words, tags and dependencies to the vocabularies,
+                   otherwise they map to UNKNOWN_TOKEN and OTH
+    Returns
+      the path lengths and the padded word, coarse pos, dep and reversed dep
+      ids
+    '''
+    path_len = seq_lengths(word_p)
+    words = [[w.lower() for w in seq] for seq in word_p]
+    word_ids = token_ids(words, word2id, None if is_training else unknown_token)
+    pos_ids = token_ids(pos_p, pos_tag2id, None if is_training else 'OTH')
+    dep_ids = token_ids(dep_p, dep2id, None if is_training else 'OTH')
+    # the tables cover the tags and dependencies added above
+    pos_ids = coarse_pos_ids(pos_tag2id)[pos_ids]
+    dep_ids_reverse = reverse_dep_ids(dep2id)[dep_ids]
+
+    dep_len = seq_lengths(dep_p)
+    return (path_len, padded(word_ids, path_len, max_len),
+            padded(pos_ids, seq_lengths(pos_p), max_len),
+            padded(dep_ids, dep_len, max_len),
+            padded(dep_ids_reverse, dep_len, max_len))
+
+def loop_path_ids(word_p, pos_p, dep_p, max_len, word2id, pos_tag2id, dep2id,
+                  is_training=True):
+    '''path_ids() with the token by token loops it replaced, for timing'''
+    def pos_tag(x):
+        if x in ['JJ', 'JJR', 'JJS']:
+            return pos_tag2id['JJ']
+        if x in ['NN', 'NNS', 'NNP', 'NNPS']:
+            return pos_tag2id['NN']
+        if x in ['RB', 'RBR', 'RBS']:
+            return pos_tag2id['RB']
+        if x in ['PRP', 'PRP$']:
+            return pos_tag2id['PRP']
+        if x in ['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ']:
+            return pos_tag2id['VB']
+        if x in ['CC', 'CD', 'DT', 'IN']:
+            return pos_tag2id[x]
+        else:
+            return 0
+
+    length = len(word_p)
+    word_p_ids = np.zeros([length, max_len],dtype=np.int32)
+    pos_p_ids = np.zeros([length, max_len],dtype=np.int32)
+    dep_p_ids = np.zeros([length, max_len],dtype=np.int32)
+    dep_p_ids_reverse = np.zeros([length, max_len],dtype=np.int32)
+    for i in range(length):
+        for j, w in enumerate(word_p[i]):
+            w = w.lower()
+            if w not in word2id:
+                if is_training:
+                    word2id[w] = len(word2id)
+                else:
+                    w = unknown_token
+            word_p_ids[i][j] = word2id[w]
+        for j, p in enumerate(pos_p[i]):
+            if p not in pos_tag2id:
+                if is_training:
+                    pos_tag2id[p] = len(pos_tag2id)
+                else:
+                    p = 'OTH'
+            pos_p_ids[i][j] = pos_tag(p)
+        for j, d in enumerate(dep_p[i]):
+            if d not in dep2id:
+                if is_training:
+                    dep2id[d] = len(dep2id)
+                else:
+                    d = 'OTH'
+            dep_p_ids[i][j] = dep2id[d]
+            if directed:
+                if d.startswith('l'):
+                    dep_p_ids_reverse[i][j] = dep2id['r'+d[1:]]
+                elif d.startswith('r'):
+                    dep_p_ids_reverse[i][j] = dep2id['l'+d[1:]]
+                else:
+                    dep_p_ids_reverse[i][j] = dep2id[d]
+    return (seq_lengths(word_p), word_p_ids, pos_p_ids, dep_p_ids,
+            dep_p_ids_reverse)
+
+def time_path_ids(repeat=3):
+    '''times path_ids() against loop_path_ids() on the train and test paths
+    and checks they agree'''
+    (word_p, dep_p, pos_p), (word_p_test, dep_p_test, pos_p_test) = load_paths()
+    max_len = max(len(w) for w in word_p + word_p_test)
+    num_tokens = sum(len(w) for w in word_p + word_p_test)
+    results = {}
+    for name, fn in [('loops', loop_path_ids), ('path_ids', path_ids)]:
+        best = float('inf')
+        for _ in range(repeat):
+            # fresh vocabularies, the training paths add to them
+            word2id = {pad_word: 0, unknown_token: 1}
+            pos_tag2id, dep2id = tag_vocabs()
+            start = time.time()
+            ids = (fn(word_p, pos_p, dep_p, max_len, word2id, pos_tag2id, dep2id) +
+                   fn(word_p_test, pos_p_test, dep_p_test, max_len, word2id, pos_tag2id, dep2id, False))
+            best = min(best, time.time() - start)
+        results[name] = ids
+        print('%-8s %.3fs %.0f tokens/sec' % (name, best, num_tokens / best))
+    same = all(np.array_equal(a, b) for a, b in zip(results['loops'], results['path_ids']))
+    print('same ids' if same else 'the ids differ')
+    return same
+
+def build_data():
+    '''
+    Returns
+      dict of name => array, the vocabularies, the word embeddings, the
+      entity descriptions and the INPUTS of both splits prefixed with
+      'train_' and 'test_'
+    '''
+    embeddings = []
+    word2id = {}
+    word2id[pad_word] = 0
+    embeddings.append([0 for i in range(word_embd_dim)])
+
+    if not senna:
+        with open(data_dir + '/extract_embed_300d.pkl', 'rb') as f:
+            word2vec = pickle.load(f)
+        for word in word2vec:
+            embeddings.append(word2vec[word])
+            word2id[word] = len(word2id)
+    else:
+        wordlist=open(data_dir + '/senna/words.lst',"r").readlines()
+        allword_embedding=open(data_dir + '/senna/embeddings.txt',"r").readlines()
+
+        for wid in range(len(wordlist)):
+            word=wordlist[wid].strip()
+            one_embedding=allword_embedding[wid].strip().split()
+            embeddings.append(one_embedding)
+            word2id[word]=wid+1
+
+    relation_vocab = []
+    for line in open(data_dir + '/relation_types.txt'):
+        relation_vocab.append(line.strip())
+    rel2id = dict((w, i) for i,w in enumerate(relation_vocab))
+
+    pos_tag2id, dep2id = tag_vocabs()
+
+    (word_p, dep_p, pos_p), (word_p_test, dep_p_test, pos_p_test) = load_paths()
+
+    init_vocab_count = len(word2id)
+    word2id[unknown_token] = init_vocab_count
+
+    relations = []
+    for line in open(data_dir + '/train_relations.txt'):
+        relations.append(line.strip().split()[1])
+
+    max_len_path = max(len(w) for w in word_p + word_p_test)
+    train = path_ids(word_p, pos_p, dep_p, max_len_path,
+                     word2id, pos_tag2id, dep2id, is_training=True)
+    rel_ids = np.array([rel2id[rel] for rel in relations], dtype=np.int64)
+
+    # entity descriptions
+    entity2id = load_entity2id(entity2idfilepath)
+    entityid2desc_dict=load_entity_desc(entity2descfilepath,entity2id)
+    pad_descs(entityid2desc_dict, max_entity_desc_length, pad_word)
+    train_en1_ids, train_en2_ids = load_triplet_entities(train_triplet_filepath, entity2id)
+    test_en1_ids, test_en2_ids = load_triplet_entities(test_triplet_filepath, entity2id)
+    # one description per entity, the training ones add their words in
+    # triplet order
+    train_entities = np.stack([train_en1_ids, train_en2_ids], axis=1).ravel()
+    entity_descs = get_entity_descs(entityid2desc_dict, word2id, train_entities)
+
+    # words without a pretrained vector start random, the draw is cached
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    miss_embe_count = len(word2id)-init_vocab_count
+    miss_embeddings = np.random.uniform(-0.01,0.01,[miss_embe_count, word_embd_dim] )
+    embeddings = np.vstack((embeddings, miss_embeddings.astype(np.float32)))
+
+    relations_test = []
+    for line in open(data_dir + '/test_relations.txt'):
+        relations_test.append(line.strip().split()[0])
+
+    test = path_ids(word_p_test, pos_p_test, dep_p_test, max_len_path,
+                    word2id, pos_tag2id, dep2id, is_training=False)
+    rel_ids_test = np.array([rel2id[rel] for rel in relations_test], dtype=np.int64)
+
+    arrays = {
+        'words': vocab_list(word2id),
+        'pos_tags': vocab_list(pos_tag2id),
+        'deps': vocab_list(dep2id),
+        'relations': np.array(relation_vocab),
+        'embeddings': embeddings,
+        'entity_descs': entity_descs,
+        # entity positions of the attention variants
+        'train_ent_pos': read_ent_pos('train_ent_pos.txt'),
+        'test_ent_pos': read_ent_pos('test_ent_pos.txt'),
+    }
+    train += (train_en1_ids, train_en2_ids, rel_ids)
+    test += (test_en1_ids, test_en2_ids, rel_ids_test)
+    for split, values in [('train', train), ('test', test)]:
+        for name, value in zip(INPUTS, values):
+            arrays['%s_%s' % (split, name)] = value
+    return arrays
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--timing']:
+        sys.exit(0 if time_path_ids() else 1)
+    start = time.time()
+    data = load_data(rebuild=True)
+    print("word_vocab_size=%d\npos_vocab_size=%d\ndep_vocab_size=%d\nmax_len_path=%d"%(data.word_vocab_size, data.pos_vocab_size, data.dep_vocab_size, data.max_len_path))
+    print('wrote %s in %.1fs' % (data_cache_file, time.time() - start))
@@ -0,0 +1,192 @@
+'''
+The SemEval-2010 task 8 scorer (semeval2010_task8_scorer-v1.2.pl) computed
+from a confusion matrix in memory.
+
+  scorer = SemEvalScorer(relation_vocab)
+  scores = scorer.score(rel_ids_test, y_pred)
+  f1 = scores['official']['macro_f1']
+
+Like the perl scorer it scores three views of the predictions
+
+  directed    (2*9+1)-way classification
+  undirected  (9+1)-way, directionality ignored
+  official    (9+1)-way, directionality taken into account; a relation with
+              the wrong direction is wrong but still counts as a proposal of
+              its type
+
+each with the accuracy, the micro- and macro-averaged P, R, F1 excluding
+Other and the P, R, F1 of every relation, in percent. Relations missing from
+the answer key are left out of the averages, as the perl scorer does.
+
+Check it against the perl scorer on saved predictions with
+
+  python semeval_scorer.py data/prediction_result.txt data/real_result.txt \
+      data/semeval2010_task8_scorer-v1.2.pl
+'''
+import re
+import sys
+import subprocess
+import numpy as np
+
+OTHER = 'Other'
+VIEWS = [('directed', '(2*9+1)-WAY EVALUATION (USING DIRECTIONALITY)'),
+         ('undirected', '(9+1)-WAY EVALUATION IGNORING DIRECTIONALITY'),
+         ('official', '(9+1)-WAY EVALUATION TAKING DIRECTIONALITY INTO ACCOUNT'
+                      ' -- OFFICIAL')]
+
+
+class SemEvalScorer(object):
+
+    def __init__(self, relations):
+        '''
+        Args
+          relations: relation names by label id, e.g. Cause-Effect(e1,e2)
+        '''
+        self.relations = list(relations)
+        types = [rel.split('(')[0] for rel in self.relations]
+        # Other is the last type
+        self.types = sorted(set(types) - set([OTHER])) + [OTHER]
+        type_ids = [self.types.index(t) for t in types]
+        # label id x type, sums the directions of a type
+        self.label_to_type = np.eye(len(self.types), dtype=np.int64)[type_ids]
+        self.label_is_other = np.array([t == OTHER for t in types])
+        self.type_is_other = np.array([t == OTHER for t in self.types])
+
+    def confusion_matrix(self, y_true, y_pred):
+        '''counts of answer label (row) by proposed label (column)'''
+        n = len(self.relations)
+        y_true = np.asarray(y_true, np.int64)
+        y_pred = np.asarray(y_pred, np.int64)
+        counts = np.bincount(y_true * n + y_pred, minlength=n * n)
+        return counts.reshape(n, n)
+
+    def score(self, y_true, y_pred):
+        '''
+        Returns
+          dict of view => scores, see the module doc
+        '''
+        confusion = self.confusion_matrix(y_true, y_pred)
+        return self.score_confusion(confusion)
+
+    def score_confusion(self, confusion):
+        collapsed = self.label_to_type.T.dot(confusion).dot(self.label_to_type)
+        # right type and right direction
+        exact = self.label_to_type.T.dot(np.diag(confusion))
+        return {
+            'directed': _scores(np.diag(confusion), confusion.sum(0),
+                                confusion.sum(1), self.relations,
+                                self.label_is_other),
+            'undirected': _scores(np.diag(collapsed), collapsed.sum(0),
+                                  collapsed.sum(1), self.types,
+                                  self.type_is_other),
+            'official': _scores(exact, collapsed.sum(0), collapsed.sum(1),
+                                self.types, self.type_is_other),
+        }
+
+
+def _div(a, b):
+    a = np.asarray(a, np.float64)
+    b = np.asarray(b, np.float64)
+    return np.divide(a, b, out=np.zeros_like(a), where=b > 0)
+
+def _f1(p, r):
+    return _div(2 * p * r, p + r)
+
+def _scores(correct, proposed, answer, names, is_other):
+    '''scores of one view from the per class counts'''
+    p = 100 * _div(correct, proposed)
+    r = 100 * _div(correct, answer)
+    f1 = _f1(p, r)
+
+    scored = (answer > 0) & ~is_other
+    micro_p = 100 * _div(correct[scored].sum(), proposed[scored].sum())
+    micro_r = 100 * _div(correct[scored].sum(), answer[scored].sum())
+    mean = lambda x: float(np.mean(x[scored])) if scored.any() else 0.
+    return {
+        'accuracy': float(100 * _div(correct.sum(), answer.sum())),
+        'micro_p': float(micro_p),
+        'micro_r': float(micro_r),
+        'micro_f1': float(_f1(micro_p, micro_r)),
+        'macro_p': mean(p),
+        'macro_r': mean(r),
+        'macro_f1': mean(f1),
+        'relations': dict((name, (p[i], r[i], f1[i]))
+                          for i, name in enumerate(names) if answer[i] > 0),
+    }
+
+def report(scores):
+    '''the scores as text, laid out like the perl scorer output'''
+    lines = []
+    for view, title in VIEWS:
+        s = scores[view]
+        lines.append('<<< %s >>>:' % title)
+        lines.append('Accuracy = %5.2f%%' % s['accuracy'])
+        for name, (p, r, f1) in sorted(s['relations'].items()):
+            lines.append('%25s :    P = %6.2f%%     R = %6.2f%%     F1 = %6.2f%%'
+                         % (name, p, r, f1))
+        lines.append('Micro-averaged result (excluding Other):')
+        lines.append('P = %6.2f%%     R = %6.2f%%     F1 = %6.2f%%'
+                     % (s['micro_p'], s['micro_r'], s['micro_f1']))
+        lines.append('MACRO-averaged result (excluding Other):')
+        lines.append('P = %6.2f%%\tR = %6.2f%%\tF1 = %6.2f%%'
+                     % (s['macro_p'], s['macro_r'], s['macro_f1']))
+        lines.append('')
+    lines.append('<<< The official score is (9+1)-way evaluation with '
+                 'directionality taken into account: macro-averaged F1 = '
+                 '%0.2f%% >>>' % scores['official']['macro_f1'])
+    return '\n'.join(lines) + '\n'
+
+def read_answers(path):
+    '''dict of sentence id => relation of a "<ID>\\t<RELATION>" file'''
+    answers = {}
+    for line in open(path):
+        if line.strip():
+            sent_id, relation = line.split()
+            answers[sent_id] = relation
+    return answers
+
+def perl_macro_f1(perl_scorer, proposed_path, answer_path):
+    '''macro-F1 of the three views printed by the perl scorer'''
+    output = subprocess.check_output(
+        ['perl', perl_scorer, proposed_path, answer_path]).decode('utf-8')
+    macro = re.findall(r'MACRO-averaged result \(excluding Other\):\s*'
+                       r'P =\s*[\d.]+%\s*R =\s*[\d.]+%\s*F1 =\s*([\d.]+)%',
+                       output)
+    return dict(zip([view for view, _ in VIEWS], map(float, macro)))
+
+
+def main(argv):
+    if len(argv) not in (3, 4):
+        print('usage: python semeval_scorer.py PROPOSED ANSWER_KEY [SCORER_PL]')
+        return 2
+    proposed = read_answers(argv[1])
+    answer = read_answers(argv[2])
+    missing = set(answer) - set(proposed)
+    if missing:
+        raise ValueError('%d sentences of the answer key have no proposed '
+                         'relation' % len(missing))
+
+    relations = sorted(set(answer.values()) | set(proposed.values()))
+    rel2id = dict((rel, i) for i, rel in enumerate(relations))
+    ids = sorted(answer)
+    y_true = [rel2id[answer[i]] for i in ids]
+    y_pred = [rel2id[proposed[i]] for i in ids]
+    scores = SemEvalScorer(relations).score(y_true, y_pred)
+    sys.stdout.write(report(scores))
+
+    if len(argv) == 4:
+        # the perl scorer prints two decimals
+        perl = perl_macro_f1(argv[3], argv[1], argv[2])
+        mismatch = [view for view, _ in VIEWS
+                    if abs(perl.get(view, -1) - scores[view]['macro_f1']) > 0.01]
+        for view, _ in VIEWS:
+            print('%-10s macro-F1 %6.2f perl %6.2f' %
+                  (view, scores[view]['macro_f1'], perl.get(view, -1)))
+        if mismatch:
+            print('differs from %s: %s' % (argv[3], ', '.join(mismatch)))
+            return 1
+        print('matches %s' % argv[3])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
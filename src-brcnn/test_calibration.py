@@ -0,0 +1,29 @@
+import numpy as np
+from calibration import *
+
+rng = np.random.RandomState(0)
+num_examples, num_classes = 20000, 19
+
+# labels drawn from softmax(z), the mixed probabilities are over-confident
+# as if the logits were scaled by 2.5
+z = rng.normal(scale=2., size=[num_examples, num_classes])
+true_probs = scaled_probs(np.exp(z))
+labels = np.array([rng.choice(num_classes, p=p) for p in true_probs])
+probs = scaled_probs(np.exp(z), 1 / 2.5)
+
+temperature = fit_temperature(probs, labels)
+print('fitted T %.3f, over-scaled by 2.5' % temperature)
+assert abs(temperature - 2.5) < 0.1
+assert np.allclose(scaled_probs(probs, temperature), true_probs, atol=0.02)
+
+report = calibrate(probs, labels)
+print(report)
+assert report['fit_examples'] + report['examples'] == num_examples
+assert report['ece_calibrated'] < 0.02 < report['ece']
+
+# ece of a fixed case: confidence 0.9 but half of them right
+probs = np.array([[0.9, 0.1], [0.9, 0.1], [0.2, 0.8], [0.4, 0.6]])
+labels = np.array([0, 1, 1, 1])
+# bins: 0.9 twice (acc 0.5), 0.8 (acc 1), 0.6 (acc 1)
+expected = (abs(1.8 - 1) + abs(0.8 - 1) + abs(0.6 - 1)) / 4
+assert np.isclose(expected_calibration_error(probs, labels), expected)
@@ -0,0 +1,67 @@
+'''
+Fits the temperature of the best checkpoint, see models/calibration.py.
+
+  python calibrate.py --dataset=semeval
+
+Scores the test records like evaluate.py, fits T on the logits of the
+`calibration_split` part of them and writes it, with the nll and the
+expected calibration error before and after on the held out rest, to
+calibration-<num_classes>.json in the model dir, with the name of the
+checkpoint. The valid, predict and exported models built afterwards on that
+checkpoint return temperature scaled top-k probabilities.
+'''
+import sys
+import json
+import tensorflow as tf
+
+from inputs import dataset, rc_dataset
+from models import cnn_model
+from models.evaluation import run_pass
+from models.calibration import calibrate, write_calibration
+import config as config_lib
+
+flags = tf.app.flags
+flags.DEFINE_enum('dataset', 'semeval', ['semeval', 'nyt'],
+                  'validation set, and hparams, of the calibrated model')
+flags.DEFINE_float('calibration_split', 0.5,
+                   'part of the test examples T is fitted on, the scores '
+                   'are reported on the others')
+flags.DEFINE_integer('seed', 0, 'of the calibration split')
+FLAGS = tf.app.flags.FLAGS
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def main(_):
+  if not 0 < FLAGS.calibration_split < 1:
+    raise ValueError('calibration_split must be in (0, 1)')
+  config = config_lib.get_config()
+  embed = dataset.Embed(config.out_dir, config.trimmed_embed300_file, config.vocab_file)
+  ini_word_embed = embed.load_embedding()
+  if FLAGS.dataset == 'semeval':
+    hparams = config_lib.semeval_hparams()
+    data = rc_dataset.RCRecordData(config.out_dir,
+                config.semeval_train_record, config.semeval_test_record)
+  else:
+    hparams = config_lib.nyt_hparams()
+    data = rc_dataset.RCRecordData(config.out_dir,
+                config.nyt_train_record, config.nyt_test_record)
+
+  with tf.Graph().as_default():
+    test_iter = data.test_data(1, hparams.batch_size)
+    m_valid = cnn_model.build_valid_model(hparams, ini_word_embed,
+                                          test_iter.get_next())
+    init_op = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
+    with tf.Session() as sess:
+      sess.run(init_op)
+      checkpoint = m_valid.restore(sess)
+      arrays = run_pass(sess, test_iter, m_valid.tensors)
+
+  report = calibrate(arrays['logits'], arrays['labels'],
+                     FLAGS.calibration_split, FLAGS.seed)
+  write_calibration(m_valid.save_dir, hparams.num_classes, report, checkpoint)
+  print(json.dumps(report, indent=2))
+  sys.stdout.flush()
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -9,6 +9,7 @@ def _baisc_hparams():
     pos_num             = 123,
     pos_dim             = 5,
     tune_word_embed     = False,
+    precision           = "float32", # or "float16"
     tune_conv           = True,
     kernel_size         = 3,
     num_filters         = 310,
@@ -17,10 +18,14 @@ def _baisc_hparams():
     dropout_rate        = 0.5,
     learning_rate       = 0.001,
     max_norm            = None,
+    steps_per_run       = 1, # training steps run in-graph per session.run
+    num_towers          = 1, # data-parallel replicas, batch_size is split
     max_len             = 97,
+    top_k               = 3, # relations returned by the inference path
     num_train_examples  = 0,
     num_test_examples   = 0,
     log_freq           = 1000,
+    ckpt_freq           = 1000, # batches between checkpoints
     logdir              = "saved_models/",
     save_dir            = "nyt_model"
     )
@@ -33,6 +38,7 @@ def semeval_hparams():
   hparams.num_train_examples = 8000
   hparams.num_test_examples = 2717
   hparams.log_freq = 80
+  hparams.ckpt_freq = 80
   hparams.learning_rate = 0.0001
   # hparams.tune_conv = False
   return hparams
@@ -50,7 +56,7 @@ class Config(object):
   out_dir = "data/generated"
 
   semeval_dir = "data/SemEval"
-  # semeval_relations_file = 'relations.txt'
+  semeval_relations_file = 'relations.txt'
   semeval_train_file = "train.cln"
   semeval_test_file = "test.cln"
   semeval_train_record = "train.semeval.tfrecord"
@@ -58,6 +64,7 @@ class Config(object):
   # semeval_results_file = "results.txt"
 
   nyt_dir = "data/nyt2010"
+  nyt_relations_file = "relation2id.txt"
   nyt_train_file = "train.cln"
   nyt_train_record = "train.nyt.tfrecord"
   nyt_test_file = "test.cln"
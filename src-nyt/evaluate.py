@@ -0,0 +1,103 @@
+'''
+Continuous evaluation of the checkpoints written by main.py.
+
+  python main.py --inline_eval=False &
+  python evaluate.py --dataset=semeval
+
+Waits for new checkpoints in the model dir and scores each on the test set
+in its own process, on a few CPU threads next to the trainer. The best one
+is marked in best_eval.json, CheckpointManager never retires it and
+BaseModel.restore() loads it.
+'''
+import os
+import sys
+import tensorflow as tf
+
+from inputs import dataset, rc_dataset, utils
+from models import cnn_model
+from models.checkpoint import read_best_eval, mark_best_eval, verify_embeddings
+import config as config_lib
+
+flags = tf.app.flags
+flags.DEFINE_enum('dataset', 'semeval', ['semeval', 'nyt'],
+                  'test set, and hparams, of the evaluated model')
+flags.DEFINE_integer('eval_threads', 2, 'CPU threads of the evaluator')
+flags.DEFINE_integer('eval_interval_secs', 10,
+                     'minimum seconds between two evaluations')
+flags.DEFINE_integer('eval_timeout_secs', 3600,
+                     'stop after this long without a new checkpoint')
+FLAGS = tf.app.flags.FLAGS
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def checkpoint_step(ckpt_path):
+  return int(ckpt_path.rsplit('-', 1)[-1])
+
+def evaluate_checkpoints(session, m_valid, test_iter, relations=None):
+  save_dir = m_valid.save_dir
+  verify_embeddings(save_dir, m_valid.embed_refs)
+  writer = tf.summary.FileWriter(os.path.join(save_dir, 'eval'))
+  best = read_best_eval(save_dir)
+  best_acc = best['metric'] if best else 0.
+
+  for ckpt_path in tf.contrib.training.checkpoints_iterator(save_dir,
+                      FLAGS.eval_interval_secs, FLAGS.eval_timeout_secs):
+    try:
+      m_valid.saver.restore(session, ckpt_path)
+    except tf.errors.NotFoundError:
+      # retired by the trainer before we got to it
+      tf.logging.warning('%s is gone, skipped' % ckpt_path)
+      continue
+
+    step = checkpoint_step(ckpt_path)
+    result = m_valid.evaluate(session, test_iter, relations)
+    valid_acc = result.acc*100
+    values = [tf.Summary.Value(tag='valid_acc', simple_value=valid_acc)]
+    if result.macro_f1 is not None:
+      values.append(tf.Summary.Value(tag='valid_f1', 
+                                     simple_value=result.macro_f1*100))
+    writer.add_summary(tf.Summary(value=values), step)
+    writer.flush()
+
+    if best_acc < valid_acc:
+      best_acc = valid_acc
+      mark_best_eval(save_dir, ckpt_path, step, valid_acc)
+    print('%s valid acc %.2f best %.2f' % (ckpt_path, valid_acc, best_acc))
+    sys.stdout.flush()
+  writer.close()
+
+def main(_):
+  config = config_lib.get_config()
+  embed = dataset.Embed(config.out_dir, config.trimmed_embed300_file, config.vocab_file)
+  ini_word_embed = embed.load_embedding()
+
+  relations = None
+  if FLAGS.dataset == 'semeval':
+    hparams = config_lib.semeval_hparams()
+    data = rc_dataset.RCRecordData(config.out_dir,
+                config.semeval_train_record, config.semeval_test_record)
+    relations = utils.load_relations(os.path.join(config.semeval_dir, 
+                                          config.semeval_relations_file))
+  else:
+    hparams = config_lib.nyt_hparams()
+    data = rc_dataset.RCRecordData(config.out_dir,
+                config.nyt_train_record, config.nyt_test_record)
+
+  with tf.Graph().as_default():
+    test_iter = data.test_data(1, hparams.batch_size)
+    m_valid = cnn_model.build_valid_model(hparams, ini_word_embed,
+                                          test_iter.get_next())
+
+    init_op = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
+    # stay off the trainer's GPU and most of its cores
+    sess_config = tf.ConfigProto(device_count={'GPU': 0},
+                            intra_op_parallelism_threads=FLAGS.eval_threads,
+                            inter_op_parallelism_threads=FLAGS.eval_threads)
+
+    with tf.Session(config=sess_config) as sess:
+      sess.run(init_op)
+      evaluate_checkpoints(sess, m_valid, test_iter, relations)
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,101 @@
+'''
+Export of the best checkpoint for serving, see models/export.py.
+
+  python export.py --dataset=semeval --export_dir=exported/semeval
+
+Rebuilds CNNModel for inference alone, restores the weights and writes the
+frozen GraphDef and the SavedModel with the `classify` signature
+
+  inputs   length [batch], ent_pos [batch, 4], sentence, pos1, pos2
+           [batch, len], encoded like the records of gen_data.py
+  outputs  logits, probs [batch, num_classes], pred [batch],
+           top_ids, top_probs [batch, top_k]
+
+the probabilities temperature scaled once calibrate.py ran, then times the
+load of the SavedModel and a one sentence request. With
+--quantize the word embedding is stored in int8 and the kernels in int8 or
+float16, see models/quantize.py and quantize.py for the accuracy drift.
+'''
+import sys
+import numpy as np
+import tensorflow as tf
+
+from inputs import dataset
+from models import cnn_model
+from models.export import export_model, time_classifier
+from models.quantize import KERNEL_MODES, quantize_weights
+import config as config_lib
+
+flags = tf.app.flags
+flags.DEFINE_enum('dataset', 'semeval', ['semeval', 'nyt'],
+                  'hparams of the exported model')
+flags.DEFINE_string('export_dir', 'exported/semeval',
+                    'where the frozen graph and the SavedModel are written')
+flags.DEFINE_enum('quantize', 'none', ['none'] + KERNEL_MODES,
+                  'int8 embedding, and kernels in this type')
+flags.DEFINE_integer('timed_requests', 100,
+                     'requests timed after the export, 0 skips the timing')
+FLAGS = tf.app.flags.FLAGS
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def inference_inputs():
+  return {'length': tf.placeholder(tf.int32, [None], name='length'),
+          'ent_pos': tf.placeholder(tf.int32, [None, 4], name='ent_pos'),
+          'sentence': tf.placeholder(tf.int64, [None, None], name='sentence'),
+          'pos1': tf.placeholder(tf.int64, [None, None], name='pos1'),
+          'pos2': tf.placeholder(tf.int64, [None, None], name='pos2')}
+
+def example_request(length=20):
+  '''one sentence, its entities at the second and the second last word'''
+  pos = np.arange(length)
+  return {'length': np.array([length], np.int32),
+          'ent_pos': np.array([[1, 1, length-2, length-2]], np.int32),
+          'sentence': np.ones([1, length], np.int64),
+          'pos1': np.clip(pos - 1, -60, 60)[None] + 61,
+          'pos2': np.clip(pos - length + 2, -60, 60)[None] + 61}
+
+def build_and_restore(hparams, ini_word_embed, quantized=None):
+  inputs = inference_inputs()
+  m_infer = cnn_model.build_inference_model(hparams, ini_word_embed,
+                [inputs[k] for k in ['length', 'ent_pos', 'sentence',
+                                     'pos1', 'pos2']], quantized)
+  init_op = tf.group(tf.global_variables_initializer(),
+                      tf.local_variables_initializer())
+  sess = tf.Session()
+  sess.run(init_op)
+  m_infer.restore(sess)
+  return sess, inputs, m_infer
+
+def main(_):
+  config = config_lib.get_config()
+  embed = dataset.Embed(config.out_dir, config.trimmed_embed300_file, config.vocab_file)
+  ini_word_embed = embed.load_embedding()
+  if FLAGS.dataset == 'semeval':
+    hparams = config_lib.semeval_hparams()
+  else:
+    hparams = config_lib.nyt_hparams()
+
+  quantized = None
+  if FLAGS.quantize != 'none':
+    with tf.Graph().as_default():
+      sess, _, _ = build_and_restore(hparams, ini_word_embed)
+      quantized = quantize_weights(sess, kernels=FLAGS.quantize)
+      sess.close()
+
+  with tf.Graph().as_default():
+    sess, inputs, m_infer = build_and_restore(hparams, ini_word_embed,
+                                              quantized)
+    export_model(sess, inputs, m_infer.tensors, FLAGS.export_dir,
+                 fold_constants=quantized is None)
+    sess.close()
+
+  if FLAGS.timed_requests:
+    startup, p50, p99 = time_classifier(FLAGS.export_dir, example_request(),
+                                        FLAGS.timed_requests)
+    print('load %.2f secs, request p50 %.2f ms p99 %.2f ms' %
+          (startup, p50*1000, p99*1000))
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,127 @@
+'''
+Sentences to classify, one per line, with the two entities marked either
+raw, optionally after an id and a tab as in the SemEval release
+
+  The <e1>company</e1> fabricates plastic <e2>chairs</e2> .
+  8001	"The <e1>company</e1> fabricates plastic <e2>chairs</e2>."
+
+or cleaned like the .cln files, the label is ignored
+
+  0 1 1 4 4 The company fabricates plastic chairs .
+
+Both are cleaned and lowercased token by token with the clean_str() of
+src/script/clean_str.py, which made the .cln files the models were trained
+on, and the entity positions follow the tokens as in its clean_data().
+'''
+import re
+
+from inputs import utils
+
+ENTITY_TAG = re.compile(r'(</?e[12]>)')
+
+
+def clean_str(string):
+  '''clean_str() of src/script/clean_str.py'''
+  string = re.sub(r"[^A-Za-z0-9(),!?\'\`]", " ", string)
+  string = re.sub(r"\'s", " \'s", string)
+  string = re.sub(r"\'ve", " \'ve", string)
+  string = re.sub(r"n\'t", " n\'t", string)
+  string = re.sub(r"\'re", " \'re", string)
+  string = re.sub(r"\'d", " \'d", string)
+  string = re.sub(r"\'ll", " \'ll", string)
+  string = re.sub(r",", " , ", string)
+  string = re.sub(r"!", " ! ", string)
+  string = re.sub(r"\(", " ( ", string)
+  string = re.sub(r"\)", " ) ", string)
+  string = re.sub(r"\?", " ? ", string)
+  string = re.sub(r"\s{2,}", " ", string)
+  string = re.sub(r"#", "", string)
+  return string.strip().lower()
+
+def tokenize(text):
+  '''whitespace separated words, clean_tokens() splits off the punctuation'''
+  return text.split()
+
+def clean_tokens(tokens, ent_pos):
+  '''
+  Cleans each token, which may split it or drop it, and moves the entity
+  positions to the cleaned tokens.
+  Returns
+    tokens and ent_pos, the positions of a dropped entity are None
+  '''
+  cleaned = []
+  starts = []
+  for tok in tokens:
+    starts.append(len(cleaned))
+    cleaned.extend(clean_str(tok).split())
+  starts.append(len(cleaned))
+
+  cleaned_pos = [None]*4
+  for i in (0, 2):
+    first, last = starts[ent_pos[i]], starts[ent_pos[i+1] + 1] - 1
+    if first <= last:
+      cleaned_pos[i], cleaned_pos[i+1] = first, last
+  return cleaned, cleaned_pos
+
+def valid_entities(tokens, ent_pos):
+  if None in ent_pos or not tokens:
+    return False
+  e1_first, e1_last, e2_first, e2_last = ent_pos
+  return (0 <= e1_first <= e1_last < len(tokens) and
+          0 <= e2_first <= e2_last < len(tokens))
+
+def parse_marked(text):
+  tokens = []
+  ent_pos = [None]*4
+  for piece in ENTITY_TAG.split(text):
+    if piece in ('<e1>', '<e2>'):
+      ent_pos[2*(piece[2] == '2')] = len(tokens)
+    elif piece in ('</e1>', '</e2>'):
+      ent_pos[2*(piece[3] == '2') + 1] = len(tokens) - 1
+    else:
+      tokens.extend(tokenize(piece))
+  return tokens, ent_pos
+
+def parse_cleaned(fields):
+  return fields[5:], [int(x) for x in fields[1:5]]
+
+def parse_line(line):
+  '''
+  Returns
+    tokens and [e1_first, e1_last, e2_first, e2_last], None when the line
+    does not mark both entities
+  '''
+  line = line.strip()
+  if '<e1>' in line or '<e2>' in line:
+    tokens, ent_pos = parse_marked(line.split('\t')[-1].strip('"'))
+  else:
+    fields = line.split(' ')
+    if len(fields) < 6 or not all(f.lstrip('-').isdigit() for f in fields[:5]):
+      return None
+    tokens, ent_pos = parse_cleaned(fields)
+
+  if not valid_entities(tokens, ent_pos):
+    return None
+  tokens, ent_pos = clean_tokens(tokens, ent_pos)
+  if not valid_entities(tokens, ent_pos):
+    return None
+  return tokens, ent_pos
+
+def encode_line(line, vocab2id, unk_id, max_len):
+  '''
+  Returns
+    (length, ent_pos, sentence, pos1, pos2) like the records of gen_data.py,
+    None for a line that can not be classified
+  '''
+  parsed = parse_line(line)
+  if parsed is None:
+    return None
+  tokens, ent_pos = parsed
+  if max(ent_pos) >= max_len:
+    return None
+  sentence = [vocab2id.get(tok, unk_id) for tok in tokens[:max_len]]
+  length = len(sentence)
+  e1_first, e1_last, e2_first, e2_last = ent_pos
+  pos1 = utils.position_feature(e1_first, e1_last, length)
+  pos2 = utils.position_feature(e2_first, e2_last, length)
+  return length, ent_pos, sentence, pos1, pos2
@@ -0,0 +1,30 @@
+from inputs.raw_text import parse_line
+
+# run from the src dir: python -m inputs.test_raw_text
+#
+# SemEval lines and the .cln lines src/script/clean_str.py made of them,
+# the entity positions of the .cln follow its cleaned tokens
+fixture = [
+  ('1\t"The <e1>company</e1> fabricates plastic <e2>chairs</e2>."',
+   '3 1 1 4 4 the company fabricates plastic chairs'),
+  ('2\t"The <e1>author</e1>\'s state-of-the-art <e2>novel</e2>, (he said), '
+   'wasn\'t read!"',
+   '0 1 1 7 7 the author \'s state of the art novel , ( he said ) , '
+   'was n\'t read !'),
+  ('3\t"An <e1>ice cream maker</e1> was put into the <e2>freezer</e2>?"',
+   '5 1 3 8 8 an ice cream maker was put into the freezer ?'),
+  ('The U.S. <e1>senators</e1> couldn\'t agree on the 3.5% <e2>rate</e2>.',
+   '0 3 3 11 11 the u s senators could n\'t agree on the 3 5 rate'),
+]
+
+for raw, cleaned in fixture:
+  fields = cleaned.split(' ')
+  expected = (fields[5:], [int(x) for x in fields[1:5]])
+  assert parse_line(raw) == expected, (raw, parse_line(raw), expected)
+  assert parse_line(cleaned) == expected, (cleaned, parse_line(cleaned))
+
+# entities not marked, or cleaned away
+assert parse_line('The company fabricates plastic chairs.') is None
+assert parse_line('The <e1>company</e1> fabricates <e2>%%</e2>.') is None
+assert parse_line('0 1 1 9 9 the company') is None
+print('%d lines clean to their .cln tokens' % len(fixture))
@@ -26,12 +26,26 @@ def position_feature(e_first, e_last, length):
       pos.append(relative_distance(i-e_last))
   return pos
 
-def write_results(predictions, label_file, relation_file):
+def load_relations(label_file):
+  '''relation names by label id'''
   id2relation = []
   with open(label_file) as f:
     for id, line in enumerate(f):
       rel = line.strip()
       id2relation.append(rel)
+  return id2relation
+
+def load_relation2id(relation_file):
+  '''relation names by label id of a "<relation> <id>" file'''
+  rel2id = {}
+  with open(relation_file) as f:
+    for line in f:
+      segs = line.strip().split()
+      rel2id[segs[0]] = int(segs[1])
+  return sorted(rel2id, key=rel2id.get)
+
+def write_results(predictions, label_file, relation_file):
+  id2relation = load_relations(label_file)
   
   start_no = 8001
   with open(relation_file, 'w') as f:
@@ -0,0 +1,104 @@
+'''
+Load test of server.py over its unix socket.
+
+  python server.py --socket_path=/tmp/rc.sock &
+  python load_test.py --socket_path=/tmp/rc.sock --num_clients=32
+
+Every client opens its own connection and sends its requests one after the
+other, each once the reply of the previous one is in. The sentences are
+read from `input_file`, or made up from random words of the vocab with the
+entities at random places. Prints the throughput, the latency percentiles
+seen by the clients, the overloaded replies and the stats of the server.
+'''
+import sys
+import json
+import time
+import socket
+import random
+import threading
+import numpy as np
+import tensorflow as tf
+
+from inputs import dataset
+import config as config_lib
+
+flags = tf.app.flags
+flags.DEFINE_string('socket_path', '/tmp/rc.sock', 'where server.py listens')
+flags.DEFINE_integer('num_clients', 16, 'concurrent connections')
+flags.DEFINE_integer('requests_per_client', 500, 'requests of a connection')
+flags.DEFINE_string('input_file', '',
+                    'sentences with marked entities, empty makes them up')
+FLAGS = tf.app.flags.FLAGS
+
+
+def made_up_sentences(words, num, min_len=5, max_len=40):
+  sentences = []
+  for _ in range(num):
+    tokens = random.sample(words, random.randint(min_len, max_len))
+    e1, e2 = sorted(random.sample(range(len(tokens)), 2))
+    tokens[e1] = '<e1>%s</e1>' % tokens[e1]
+    tokens[e2] = '<e2>%s</e2>' % tokens[e2]
+    sentences.append(' '.join(tokens))
+  return sentences
+
+def request(conn_file, message):
+  conn_file.write((json.dumps(message) + '\n').encode('utf-8'))
+  conn_file.flush()
+  return json.loads(conn_file.readline().decode('utf-8'))
+
+def run_client(client_id, sentences, latency, errors):
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.connect(FLAGS.socket_path)
+  conn_file = sock.makefile('rwb')
+  for i in range(FLAGS.requests_per_client):
+    sentence = sentences[(client_id * FLAGS.requests_per_client + i) %
+                         len(sentences)]
+    start_time = time.time()
+    reply = request(conn_file, {'id': i, 'sentence': sentence})
+    latency.append(time.time() - start_time)
+    if 'error' in reply:
+      errors.append(reply['error'])
+  conn_file.close()
+  sock.close()
+
+def server_stats():
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.connect(FLAGS.socket_path)
+  conn_file = sock.makefile('rwb')
+  stats = request(conn_file, {'stats': True})
+  conn_file.close()
+  sock.close()
+  return stats
+
+def main(_):
+  if FLAGS.input_file:
+    with open(FLAGS.input_file) as f:
+      sentences = [line.strip() for line in f if line.strip()]
+  else:
+    config = config_lib.get_config()
+    vocab = dataset.Vocab(config.out_dir, config.vocab_file)
+    # no <PAD> and <UNK>
+    sentences = made_up_sentences(vocab.vocab[2:], 10000)
+
+  latency, errors = [], []
+  clients = [threading.Thread(target=run_client,
+                              args=(i, sentences, latency, errors))
+               for i in range(FLAGS.num_clients)]
+  start_time = time.time()
+  for client in clients:
+    client.start()
+  for client in clients:
+    client.join()
+  duration = time.time() - start_time
+
+  latency = np.array(latency) * 1000
+  print('%d requests from %d clients in %.1f secs, %.0f requests/sec' %
+        (len(latency), FLAGS.num_clients, duration, len(latency) / duration))
+  print('client latency ms p50 %.2f p99 %.2f, %d errors (%d overloaded)' %
+        (np.percentile(latency, 50), np.percentile(latency, 99),
+         len(errors), errors.count('overloaded')))
+  print('server %s' % json.dumps(server_stats()))
+  sys.stdout.flush()
+
+if __name__ == '__main__':
+  tf.app.run()
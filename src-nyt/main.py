@@ -7,6 +7,9 @@ import numpy as np
 
 from inputs import  dataset, rc_dataset, utils
 from models import cnn_model
+from models.checkpoint import new_train_state, resume_point
+from models.profiler import profiled
+from models.metrics import MetricsLogger
 import config as config_lib
 
 # tf.set_random_seed(0)
@@ -14,17 +17,44 @@ import config as config_lib
 
 flags = tf.app.flags
 flags.DEFINE_boolean('test', False, 'set True to test')
+flags.DEFINE_boolean('resume', False, 
+                     'continue the interrupted run saved in the model dir')
+flags.DEFINE_boolean('inline_eval', True, 
+                     'validate after every epoch, set False when evaluate.py '
+                     'runs next to the trainer')
+flags.DEFINE_integer('profile_steps', 0, 
+                     'training steps traced by the profiler, 0 disables it')
+flags.DEFINE_integer('profile_start', 10, 'training steps before the trace')
+flags.DEFINE_integer('profile_top_n', 20, 'ops printed after the trace')
+flags.DEFINE_string('profile_dir', 'profile/', 
+                    'where the timeline and the op reports are written')
 FLAGS = tf.app.flags.FLAGS
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
-def train(session, m_train, m_valid, test_iter, restore=False):
-  if restore:
+def train(session, m_train, m_valid, test_iter, state, restore=False, 
+          checkpoint=None, inputs=None, relations=None):
+  '''
+  Args
+    state: train state from new_train_state() or of `checkpoint`, updated in
+           place and saved with every checkpoint
+    restore: start from the best saved model
+    checkpoint: resume_point() entry of an interrupted run, takes precedence 
+                over `restore`
+    inputs: dict of dataset name => training iterators, for the input stall 
+            breakdown
+    relations: relation names by label id, validation then also reports the
+               SemEval macro-F1
+  '''
+  if checkpoint:
+    m_train.resume(session, checkpoint)
+    print('resume from %s, batch %d' % (checkpoint['path'], state['batches']))
+  elif restore:
     m_train.restore(session)
 
   print('='*80)
 
-  best_acc, best_step = 0., 0
+  best_acc, best_step = state['best_metric'], state['best_step']
   global_step_tensor = tf.train.get_global_step()
 
   start_time = time.time()
@@ -32,19 +62,31 @@ def train(session, m_train, m_valid, test_iter, restore=False):
   
   hparams = m_train.hparams
   num_batches_train = math.ceil(hparams.num_train_examples / hparams.batch_size)
-  num_batches_test  = math.ceil(hparams.num_test_examples / hparams.batch_size)
 
-  batch = 0
+  batch = state['batches']
+  step_size = hparams.batch_size // hparams.num_towers * hparams.num_towers
+  # records are written at log_freq, next to the printed line
+  metrics = MetricsLogger(os.path.join(m_train.save_dir, 'metrics'), 
+                          step_size, m_train.steps_per_run, 
+                          [m_train.tensors.get('n_steps_loss')], log_every=0,
+                          start_step=batch, inputs=inputs)
+  train_session = profiled(metrics.wrap(session), FLAGS.profile_dir, 
+                           FLAGS.profile_start, FLAGS.profile_steps, 
+                           FLAGS.profile_top_n)
   moving_acc = []
   moving_loss = []
   while True:
     try:
-      loss, acc = m_train.train_step(session)
+      loss, acc = m_train.train_step(train_session)
       moving_loss.append(loss)
       moving_acc.append(acc)
 
-      batch += 1
-      if batch % hparams.log_freq == 0:
+      prev_batch = batch
+      batch += m_train.steps_per_run
+      state['batches'] = batch
+      state['epoch'] = batch // num_batches_train
+      metric = None
+      if batch // hparams.log_freq > prev_batch // hparams.log_freq:
         # duration
         now = time.time()
         duration = now - start_time
@@ -53,36 +95,58 @@ def train(session, m_train, m_valid, test_iter, restore=False):
         # log
         loss = np.mean(moving_loss)
         acc = np.mean(moving_acc)*100
-        print("Epoch %d batch %d loss %.2f acc %.2f time %.2f" % 
-              (batch/num_batches_train, batch, loss, acc, duration))
+        examples_per_sec = len(moving_loss)*m_train.steps_per_run*step_size/duration
+        print("Epoch %d batch %d loss %.2f acc %.2f time %.2f %.0f examples/sec" % 
+              (batch/num_batches_train, batch, loss, acc, duration, 
+               examples_per_sec))
         sys.stdout.flush()
+        metrics.log(loss=loss, acc=acc)
         moving_loss.clear()
         moving_acc.clear()
       
-      if batch % num_batches_train == 0:
-        # valid accuracy
-        valid_acc = m_valid.evaluate(session, test_iter, num_batches_test)
+      epoch_end = batch // num_batches_train > prev_batch // num_batches_train
+      if epoch_end and FLAGS.inline_eval:
+        # valid accuracy and macro-F1, one pass over the test set
+        result = m_valid.evaluate(session, test_iter, relations)
+        valid_acc = result.acc*100
+        metric = valid_acc
 
         if best_acc < valid_acc:
           best_acc = valid_acc
           best_step = tf.train.global_step(session, global_step_tensor)
-          m_train.save(session, best_step)
-        print('\t Valid acc: %.2f' % valid_acc)
+          state['best_metric'], state['best_step'] = best_acc, best_step
+        scalars = dict(valid_acc=valid_acc)
+        msg = '\t Valid acc: %.2f' % valid_acc
+        if result.macro_f1 is not None:
+          scalars['valid_f1'] = result.macro_f1*100
+          msg += ' f1: %.2f' % scalars['valid_f1']
+        print(msg)
         sys.stdout.flush()
+        metrics.log(epoch=state['epoch'], **scalars)
+
+      # without inline_eval, evaluate.py scores the checkpoints
+      if (epoch_end or 
+          batch // hparams.ckpt_freq > prev_batch // hparams.ckpt_freq):
+        step = tf.train.global_step(session, global_step_tensor)
+        m_train.save(session, step, metric, state)
 
     except tf.errors.OutOfRangeError:
       break
   
+  m_train.wait_for_checkpoints()
+  metrics.close()
   duration = time.time() - orig_begin_time
   duration /= 3600
   # print('Done training, best_epoch: %d, best_acc: %.4f' % (best_epoch, best_acc))
   print('duration: %.2f hours' % duration)
   sys.stdout.flush()
 
-def test(session, m_valid, test_iter):
+def test(session, m_valid, test_iter, relations_file):
   m_valid.restore(session)
-  all_pred = m_valid.pred_results(session, test_iter, 28)
-  utils.write_results(all_pred, "data/SemEval/relations.txt", "data/generated/results.txt")
+  result = m_valid.evaluate(session, test_iter, 
+                            utils.load_relations(relations_file))
+  print('acc: %.2f macro-f1: %.2f' % (result.acc*100, result.macro_f1*100))
+  utils.write_results(result.pred, relations_file, "data/generated/results.txt")
 
 def main(_):
   config = config_lib.get_config()
@@ -97,25 +161,46 @@ def main(_):
 
   semeval_hparams = config_lib.semeval_hparams()
   nyt_hparams = config_lib.nyt_hparams()
+  relations_file = os.path.join(config.semeval_dir, 
+                                config.semeval_relations_file)
+
+  checkpoint = None
+  if FLAGS.resume and not FLAGS.test:
+    checkpoint = resume_point(os.path.join(semeval_hparams.logdir, 
+                                           semeval_hparams.save_dir))
+  sem_state = checkpoint['train_state'] if checkpoint else new_train_state()
+  nyt_state = new_train_state()
+
+  def tower_iters(data, hparams, state):
+    # one record shard per replica, `batches` counts steps so every shard 
+    # skips the same number of batches
+    n = hparams.num_towers
+    return [data.train_data(hparams.num_epochs, hparams.batch_size // n, 
+                            seed=state['seed'], skip_batches=state['batches'],
+                            num_shards=n, shard_index=i)
+              for i in range(n)]
 
   with tf.Graph().as_default():
-    semeval_train_iter = semeval_data.train_data(semeval_hparams.num_epochs, 
-                                                 semeval_hparams.batch_size)
+    semeval_train_iters = tower_iters(semeval_data, semeval_hparams, sem_state)
     semeval_test_iter = semeval_data.test_data(1, semeval_hparams.batch_size)
 
-    nyt_train_iter = nyt_data.train_data(nyt_hparams.num_epochs, 
-                                         nyt_hparams.batch_size)
+    nyt_train_iters = tower_iters(nyt_data, nyt_hparams, nyt_state)
     nyt_test_iter = nyt_data.test_data(1, nyt_hparams.batch_size)
 
-    semeval_train_data = semeval_train_iter.get_next()
+    semeval_train_data = [it.get_next() for it in semeval_train_iters]
     semeval_test_data = semeval_test_iter.get_next()
-    nyt_train_data = nyt_train_iter.get_next()
+    nyt_train_data = [it.get_next() for it in nyt_train_iters]
     nyt_test_data = nyt_test_iter.get_next()
 
     sem_train, sem_valid = cnn_model.build_train_valid_model(semeval_hparams, 
                   ini_word_embed, semeval_train_data, semeval_test_data)
     nyt_train, nyt_valid = cnn_model.build_train_valid_model(nyt_hparams, 
                   ini_word_embed, nyt_train_data, nyt_test_data)
+    for m_train, train_iters in [(sem_train, semeval_train_iters), 
+                                 (nyt_train, nyt_train_iters)]:
+      if m_train.hparams.steps_per_run > 1:
+        with tf.name_scope('Train'):
+          m_train.build_train_n_steps(train_iters, m_train.hparams.steps_per_run)
 
     init_op = tf.group(tf.global_variables_initializer(),
                         tf.local_variables_initializer())# for file queue
@@ -129,10 +214,14 @@ def main(_):
       sess.run(init_op)
 
       if FLAGS.test:
-        test(sess, sem_valid, semeval_test_iter)
+        test(sess, sem_valid, semeval_test_iter, relations_file)
       else:
-        # train(sess, nyt_train, nyt_valid, nyt_test_iter)
-        train(sess, sem_train, sem_valid, semeval_test_iter, restore=True)
+        # train(sess, nyt_train, nyt_valid, nyt_test_iter, nyt_state, 
+        #       inputs={'nyt_train': nyt_train_iters})
+        train(sess, sem_train, sem_valid, semeval_test_iter, sem_state, 
+              restore=True, checkpoint=checkpoint, 
+              inputs={'semeval_train': semeval_train_iters},
+              relations=utils.load_relations(relations_file))
 
 if __name__ == '__main__':
   tf.app.run()
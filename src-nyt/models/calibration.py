@@ -0,0 +1,135 @@
+'''
+Temperature scaling of the relation probabilities.
+
+  python calibrate.py --dataset=nyt     # writes calibration-53.json
+
+A single temperature T is fitted on validation logits by minimizing the
+negative log likelihood of softmax(logits / T); it leaves the argmax alone
+and only makes the probabilities honest enough to filter predictions by
+confidence. The repo has no validation split, so calibrate() fits T on a
+fixed random part of the test examples and reports the nll and the
+expected calibration error on the others.
+
+The models read T from calibration-<num_classes>.json in their model dir
+when their graph is built, T = 1 before calibrate.py ran, and compute the
+top-k relation ids and probabilities in-graph with calibrated_top_k(). The
+file is keyed by the number of classes as the SemEval and the NYT models
+share the model dir, and names the checkpoint T was fitted on: a model
+restoring another checkpoint warns and keeps T = 1 until calibrate.py runs
+again.
+'''
+import os
+import json
+import numpy as np
+import tensorflow as tf
+
+from models.evaluation import softmax
+
+CALIBRATION_FILE = 'calibration-%d.json'
+
+
+def nll(logits, labels, temperature=1.):
+  '''mean negative log likelihood of the labels'''
+  z = logits / temperature
+  z = z - np.max(z, axis=1, keepdims=True)
+  log_probs = z - np.log(np.sum(np.exp(z), axis=1, keepdims=True))
+  return -np.mean(log_probs[np.arange(len(labels)), labels])
+
+def fit_temperature(logits, labels, lo=0.05, hi=20., iters=50):
+  '''T minimizing nll(), by golden section search over log T, on which the
+  nll is unimodal'''
+  logits = np.asarray(logits, np.float64)
+  a, b = np.log(lo), np.log(hi)
+  ratio = (np.sqrt(5) - 1) / 2
+  c, d = b - ratio*(b - a), a + ratio*(b - a)
+  f_c, f_d = nll(logits, labels, np.exp(c)), nll(logits, labels, np.exp(d))
+  for _ in range(iters):
+    if f_c < f_d:
+      b, d, f_d = d, c, f_c
+      c = b - ratio*(b - a)
+      f_c = nll(logits, labels, np.exp(c))
+    else:
+      a, c, f_c = c, d, f_d
+      d = a + ratio*(b - a)
+      f_d = nll(logits, labels, np.exp(d))
+  return float(np.exp((a + b) / 2))
+
+def expected_calibration_error(probs, labels, num_bins=15):
+  '''mean gap between confidence and accuracy over confidence bins,
+  weighted by the examples in each bin'''
+  confidence = np.max(probs, axis=1)
+  correct = np.argmax(probs, axis=1) == labels
+  bins = np.minimum((confidence * num_bins).astype(np.int64), num_bins - 1)
+  counts = np.bincount(bins, minlength=num_bins)
+  gap = np.abs(np.bincount(bins, weights=confidence, minlength=num_bins) -
+               np.bincount(bins, weights=correct, minlength=num_bins))
+  return gap.sum() / max(counts.sum(), 1)
+
+def calibration_report(logits, labels, temperature):
+  '''nll and ece before and after the temperature scaling'''
+  return {'temperature': temperature, 'examples': len(labels),
+          'nll': nll(logits, labels),
+          'nll_calibrated': nll(logits, labels, temperature),
+          'ece': expected_calibration_error(softmax(logits), labels),
+          'ece_calibrated': expected_calibration_error(
+                                softmax(logits / temperature), labels)}
+
+def split_examples(num_examples, fit_fraction, seed=0):
+  '''indices of the examples T is fitted on and of the held out ones'''
+  perm = np.random.RandomState(seed).permutation(num_examples)
+  num_fit = int(round(num_examples * fit_fraction))
+  return perm[:num_fit], perm[num_fit:]
+
+def calibrate(logits, labels, fit_fraction=0.5, seed=0):
+  '''
+  Returns
+    calibration_report() on the held out examples of the T fitted on the
+    `fit_fraction` others, with the number of examples T is fitted on
+  '''
+  logits, labels = np.asarray(logits), np.asarray(labels)
+  fit, held_out = split_examples(len(labels), fit_fraction, seed)
+  temperature = fit_temperature(logits[fit], labels[fit])
+  report = calibration_report(logits[held_out], labels[held_out], temperature)
+  report['fit_examples'] = len(fit)
+  return report
+
+def write_calibration(save_dir, num_classes, report, checkpoint):
+  '''
+  Args
+    checkpoint: path of the checkpoint the logits were computed with
+  '''
+  report = dict(report, checkpoint=os.path.basename(checkpoint))
+  path = os.path.join(save_dir, CALIBRATION_FILE % num_classes)
+  with tf.gfile.GFile(path, 'w') as f:
+    f.write(json.dumps(report, indent=2))
+
+def read_temperature(save_dir, num_classes, checkpoint=None):
+  '''
+  Args
+    checkpoint: path of the checkpoint the model restores, None before the
+                first one is written
+  Returns
+    the fitted T, 1 before calibrate.py ran or when T was fitted on another
+    checkpoint
+  '''
+  path = os.path.join(save_dir, CALIBRATION_FILE % num_classes)
+  if not tf.gfile.Exists(path):
+    return 1.
+  with tf.gfile.GFile(path) as f:
+    report = json.load(f)
+  fitted_on = report.get('checkpoint')
+  restored = checkpoint and os.path.basename(checkpoint)
+  if fitted_on != restored:
+    tf.logging.warning('%s was fitted on %s, not on %s, rerun calibrate.py; '
+                       'the probabilities are not calibrated' %
+                       (path, fitted_on, restored))
+    return 1.
+  return float(report['temperature'])
+
+def calibrated_top_k(logits, k, temperature=1.):
+  '''ids and probabilities of the k most probable relations by example,
+  after scaling the logits by 1/temperature'''
+  with tf.name_scope('top_k'):
+    probs = tf.nn.softmax(logits / temperature)
+    top_probs, top_ids = tf.nn.top_k(probs, k)
+  return probs, top_ids, top_probs
@@ -0,0 +1,232 @@
+'''
+Checkpoints written on a background thread.
+
+save() copies the variables into host memory with one session.run and
+returns; a worker thread writes the copy with its own graph and Saver, so
+the files are ordinary checkpoints that tf.train.Saver restores.
+
+Frozen embeddings are initialized from their pretrain file on every run, so
+by default they are left out and only a sha1 of the table is recorded in
+manager.json.
+
+Each entry of manager.json also carries the train state of the driver (epoch,
+batches consumed, shuffle seed, best metric), an interrupted run resumes from
+the newest entry, see resume_point().
+
+A separate evaluator process (evaluate.py) marks the best checkpoint it has
+seen in best_eval.json, the marked checkpoint is never retired.
+'''
+import os
+import json
+import queue
+import random
+import hashlib
+import threading
+import tensorflow as tf
+
+
+BEST_EVAL_FILE = 'best_eval.json'
+
+
+def array_sha1(array):
+  return hashlib.sha1(array.tobytes()).hexdigest()
+
+def frozen_embeddings():
+  '''non-trainable embedding tables of the default graph'''
+  trainable = set(tf.trainable_variables())
+  return [v for v in tf.global_variables()
+            if v not in trainable and v.op.name.endswith('_embed')]
+
+def saveable_variables(include_frozen=False):
+  var_list = tf.global_variables()
+  if include_frozen:
+    return var_list
+  frozen = set(frozen_embeddings())
+  return [v for v in var_list if v not in frozen]
+
+def verify_embeddings(save_dir, embed_refs):
+  '''warn if the embeddings differ from the ones the checkpoint was trained
+  with, they are not part of the checkpoint'''
+  path = os.path.join(save_dir, CheckpointManager.STATE_FILE)
+  if not tf.gfile.Exists(path):
+    return
+  with tf.gfile.GFile(path) as f:
+    saved_refs = json.load(f).get('embeddings', {})
+  for name, sha1 in saved_refs.items():
+    if embed_refs.get(name) != sha1:
+      tf.logging.warning('%s differs from the one saved with %s' %
+                         (name, save_dir))
+
+def _load_state(save_dir):
+  path = os.path.join(save_dir, CheckpointManager.STATE_FILE)
+  if not tf.gfile.Exists(path):
+    return {}
+  with tf.gfile.GFile(path) as f:
+    return json.load(f)
+
+def _on_disk(ckpt):
+  return len(tf.gfile.Glob(ckpt['path'] + '.*')) > 0
+
+def new_train_state():
+  '''bookkeeping of a fresh run, `batches` counts the training batches 
+  consumed so far and `seed` fixes the shuffle order of the input pipeline'''
+  return {'epoch': 0, 'batches': 0, 'seed': random.randint(0, 2**31 - 1),
+          'best_metric': 0., 'best_step': 0}
+
+def resume_point(save_dir):
+  '''newest checkpoint in save_dir with a train state, None if there is none
+
+  Returns
+    dict of path, step, metric, train_state
+  '''
+  checkpoints = _load_state(save_dir).get('checkpoints', [])
+  checkpoints = [c for c in checkpoints 
+                   if c.get('train_state') is not None and _on_disk(c)]
+  return checkpoints[-1] if checkpoints else None
+
+def read_best_eval(save_dir):
+  '''the best_eval.json marker of the evaluator, None if there is none'''
+  path = os.path.join(save_dir, BEST_EVAL_FILE)
+  if not tf.gfile.Exists(path):
+    return None
+  with tf.gfile.GFile(path) as f:
+    return json.load(f)
+
+def _write_json(path, obj):
+  '''writes a temp file and renames it, readers never see a partial file'''
+  tmp_path = path + '.tmp'
+  with tf.gfile.GFile(tmp_path, 'w') as f:
+    json.dump(obj, f, indent=2)
+  tf.gfile.Rename(tmp_path, path, overwrite=True)
+
+def mark_best_eval(save_dir, ckpt_path, step, metric):
+  _write_json(os.path.join(save_dir, BEST_EVAL_FILE),
+              {'path': ckpt_path, 'step': int(step), 'metric': float(metric)})
+
+def best_checkpoint(save_dir):
+  '''path of the checkpoint marked by the evaluator, else the one with the 
+  highest metric, else the newest one'''
+  marked = read_best_eval(save_dir)
+  if marked is not None and _on_disk(marked):
+    return marked['path']
+  checkpoints = _load_state(save_dir).get('checkpoints', [])
+  scored = [c for c in checkpoints if c['metric'] is not None and _on_disk(c)]
+  if scored:
+    return max(scored, key=lambda c: c['metric'])['path']
+  return tf.train.get_checkpoint_state(save_dir).model_checkpoint_path
+
+
+class CheckpointManager(object):
+  '''writes checkpoints asynchronously and keeps the last `max_to_keep`
+  plus the `keep_best` with the highest metric
+  '''
+  STATE_FILE = 'manager.json'
+
+  def __init__(self, save_dir, var_list, embed_refs=None,
+               max_to_keep=5, keep_best=3, prefix='model.ckpt'):
+    self.save_dir = save_dir
+    self.save_path = os.path.join(save_dir, prefix)
+    self.var_list = var_list
+    self.embed_refs = embed_refs or {}
+    self.max_to_keep = max_to_keep
+    self.keep_best = keep_best
+
+    # dicts of path, step, metric, train_state, oldest first; the ones of
+    # an earlier run in save_dir, resumed or restored, are kept retiring
+    checkpoints = _load_state(save_dir).get('checkpoints', [])
+    self.checkpoints = [c for c in checkpoints if _on_disk(c)]
+    self._queue = queue.Queue(maxsize=2) # bounds the snapshots held in memory
+    self._error = None
+    self._thread = None
+
+  def save(self, session, global_step, metric=None, train_state=None):
+    '''snapshots the variables and queues them for writing
+
+    `train_state` is a dict of scalars stored next to the entry
+    '''
+    self._raise_error()
+    values = session.run(self.var_list)
+    snapshot = {v.op.name: value for v, value in zip(self.var_list, values)}
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name='ckpt-writer')
+      self._thread.daemon = True
+      self._thread.start()
+    # numpy scalars are not json-serializable
+    if metric is not None:
+      metric = float(metric)
+    if train_state is not None:
+      train_state = {k: getattr(v, 'item', lambda: v)() 
+                       for k, v in train_state.items()}
+    self._queue.put((snapshot, global_step, metric, train_state))
+
+  def wait(self):
+    '''blocks until every queued checkpoint is on disk'''
+    self._queue.join()
+    self._raise_error()
+
+  def _raise_error(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def _run(self):
+    writer = None
+    while True:
+      snapshot, global_step, metric, train_state = self._queue.get()
+      try:
+        if writer is None:
+          writer = _SnapshotWriter(snapshot)
+        path = writer.write(snapshot, self.save_path, global_step)
+        self._retain(path, global_step, metric, train_state)
+      except Exception as e:
+        self._error = e
+      finally:
+        self._queue.task_done()
+
+  def _retain(self, path, global_step, metric, train_state):
+    self.checkpoints.append({'path': path, 'step': int(global_step), 
+                             'metric': metric, 'train_state': train_state})
+
+    keep = self.checkpoints[-self.max_to_keep:]
+    scored = [c for c in self.checkpoints if c['metric'] is not None]
+    scored.sort(key=lambda c: c['metric'], reverse=True)
+    keep += scored[:self.keep_best]
+    marked = read_best_eval(self.save_dir)
+    if marked is not None:
+      keep += [c for c in self.checkpoints if c['path'] == marked['path']]
+
+    for ckpt in self.checkpoints:
+      if ckpt not in keep:
+        for f in tf.gfile.Glob(ckpt['path'] + '.*'):
+          tf.gfile.Remove(f)
+    self.checkpoints = [c for c in self.checkpoints if c in keep]
+
+    tf.train.update_checkpoint_state(self.save_dir, path,
+                      all_model_checkpoint_paths=[c['path'] for c in self.checkpoints])
+    state = {'checkpoints': self.checkpoints, 'embeddings': self.embed_refs}
+    _write_json(os.path.join(self.save_dir, self.STATE_FILE), state)
+
+
+class _SnapshotWriter(object):
+  '''a private graph with one variable per snapshot entry'''
+
+  def __init__(self, snapshot):
+    self.graph = tf.Graph()
+    with self.graph.as_default():
+      self.feeds, assigns, var_list = {}, [], {}
+      for name, value in snapshot.items():
+        var = tf.Variable(tf.zeros(value.shape, value.dtype), name=name)
+        feed = tf.placeholder(var.dtype.base_dtype, value.shape)
+        self.feeds[name] = feed
+        assigns.append(var.assign(feed))
+        var_list[name] = var
+      self.assign_op = tf.group(*assigns)
+      self.saver = tf.train.Saver(var_list, max_to_keep=None)
+    self.session = tf.Session(graph=self.graph)
+
+  def write(self, snapshot, save_path, global_step):
+    feed_dict = {self.feeds[name]: value for name, value in snapshot.items()}
+    self.session.run(self.assign_op, feed_dict)
+    return self.saver.save(self.session, save_path, global_step,
+                           write_meta_graph=False,
+                           write_state=False)
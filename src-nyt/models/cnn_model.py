@@ -1,66 +1,201 @@
 import os
 import numpy as np
 import tensorflow as tf
+from models.checkpoint import *
 from models.adv import *
 from models.attention import *
+from models.evaluation import evaluate
+from models.quantize import dequantized_tensor, dequantized_lookup
+from models.calibration import read_temperature, calibrated_top_k
 
 
 class BaseModel(object):
+  # sha1 of the frozen embeddings, see models/checkpoint.py
+  embed_refs = {}
+
   def __init__(self, hparams, ini_word_embed, batched_data, is_train):
     self.is_train = is_train
     self.hparams = hparams
 
-    # embedding initialization
-    self.word_embed = tf.get_variable('word_embed', initializer= ini_word_embed,
-                      dtype=tf.float32, trainable=self.hparams.tune_word_embed)
+    # embedding initialization, a frozen embedding is stored in the 
+    # compute dtype
+    self.dtype = tf.as_dtype(self.hparams.precision)
+    if self.hparams.tune_word_embed:
+      self.word_embed = tf.get_variable('word_embed', initializer= ini_word_embed,
+                        dtype=tf.float32, trainable=True)
+    else:
+      self.word_embed = tf.get_variable('word_embed', 
+                        initializer=ini_word_embed.astype(self.dtype.as_numpy_dtype),
+                        dtype=self.dtype, trainable=False)
+      self.embed_refs = {self.word_embed.op.name: array_sha1(ini_word_embed)}
     pos_shape = [self.hparams.pos_num, self.hparams.pos_dim]  
     self.pos1_embed = tf.get_variable('pos1_embed', shape=pos_shape)
     self.pos2_embed = tf.get_variable('pos2_embed', shape=pos_shape)
     self.embed_dim = self.hparams.word_embed_size + 2*self.hparams.pos_dim
 
     self.tensors = dict()
+    self.pos_kv = dict()
+    self.steps_per_run = 1
 
     initializer = tf.keras.initializers.he_normal()
-    self.regularizer = tf.contrib.layers.l2_regularizer(self.hparams.l2_scale)
+    self.l2_regularizer = tf.contrib.layers.l2_regularizer(self.hparams.l2_scale)
+    self.regularized_weights = []
 
-    with tf.variable_scope('model_graph', initializer=initializer):
+    with tf.variable_scope('model_graph', initializer=initializer,
+                           custom_getter=self.variable_getter) as self.scope:
       self.build_graph(batched_data)
     
     self.set_saver()
 
   def set_saver(self):
     # shared between train and valid model instance
-    self.saver = tf.train.Saver(var_list=None)
+    self.saver = tf.train.Saver(var_list=saveable_variables())
     self.save_dir = os.path.join(self.hparams.logdir, self.hparams.save_dir)
     self.save_path = os.path.join(self.save_dir, "model.ckpt")
+    self.ckpt_manager = None
 
   def restore(self, session):
-    ckpt = tf.train.get_checkpoint_state(self.save_dir)
-    self.saver.restore(session, ckpt.model_checkpoint_path)
+    '''restores the best checkpoint and returns its path'''
+    verify_embeddings(self.save_dir, self.embed_refs)
+    path = best_checkpoint(self.save_dir)
+    self.saver.restore(session, path)
+    return path
 
-  def save(self, session, global_step):
-    self.saver.save(session, self.save_path, global_step)
+  def resume(self, session, checkpoint):
+    '''restores an interrupted run, optimizer slots and global step included
 
-  def optimize(self, loss, lrn_rate, max_norm=None, decay_steps=None):
+    Args
+      checkpoint: entry returned by resume_point()
+    '''
+    verify_embeddings(self.save_dir, self.embed_refs)
+    saver = tf.train.Saver(var_list=saveable_variables())
+    saver.restore(session, checkpoint['path'])
+    self.ckpt_manager = CheckpointManager(self.save_dir, 
+                            saveable_variables(), self.embed_refs)
+
+  def save(self, session, global_step, metric=None, train_state=None):
+    '''snapshots the variables, the files are written in the background'''
+    if self.ckpt_manager is None:
+      self.ckpt_manager = CheckpointManager(self.save_dir, 
+                              saveable_variables(), self.embed_refs)
+    self.ckpt_manager.save(session, global_step, metric, train_state)
+
+  def wait_for_checkpoints(self):
+    if self.ckpt_manager is not None:
+      self.ckpt_manager.wait()
+
+  def regularizer(self, weights):
+    # remember the weights so that the loss can read them again inside the
+    # in-graph training loop, the towers and the loop reuse the same weights
+    var = master_variable(weights)
+    if not any(var is w for w in self.regularized_weights):
+      self.regularized_weights.append(var)
+    return self.l2_regularizer(weights)
+
+  def optimize(self, tower_losses, lrn_rate, max_norm=None, decay_steps=None):
+    global_step = tf.train.get_or_create_global_step()
+    
+    if decay_steps is not None:
+      lrn_rate = tf.train.exponential_decay(lrn_rate, global_step, 
+                                    decay_steps, 0.95, staircase=True)
+    
+    self.optimizer = tf.train.AdamOptimizer(lrn_rate)
+    if self.dtype == tf.float16:
+      self.optimizer = loss_scale_optimizer(self.optimizer)
+    return self.apply_gradients(tower_losses, max_norm)
+
+  def apply_gradients(self, tower_losses, max_norm=None):
+    '''one synchronous update from the gradients averaged over the 
+    data-parallel towers, one loss each'''
     update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS) # for batch_norm
     with tf.control_dependencies(update_ops):
-      global_step = tf.train.get_or_create_global_step()
-      
-      if decay_steps is not None:
-        lrn_rate = tf.train.exponential_decay(lrn_rate, global_step, 
-                                      decay_steps, 0.95, staircase=True)
-      
-      optimizer = tf.train.AdamOptimizer(lrn_rate)
-      gradients, variables = zip(*optimizer.compute_gradients(loss))
+      tower_grads = [self.optimizer.compute_gradients(loss) 
+                       for loss in tower_losses]
+      gradients, variables = zip(*average_gradients(tower_grads))
       
       if max_norm is not None:
         gradients, _ = tf.clip_by_global_norm(gradients, max_norm)
-      train_op = optimizer.apply_gradients(zip(gradients, variables), global_step=global_step)
+      train_op = self.optimizer.apply_gradients(zip(gradients, variables), 
+                        global_step=tf.train.get_global_step())
       return train_op
 
+  def variable_getter(self, getter, *args, **kwargs):
+    return float32_master_getter(getter, *args, **kwargs)
+
+  def embed_words(self, ids):
+    return tf.nn.embedding_lookup(self.word_embed, ids)
+
+  def top_k(self, logits):
+    '''calibrated probabilities, top-k relation ids and their probabilities,
+    the temperature is the one calibrate.py fitted for the model dir'''
+    save_dir = os.path.join(self.hparams.logdir, self.hparams.save_dir)
+    k = min(self.hparams.top_k, self.hparams.num_classes)
+    # the checkpoint restore() will pick, none yet in a new model dir
+    checkpoint = None
+    if tf.train.get_checkpoint_state(save_dir) is not None:
+      checkpoint = best_checkpoint(save_dir)
+    temperature = read_temperature(save_dir, self.hparams.num_classes,
+                                   checkpoint)
+    return calibrated_top_k(logits, k, temperature)
+
   def build_graph(self, batched_data):
     raise NotImplementedError
 
+def float32_master_getter(getter, *args, **kwargs):
+  '''custom getter for reduced precision training
+
+  Trainable variables are stored in float32 and cast to the requested dtype
+  on read, so the optimizer always updates float32 master weights.
+  '''
+  dtype = kwargs.get('dtype')
+  if not kwargs.get('trainable', True) or dtype in (None, tf.float32):
+    return getter(*args, **kwargs)
+  kwargs['dtype'] = tf.float32
+  return tf.cast(getter(*args, **kwargs), dtype)
+
+def average_gradients(tower_grads):
+  '''
+  Args
+    tower_grads: one list of (gradient, variable) pairs per tower, all 
+                 towers listing the same variables in the same order
+  Returns
+    list of (gradient, variable), each gradient averaged over the towers
+  '''
+  if len(tower_grads) == 1:
+    return tower_grads[0]
+
+  averaged = []
+  for grads_and_var in zip(*tower_grads):
+    var = grads_and_var[0][1]
+    grads = [g for g, _ in grads_and_var if g is not None]
+    if not grads:
+      grad = None
+    elif isinstance(grads[0], tf.IndexedSlices):
+      # embedding lookups, keep the gradient sparse
+      grad = tf.IndexedSlices(
+                tf.concat([g.values for g in grads], axis=0) / len(grads),
+                tf.concat([g.indices for g in grads], axis=0),
+                grads[0].dense_shape)
+    else:
+      grad = tf.add_n(grads) / len(grads)
+    averaged.append((grad, var))
+  return averaged
+
+def master_variable(weights):
+  '''the variable behind `weights`, which float32_master_getter may have cast'''
+  if isinstance(weights, tf.Variable):
+    return weights
+  for var in tf.trainable_variables():
+    if var.value() is weights.op.inputs[0]:
+      return var
+  raise ValueError('no variable behind %s' % weights.name)
+
+def loss_scale_optimizer(optimizer):
+  '''dynamic loss scaling, float16 gradients underflow without it'''
+  manager = tf.contrib.mixed_precision.ExponentialUpdateLossScaleManager(
+                init_loss_scale=2**15, incr_every_n_steps=2000)
+  return tf.contrib.mixed_precision.LossScaleOptimizer(optimizer, manager)
+
 def conv_block_v2(inputs, kernel_size, num_filters, name, training, 
                batch_norm=False, initializer=None, shortcut=None, reuse=None):
   with tf.variable_scope(name, reuse=reuse):
@@ -76,27 +211,40 @@ def conv_block_v2(inputs, kernel_size, num_filters, name, training,
       conv_out = conv_out + shortcut
     return conv_out
 
+def masked_max_pool(inputs, length):
+  '''global max pooling over the first `length` steps of each sequence
+
+  Args
+    inputs: [batch, len, dim]
+    length: [batch]
+  Returns
+    [batch, dim]
+  '''
+  mask = tf.sequence_mask(length, tf.shape(inputs)[1]) # (batch, len)
+  mask = tf.tile(tf.expand_dims(mask, axis=-1), [1, 1, tf.shape(inputs)[2]])
+  # padded positions never win the max
+  neg_inf = tf.ones_like(inputs) * inputs.dtype.min
+  return tf.reduce_max(tf.where(mask, inputs, neg_inf), axis=1)
+
 class CNNModel(BaseModel):
 
   def bottom(self, data):
     (labels, length, ent_pos, sentence, pos1, pos2) = data
 
     # embedding lookup
-    sentence = tf.nn.embedding_lookup(self.word_embed, sentence)
-    pos1 = tf.nn.embedding_lookup(self.pos1_embed, pos1)
-    pos2 = tf.nn.embedding_lookup(self.pos2_embed, pos2)
+    sentence = tf.cast(self.embed_words(sentence), self.dtype)
+    pos1 = tf.cast(tf.nn.embedding_lookup(self.pos1_embed, pos1), self.dtype)
+    pos2 = tf.cast(tf.nn.embedding_lookup(self.pos2_embed, pos2), self.dtype)
 
     sentence = tf.layers.dropout(sentence, self.hparams.dropout_rate, training=self.is_train)
 
     return labels, length, ent_pos, sentence, pos1, pos2
   
-  def conv_shallow(self, inputs, name='conv_block'):
+  def conv_shallow(self, inputs, length, name='conv_block'):
     conv_out = conv_block_v2(inputs, self.hparams.kernel_size, 
                   self.hparams.num_filters, name,training=self.is_train, 
                   reuse=tf.AUTO_REUSE)
-    max_len = self.hparams.max_len
-    pool_out = tf.layers.max_pooling1d(conv_out, max_len, max_len, padding='same')
-    pool_out = tf.squeeze(pool_out, axis=1)
+    pool_out = masked_max_pool(conv_out, length)
     return pool_out
 
   def compute_logits(self, sentence, length, ent_pos, pos1, pos2, regularizer=None):
@@ -104,14 +252,16 @@ class CNNModel(BaseModel):
 
     entities = self.slice_entity(inputs, ent_pos, length)
     depth = self.hparams.word_embed_size + 2*self.hparams.pos_dim
-    scaled_entities = multihead_attention(entities, inputs, None, depth, 
-                                  depth, depth, 10, reuse=tf.AUTO_REUSE,
-                                  name='ent-mh-att')
+    bias = attention_bias_lengths(length, tf.shape(inputs)[1], inputs.dtype)
+    scaled_entities = multihead_attention(entities, sentence, bias, depth, 
+                                  depth, depth, 10, 
+                                  memory_static=self.position_kv(pos1, pos2),
+                                  reuse=tf.AUTO_REUSE, name='ent-mh-att')
     ent_out = tf.nn.relu(scaled_entities)
     ent_out = tf.reduce_max(ent_out, axis=1)
-    # ent_out = self.conv_shallow(scaled_entities, 'conv_ent')
+    # ent_out = self.conv_shallow(scaled_entities, length, 'conv_ent')
 
-    conv_out = self.conv_shallow(inputs)
+    conv_out = self.conv_shallow(inputs, length)
     # conv_out = self.conv_deep(inputs)
 
     out = tf.concat([ent_out, conv_out], axis=1)
@@ -123,8 +273,21 @@ class CNNModel(BaseModel):
     logits = tf.layers.dense(out, self.hparams.num_classes, 
                         name='logits-%d' % self.hparams.num_classes,
                         kernel_regularizer=regularizer, reuse=tf.AUTO_REUSE)
-    return logits
+    # softmax and KL stay in float32
+    return tf.cast(logits, tf.float32)
   
+  def position_kv(self, pos1, pos2):
+    '''key/value projection of the position embeddings, computed once and 
+    shared by the clean and the adversarial passes
+    '''
+    key = (pos1, pos2)
+    if key not in self.pos_kv:
+      depth = self.hparams.word_embed_size + 2*self.hparams.pos_dim
+      self.pos_kv[key] = precompute_memory_kv(tf.concat([pos1, pos2], axis=2),
+                                  depth, depth, depth, reuse=tf.AUTO_REUSE,
+                                  name='ent-mh-att')
+    return self.pos_kv[key]
+
   def slice_entity(self, inputs, ent_pos, length):
     '''
     Args
@@ -144,7 +307,8 @@ class CNNModel(BaseModel):
     
     depth = self.hparams.word_embed_size + 2*self.hparams.pos_dim
 
-    entities = slice_batch_n(inputs, [begin1, begin2], [size1, size2])
+    entities = slice_batch_n(inputs, [begin1, begin2], [size1, size2],
+                             dtype=inputs.dtype)
     entities.set_shape(tf.TensorShape([None, None, depth]))
 
     return entities
@@ -159,7 +323,8 @@ class CNNModel(BaseModel):
 
     return tf.reduce_mean(cross_entropy)
   
-  def build_graph(self, data):
+  def compute_loss(self, data):
+    '''loss, accuracy, predictions, logits and labels of one batch'''
     labels, length, ent_pos, sentence, pos1, pos2 = self.bottom(data)
 
     # cross entropy loss
@@ -175,8 +340,7 @@ class CNNModel(BaseModel):
     # loss_vadv = virtual_adversarial_loss(logits, sentence, length, ent_pos, pos1, pos2, self.compute_logits)
 
     # l2 loss
-    regularization_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
-    loss_l2 = sum(regularization_losses)
+    loss_l2 = sum(self.l2_regularizer(w) for w in self.regularized_weights)
     # l2_losses = []
     # for var in tf.trainable_variables():
     #   l2_losses.append(tf.nn.l2_loss(var))
@@ -188,19 +352,50 @@ class CNNModel(BaseModel):
       acc = tf.cast(tf.equal(pred, labels), tf.float32)
       acc = tf.reduce_mean(acc)
 
-    self.tensors['acc'] = acc
-    self.tensors['loss'] = loss_xent + loss_l2 # + loss_adv + loss_vadv
-    self.tensors['pred'] = pred
+    loss = loss_xent + loss_l2 # + loss_adv + loss_vadv
+    return loss, acc, pred, logits, labels
 
-    self.maybe_build_train_op()
+  def build_graph(self, data):
+    '''
+    Args
+      data: a batch, or a list of batches, one per data-parallel replica
+    '''
+    tower_data = data if isinstance(data, list) else [data]
+    loss, acc, pred, logits, labels = self.compute_loss(tower_data[0])
 
-  def maybe_build_train_op(self):
+    self.tensors['acc'] = acc
+    self.tensors['loss'] = loss
+    self.tensors['pred'] = pred
+    self.tensors['logits'] = logits
+    self.tensors['labels'] = labels
+    if not self.is_train:
+      _, self.tensors['top_ids'], self.tensors['top_probs'] = self.top_k(logits)
+
+    self.maybe_build_train_op(tower_data[1:])
+
+  def tower_losses(self, tower_data):
+    '''loss and accuracy of one replica per batch, all sharing the variables'''
+    losses, accs = [], []
+    for i, data in enumerate(tower_data):
+      with tf.name_scope('tower_%d' % i):
+        with tf.variable_scope(self.scope, reuse=True):
+          loss, acc = self.compute_loss(data)[:2]
+      losses.append(loss)
+      accs.append(acc)
+    return losses, accs
+
+  def maybe_build_train_op(self, tower_data=()):
     if not self.is_train:
       return
 
     self.train_ops = dict()
-    loss = self.tensors['loss']
-    self.train_ops['train_loss'] = self.optimize(loss, self.hparams.learning_rate)
+    losses, accs = self.tower_losses(tower_data)
+    losses.insert(0, self.tensors['loss'])
+    accs.insert(0, self.tensors['acc'])
+    self.train_ops['train_loss'] = self.optimize(losses, self.hparams.learning_rate)
+    if tower_data:
+      self.tensors['loss'] = tf.add_n(losses) / len(losses)
+      self.tensors['acc'] = tf.add_n(accs) / len(accs)
 
   def train_epoch(self, session, num_batches_per_epoch):
     if not self.is_train:
@@ -217,42 +412,99 @@ class CNNModel(BaseModel):
    
     return np.mean(moving_loss), np.mean(moving_acc)*100
   
+  def build_train_n_steps(self, data_iters, num_steps):
+    '''run `num_steps` optimizer steps per train_step() call inside a 
+    tf.while_loop, each step pulls its own batch from every iterator of 
+    `data_iters` (one per replica)
+    '''
+    def step_fn():
+      losses, accs = self.tower_losses([it.get_next() for it in data_iters])
+      return (self.apply_gradients(losses), 
+              tf.add_n(losses) / len(losses), tf.add_n(accs) / len(accs))
+
+    def body(step, loss_sum, acc_sum):
+      train_op, loss, acc = step_fn()
+      with tf.control_dependencies([train_op]):
+        return step + 1, loss_sum + loss, acc_sum + acc
+
+    with tf.name_scope('train_n_steps'):
+      _, loss_sum, acc_sum = tf.while_loop(lambda step, *_: step < num_steps,
+                    body, [tf.constant(0), tf.constant(0.), tf.constant(0.)],
+                    parallel_iterations=1, back_prop=False)
+    self.tensors['n_steps_loss'] = loss_sum / num_steps
+    self.tensors['n_steps_acc'] = acc_sum / num_steps
+    self.steps_per_run = num_steps
+
   def train_step(self, session):
+    '''one session.run: a single step, or `steps_per_run` steps when 
+    build_train_n_steps() was called; returns their mean loss and acc
+    '''
     if not self.is_train:
       return
 
+    if 'n_steps_loss' in self.tensors:
+      fetches = [self.tensors['n_steps_loss'], self.tensors['n_steps_acc']]
+      return session.run(fetches)
+
     fetches = [self.train_ops['train_loss'], self.tensors['loss'], self.tensors['acc']]
     _, loss, acc = session.run(fetches)
 
     return loss, acc
 
 
-  def evaluate(self, session, test_ds_iter, num_batches):
+  def evaluate(self, session, test_ds_iter, relations=None):
+    '''one pass over the whole test set
+
+    Returns
+      EvalResult with the predictions, probabilities, accuracy and, given the
+      relation names, the SemEval macro-F1
+    '''
     if self.is_train:
       return
 
-    session.run(test_ds_iter.initializer)
+    return evaluate(session, test_ds_iter, self.tensors, relations)
 
-    moving_acc = []
-    for batch in range(num_batches):
-      acc = session.run(self.tensors['acc'])
-      moving_acc.append(acc)
-    
-    return np.mean(moving_acc)*100
-  
-  def pred_results(self, session, test_ds_iter, num_batches):
-    if self.is_train:
-      return
 
-    session.run(test_ds_iter.initializer)
+class CNNInferenceModel(CNNModel):
+  '''the logits of unlabeled batches alone, without loss, adversarial branch
+  or train op, for export'''
+
+  def __init__(self, hparams, ini_word_embed, inputs, quantized=None):
+    '''
+    Args
+      quantized: dict of variable name => QuantizedWeight, these weights are
+                 dequantized from constants, see models/quantize.py
+    '''
+    self.quantized = quantized or {}
+    super().__init__(hparams, ini_word_embed, inputs, is_train=False)
+
+  def variable_getter(self, getter, *args, **kwargs):
+    var = float32_master_getter(getter, *args, **kwargs)
+    weight = self.quantized.get(kwargs['name'])
+    if weight is None:
+      return var
+    return tf.cast(dequantized_tensor(weight), var.dtype.base_dtype)
+
+  def embed_words(self, ids):
+    weight = self.quantized.get(self.word_embed.op.name)
+    if weight is None:
+      return super().embed_words(ids)
+    return dequantized_lookup(weight, ids)
 
-    all_pred = []
-    for batch in range(num_batches):
-      pred = session.run(self.tensors['pred'])
-      all_pred.append(pred)
-    all_pred = np.concatenate(all_pred)
+  def build_graph(self, data):
+    '''
+    Args
+      data: (length, ent_pos, sentence, pos1, pos2), a batch without labels
+    '''
+    _, length, ent_pos, sentence, pos1, pos2 = self.bottom((None,) + tuple(data))
+    logits = self.compute_logits(sentence, length, ent_pos, pos1, pos2)
 
-    return all_pred
+    probs, top_ids, top_probs = self.top_k(logits)
+    self.tensors['logits'] = tf.identity(logits, name='logits')
+    self.tensors['probs'] = tf.identity(probs, name='probs')
+    self.tensors['pred'] = tf.argmax(logits, axis=1, name='pred')
+    self.tensors['top_ids'] = tf.identity(top_ids, name='top_ids')
+    self.tensors['top_probs'] = tf.identity(top_probs, name='top_probs')
 
 
 def build_train_valid_model(hparams, ini_word_embed, train_data, test_data):
@@ -263,3 +515,16 @@ def build_train_valid_model(hparams, ini_word_embed, train_data, test_data):
     with tf.variable_scope('CNNModel', reuse=True):
       m_valid = CNNModel(hparams, ini_word_embed, test_data, is_train=False)
   return m_train, m_valid
+
+def build_valid_model(hparams, ini_word_embed, test_data):
+  '''the valid model alone, for evaluating checkpoints in another process'''
+  with tf.name_scope('Valid'):
+    with tf.variable_scope('CNNModel', reuse=tf.AUTO_REUSE):
+      m_valid = CNNModel(hparams, ini_word_embed, test_data, is_train=False)
+  return m_valid
+
+def build_inference_model(hparams, ini_word_embed, inputs, quantized=None):
+  '''the model to export, variables named like the trained one'''
+  with tf.variable_scope('CNNModel'):
+    m_infer = CNNInferenceModel(hparams, ini_word_embed, inputs, quantized)
+  return m_infer
@@ -0,0 +1,178 @@
+'''
+Evaluation of a whole test set in one pass.
+
+  result = evaluate(session, test_iter, m_valid.tensors, relations)
+  result.acc, result.macro_f1, result.pred, result.probs
+
+The logits, labels and, for the tagging models, the tags and lengths of every
+batch are fetched together until the iterator is exhausted; accuracy, the
+confusion matrix, the SemEval macro-F1 and the tag chunk F1 are then computed
+from the concatenated arrays with NumPy. Accuracies and F1 scores are
+fractions.
+'''
+import collections
+import numpy as np
+import tensorflow as tf
+
+
+# fetched when the model has them
+EVAL_TENSORS = ('logits', 'labels', 'lengths', 'tags', 'pred_tags')
+
+
+def evaluate(session, test_iter, tensors, relations=None, vocab_tags=None,
+             num_batches=None):
+  '''
+  Args
+    tensors: tensors of the valid model, `logits` and `labels` are required
+    relations: relation names by label id, for the macro-F1
+    vocab_tags: dict of tag => id, for the chunk F1
+    num_batches: stop early, None runs the whole test set
+  Returns
+    EvalResult
+  '''
+  arrays = run_pass(session, test_iter, tensors, num_batches)
+  return EvalResult(arrays, relations, vocab_tags)
+
+def run_pass(session, test_iter, tensors, num_batches=None):
+  '''dict of name => array over all the batches of `test_iter`'''
+  fetches = {name: tensors[name] for name in EVAL_TENSORS if name in tensors}
+  session.run(test_iter.initializer)
+  batches = collections.defaultdict(list)
+  batch = 0
+  while num_batches is None or batch < num_batches:
+    try:
+      values = session.run(fetches)
+    except tf.errors.OutOfRangeError:
+      break
+    for name, value in values.items():
+      batches[name].append(value)
+    batch += 1
+  return {name: _concat(values) for name, values in batches.items()}
+
+def _concat(batches):
+  # padded sequences are as long as the longest one of their batch
+  if batches[0].ndim > 1:
+    width = max(b.shape[1] for b in batches)
+    batches = [np.pad(b, [(0, 0), (0, width - b.shape[1])] +
+                         [(0, 0)]*(b.ndim - 2), 'constant')
+                 for b in batches]
+  return np.concatenate(batches)
+
+
+class EvalResult(object):
+  '''the fetched arrays of the test set and the metrics computed from them'''
+
+  def __init__(self, arrays, relations=None, vocab_tags=None):
+    self.logits = arrays['logits']
+    self.labels = arrays['labels']
+    self.lengths = arrays.get('lengths')
+    self.probs = softmax(self.logits)
+    self.pred = np.argmax(self.logits, axis=1)
+    self.num_examples = len(self.labels)
+
+    self.acc = np.mean(self.pred == self.labels)
+    self.confusion = confusion_matrix(self.labels, self.pred,
+                                      self.logits.shape[1])
+    self.relation_f1, self.macro_f1 = None, None
+    if relations is not None:
+      self.relation_f1 = relation_f1(self.confusion, relations)
+      self.macro_f1 = (np.mean(list(self.relation_f1.values())) 
+                         if self.relation_f1 else 0.)
+
+    self.tags = arrays.get('tags')
+    self.pred_tags = arrays.get('pred_tags')
+    self.tag_acc, self.chunk_f1 = None, None
+    if self.tags is not None:
+      mask = np.arange(self.tags.shape[1]) < self.lengths[:, None]
+      hits = np.sum((self.tags == self.pred_tags) & mask, axis=1)
+      self.tag_acc = np.mean(hits / np.maximum(self.lengths, 1))
+      if vocab_tags is not None:
+        self.chunk_f1 = chunk_f1(self.tags, self.pred_tags, self.lengths,
+                                 vocab_tags)
+
+
+def softmax(logits):
+  exp = np.exp(logits - np.max(logits, axis=-1, keepdims=True))
+  return exp / np.sum(exp, axis=-1, keepdims=True)
+
+def confusion_matrix(labels, pred, num_classes):
+  '''counts of gold label (row) by predicted label (column)'''
+  counts = np.bincount(labels * num_classes + pred,
+                       minlength=num_classes * num_classes)
+  return counts.reshape(num_classes, num_classes)
+
+def _safe_div(a, b):
+  return np.divide(a, b, out=np.zeros_like(a, dtype=np.float64), where=b > 0)
+
+def relation_f1(confusion, relations, other='Other'):
+  '''F1 of each relation type but `other`, as in the official SemEval-2010
+  task 8 scorer: a prediction is only correct with the right direction, a
+  wrong direction still counts as a prediction of its type. Like the
+  scorer, types without a gold example are left out, so they don't drag
+  the macro-F1 down
+
+  Args
+    relations: names like Cause-Effect(e1,e2), by label id
+  Returns
+    dict of relation type => F1
+  '''
+  types = [rel.split('(')[0] for rel in relations]
+  names = sorted(set(types) - set([other]))
+  # `other` is the last type
+  type_ids = np.array([names.index(t) if t != other else len(names)
+                         for t in types])
+  one_hot = np.eye(len(names) + 1)[type_ids]
+  collapsed = one_hot.T.dot(confusion).dot(one_hot)
+
+  correct = np.bincount(type_ids, weights=np.diag(confusion),
+                        minlength=len(names) + 1)
+  gold = collapsed.sum(axis=1)
+  p = _safe_div(correct, collapsed.sum(axis=0))
+  r = _safe_div(correct, gold)
+  f1 = _safe_div(2*p*r, p + r)
+  return {name: f1[i] for i, name in enumerate(names) if gold[i] > 0}
+
+def tag_chunks(tags, lengths, vocab_tags, default_tag='O'):
+  '''chunks of the padded tag sequences, a chunk starts at a B- tag or at a
+  change of type and runs up to the next start or `default_tag`
+
+  Returns
+    one int64 key per chunk, encoding (sentence, start, end, chunk type)
+  '''
+  id2tag = {idx: tag for tag, idx in vocab_tags.items()}
+  type_names = sorted(set(tag.split('-', 1)[-1] for tag in id2tag.values()))
+  tag_type = np.zeros(max(id2tag) + 1, np.int64)
+  tag_begin = np.zeros(max(id2tag) + 1, np.bool_)
+  for idx, tag in id2tag.items():
+    tag_type[idx] = type_names.index(tag.split('-', 1)[-1])
+    tag_begin[idx] = tag.split('-')[0] == 'B'
+
+  num_seqs, max_len = tags.shape
+  inside = ((np.arange(max_len) < lengths[:, None]) &
+            (tags != vocab_tags[default_tag]))
+  types = tag_type[tags]
+  prev_inside = np.pad(inside[:, :-1], [(0, 0), (1, 0)], 'constant')
+  prev_types = np.pad(types[:, :-1], [(0, 0), (1, 0)], 'constant')
+  start = inside & (~prev_inside | (types != prev_types) | tag_begin[tags])
+
+  # a chunk ends at the next start or outside position
+  boundary = np.concatenate([start | ~inside,
+                             np.ones([num_seqs, 1], np.bool_)], axis=1)
+  positions = np.where(boundary, np.arange(max_len + 1), max_len)
+  next_boundary = np.minimum.accumulate(positions[:, ::-1], axis=1)[:, ::-1]
+
+  seqs, starts = np.nonzero(start)
+  ends = next_boundary[seqs, starts + 1]
+  width = max_len + 1
+  return (((seqs * width + starts) * width + ends) * len(type_names) +
+          types[seqs, starts])
+
+def chunk_f1(tags, pred_tags, lengths, vocab_tags):
+  gold = tag_chunks(tags, lengths, vocab_tags)
+  pred = tag_chunks(pred_tags, lengths, vocab_tags)
+  correct = len(np.intersect1d(gold, pred))
+  if correct == 0:
+    return 0.
+  p = correct / len(pred)
+  r = correct / len(gold)
+  return 2 * p * r / (p + r)
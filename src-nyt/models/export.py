@@ -0,0 +1,112 @@
+'''
+Inference-only export of a trained relation classifier.
+
+  export_model(session, inputs, outputs, 'exported/semeval')
+  session, inputs, outputs = load_classifier('exported/semeval')
+
+The model rebuilt for inference has no loss, dropout, adversarial branch,
+optimizer or dataset iterator. Its variables, frozen embedding included, are
+turned into constants, the constants folded and the training and unused
+nodes stripped. The constants of quantized weights are not folded, that
+would store them as float32 again, see models/quantize.py. The result is
+written twice
+
+  frozen_graph.pb     the bare GraphDef, inputs and outputs by node name
+  saved_model/        a SavedModel with the same graph and a `classify`
+                      signature, loaded by load_classifier()
+'''
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+SIGNATURE = 'classify'
+FROZEN_GRAPH_FILE = 'frozen_graph.pb'
+SAVED_MODEL_DIR = 'saved_model'
+
+TRANSFORMS = ['remove_nodes(op=Identity, op=CheckNumerics)',
+              'fold_constants(ignore_errors=true)',
+              'fold_batch_norms',
+              'strip_unused_nodes',
+              'sort_by_execution_order']
+
+
+def freeze(session, inputs, outputs, fold_constants=True):
+  '''
+  Args
+    inputs, outputs: dicts of name => tensor, named after their nodes
+    fold_constants: False keeps quantized weights quantized
+  Returns
+    the folded GraphDef of the outputs
+  '''
+  input_nodes = [t.op.name for t in inputs.values()]
+  output_nodes = [t.op.name for t in outputs.values()]
+  graph_def = tf.graph_util.convert_variables_to_constants(
+                  session, session.graph.as_graph_def(), output_nodes)
+  graph_def = tf.graph_util.remove_training_nodes(graph_def, output_nodes)
+  transforms = [t for t in TRANSFORMS
+                  if fold_constants or not t.startswith('fold_constants')]
+  return TransformGraph(graph_def, input_nodes, output_nodes, transforms)
+
+def export_model(session, inputs, outputs, export_dir, fold_constants=True):
+  '''writes the frozen GraphDef and the SavedModel of the outputs'''
+  graph_def = freeze(session, inputs, outputs, fold_constants)
+  tf.gfile.MakeDirs(export_dir)
+  tf.train.write_graph(graph_def, export_dir, FROZEN_GRAPH_FILE,
+                       as_text=False)
+
+  saved_model_dir = os.path.join(export_dir, SAVED_MODEL_DIR)
+  if tf.gfile.Exists(saved_model_dir):
+    tf.gfile.DeleteRecursively(saved_model_dir)
+  with tf.Graph().as_default() as graph:
+    tf.import_graph_def(graph_def, name='')
+    tensor = lambda t: graph.get_tensor_by_name(t.name)
+    signature = tf.saved_model.signature_def_utils.predict_signature_def(
+                    {k: tensor(t) for k, t in inputs.items()},
+                    {k: tensor(t) for k, t in outputs.items()})
+    builder = tf.saved_model.builder.SavedModelBuilder(saved_model_dir)
+    with tf.Session(graph=graph) as sess:
+      builder.add_meta_graph_and_variables(sess,
+                          [tf.saved_model.tag_constants.SERVING],
+                          signature_def_map={SIGNATURE: signature})
+    builder.save()
+  tf.logging.info('exported %d nodes to %s' %
+                  (len(graph_def.node), export_dir))
+
+def load_classifier(export_dir, config=None):
+  '''
+  Returns
+    session of the SavedModel and the dicts of name => tensor of the inputs
+    and outputs of its `classify` signature
+  '''
+  session = tf.Session(graph=tf.Graph(), config=config)
+  meta_graph = tf.saved_model.loader.load(session,
+                      [tf.saved_model.tag_constants.SERVING],
+                      os.path.join(export_dir, SAVED_MODEL_DIR))
+  signature = meta_graph.signature_def[SIGNATURE]
+  tensor = session.graph.get_tensor_by_name
+  inputs = {k: tensor(v.name) for k, v in signature.inputs.items()}
+  outputs = {k: tensor(v.name) for k, v in signature.outputs.items()}
+  return session, inputs, outputs
+
+def time_classifier(export_dir, feed, num_requests=100):
+  '''seconds to load the SavedModel and the median and 99th percentile
+  seconds of a request
+
+  Args
+    feed: dict of input name => array, one request
+  '''
+  start_time = time.time()
+  session, inputs, outputs = load_classifier(export_dir)
+  startup = time.time() - start_time
+
+  feed = {inputs[k]: v for k, v in feed.items()}
+  session.run(outputs, feed) # warm up
+  latency = []
+  for _ in range(num_requests):
+    start_time = time.time()
+    session.run(outputs, feed)
+    latency.append(time.time() - start_time)
+  session.close()
+  return startup, np.percentile(latency, 50), np.percentile(latency, 99)
@@ -0,0 +1,146 @@
+'''
+Per-op profiling of a window of training steps.
+
+  profiler = StepProfiler('profile/', start_step=20, num_steps=5)
+  train_sess = profiler.wrap(sess)   # pass train_sess to the training loop
+
+Every session.run of the wrapped session counts as a step, the ones inside
+the window run with a full trace. When the window closes the profiler
+
+  * writes the merged chrome timeline of the window to timeline.ctf.json,
+    open it from chrome://tracing
+  * writes the tf.profiler time and memory reports, by op type and by name
+    scope, to ops.txt and scopes.txt
+  * prints the top-N ops by total time
+
+Training that ends, or fails, inside the window gets the same reports of
+the steps traced so far from close(), which runs at exit.
+'''
+import os
+import json
+import atexit
+import collections
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+def profiled(session, out_dir, start_step=10, num_steps=5, top_n=20):
+  '''`session` traced by a StepProfiler, unchanged if num_steps is 0'''
+  if num_steps <= 0:
+    return session
+  return StepProfiler(out_dir, start_step, num_steps, top_n).wrap(session)
+
+
+class StepProfiler(object):
+
+  def __init__(self, out_dir, start_step=10, num_steps=5, top_n=20):
+    '''
+    Args
+      start_step: steps to skip first, they include the warm up
+      num_steps: steps traced
+      top_n: ops printed by report()
+    '''
+    self.out_dir = out_dir
+    self.start_step = start_step
+    self.num_steps = num_steps
+    self.top_n = top_n
+
+    self.step = 0
+    self.traced = [] # (step, RunMetadata)
+    self._profiler = None
+
+  def wrap(self, session):
+    return _ProfiledSession(session, self)
+
+  def tracing(self):
+    return self.start_step <= self.step < self.start_step + self.num_steps
+
+  def run(self, session, fetches, feed_dict=None, options=None,
+          run_metadata=None):
+    if not self.tracing() or options is not None or run_metadata is not None:
+      self.step += 1
+      return session.run(fetches, feed_dict, options, run_metadata)
+
+    options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    run_metadata = tf.RunMetadata()
+    results = session.run(fetches, feed_dict, options, run_metadata)
+
+    if self._profiler is None:
+      self._profiler = tf.profiler.Profiler(session.graph)
+      atexit.register(self.close)
+    self._profiler.add_step(self.step, run_metadata)
+    self.traced.append((self.step, run_metadata))
+
+    self.step += 1
+    if self.step == self.start_step + self.num_steps:
+      self.report()
+    return results
+
+  def report(self):
+    if not self.traced:
+      return
+    tf.gfile.MakeDirs(self.out_dir)
+    self._write_timeline(os.path.join(self.out_dir, 'timeline.ctf.json'))
+    self._write_profiles()
+    self._print_top_ops()
+    self.traced = []
+
+  def close(self):
+    '''reports the steps of a window that did not close'''
+    self.report()
+
+  def _write_timeline(self, path):
+    # timestamps are absolute, so the events of the steps line up one
+    # after another in a single trace
+    events = []
+    for _, run_metadata in self.traced:
+      trace = timeline.Timeline(step_stats=run_metadata.step_stats)
+      trace = json.loads(trace.generate_chrome_trace_format())
+      events.extend(trace['traceEvents'])
+    with tf.gfile.GFile(path, 'w') as f:
+      json.dump({'traceEvents': events}, f)
+
+  def _write_profiles(self):
+    builder = tf.profiler.ProfileOptionBuilder
+    options = (builder(builder.time_and_memory())
+                 .order_by('micros')
+                 .with_file_output(os.path.join(self.out_dir, 'ops.txt'))
+                 .build())
+    self._profiler.profile_operations(options)
+
+    options = (builder(builder.time_and_memory())
+                 .order_by('micros')
+                 .with_file_output(os.path.join(self.out_dir, 'scopes.txt'))
+                 .build())
+    self._profiler.profile_name_scope(options)
+
+  def _print_top_ops(self):
+    total = collections.Counter() # node name => micros
+    for _, run_metadata in self.traced:
+      for dev_stats in run_metadata.step_stats.dev_stats:
+        for node in dev_stats.node_stats:
+          total[node.node_name] += node.all_end_rel_micros
+
+    num_steps = len(self.traced)
+    all_micros = max(sum(total.values()), 1)
+    print('top %d ops over %d steps' % (self.top_n, num_steps))
+    print('%10s %10s %6s  %s' % ('total ms', 'ms/step', '%', 'op'))
+    for name, micros in total.most_common(self.top_n):
+      print('%10.2f %10.2f %6.2f  %s' % (micros/1000, micros/1000/num_steps,
+                                         100*micros/all_micros, name))
+
+
+class _ProfiledSession(object):
+  '''session whose run() goes through the profiler, everything else is
+  forwarded to the wrapped session'''
+
+  def __init__(self, session, profiler):
+    self._session = session
+    self._profiler = profiler
+
+  def run(self, fetches, feed_dict=None, options=None, run_metadata=None):
+    return self._profiler.run(self._session, fetches, feed_dict,
+                              options, run_metadata)
+
+  def __getattr__(self, name):
+    return getattr(self._session, name)
@@ -0,0 +1,107 @@
+'''
+Post-training weight quantization for inference.
+
+  weights = quantize_weights(session, kernels='int8')   # or 'float16'
+  m_infer = build_inference_model(hparams, ini_word_embed, inputs, weights)
+
+The frozen word embedding is stored as int8 with one float32 scale per row
+and dequantized after the lookup, so only the looked up rows are. The conv
+and dense kernels are stored as int8 with one scale per output channel, or
+as float16, and dequantized when read. The int8 quantization is symmetric,
+a row x is stored as round(x / s) with s = max|x| / 127.
+
+To measure the accuracy drift, load_values() puts the dequantized values
+back into the float32 variables of a model, its predictions are then those
+of the quantized graph.
+'''
+import collections
+import numpy as np
+import tensorflow as tf
+
+KERNEL_MODES = ['int8', 'float16']
+
+# scale is None for float16 values
+QuantizedWeight = collections.namedtuple('QuantizedWeight', 'values scale')
+
+
+def quantize_int8(array, axis):
+  '''
+  Args
+    axis: the axis with one scale per index, rows of the embedding, output
+          channels of a kernel
+  Returns
+    QuantizedWeight, the scales keep the other axes with size 1
+  '''
+  array = np.asarray(array, np.float32)
+  other = tuple(i for i in range(array.ndim) if i != axis % array.ndim)
+  max_abs = np.max(np.abs(array), axis=other, keepdims=True)
+  scale = np.where(max_abs > 0, max_abs / 127., 1.).astype(np.float32)
+  values = np.clip(np.round(array / scale), -127, 127).astype(np.int8)
+  return QuantizedWeight(values, scale)
+
+def dequantize(weight):
+  values = weight.values.astype(np.float32)
+  if weight.scale is None:
+    return values
+  return values * weight.scale
+
+def is_word_embed(var):
+  return var.op.name.endswith('word_embed')
+
+def is_kernel(var):
+  return var.op.name.endswith('/kernel')
+
+def quantize_weights(session, kernels='int8'):
+  '''
+  Args
+    kernels: 'int8' or 'float16'
+  Returns
+    dict of variable name => QuantizedWeight of the word embedding and the
+    kernels of the model restored in `session`
+  '''
+  weights = {}
+  for var in tf.global_variables():
+    if is_word_embed(var):
+      weights[var.op.name] = quantize_int8(session.run(var), axis=0)
+    elif is_kernel(var):
+      value = session.run(var)
+      if kernels == 'int8':
+        weights[var.op.name] = quantize_int8(value, axis=-1)
+      else:
+        weights[var.op.name] = QuantizedWeight(value.astype(np.float16), None)
+  return weights
+
+def quantized_bytes(weights):
+  '''bytes of the weights as float32 and quantized'''
+  float_bytes, q_bytes = 0, 0
+  for weight in weights.values():
+    float_bytes += weight.values.size * 4
+    q_bytes += weight.values.nbytes
+    if weight.scale is not None:
+      q_bytes += weight.scale.nbytes
+  return float_bytes, q_bytes
+
+def read_values(session, names):
+  '''dict of variable name => value of the variables `names`'''
+  return {var.op.name: session.run(var) for var in tf.global_variables()
+            if var.op.name in names}
+
+def load_values(session, values):
+  '''assigns the dict of variable name => value to the variables'''
+  for var in tf.global_variables():
+    if var.op.name in values:
+      var.load(np.asarray(values[var.op.name],
+                          var.dtype.base_dtype.as_numpy_dtype), session)
+
+def dequantized_tensor(weight):
+  '''float32 tensor of a quantized kernel'''
+  values = tf.cast(tf.constant(weight.values), tf.float32)
+  if weight.scale is None:
+    return values
+  return values * tf.constant(weight.scale)
+
+def dequantized_lookup(weight, ids):
+  '''rows `ids` of a quantized embedding, float32'''
+  values = tf.gather(tf.constant(weight.values), ids)
+  scale = tf.gather(tf.constant(weight.scale), ids)
+  return tf.cast(values, tf.float32) * scale
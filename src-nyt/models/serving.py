@@ -0,0 +1,238 @@
+'''
+Micro-batching of concurrent requests to an exported classifier.
+
+  session, inputs, outputs = load_classifier(export_dir)
+  batcher = MicroBatcher(session, inputs, outputs, max_batch_size=64,
+                         max_latency_ms=5, queue_size=1024)
+  batcher.start()
+  batcher.submit(features, reply)    # from any thread
+
+A request is a dict of signature input name => array of one example, like
+{'length': 12, 'ent_pos': [..], 'sentence': [..], ..}. The batcher thread
+waits for a first request, then gathers more until the batch is full or
+the first one has waited `max_latency_ms`, pads them into one batch, runs
+it and calls every `reply(outputs)` with the dict of output name => row of
+its request. A reply that raises is logged and the batcher goes on. The
+queue holds at most `queue_size` requests: submit() waits up to `timeout`
+secs for room and raises Overloaded, the caller passes the backpressure on
+to its client. check() rejects a request that does not fit the signature,
+or whose ids, length or ent_pos are out of range, before it is queued,
+where it would fail its whole batch.
+
+ServingStats keeps the latency of every request, from submit() to reply,
+and the number of requests of every batch.
+'''
+import time
+import queue
+import threading
+import collections
+import numpy as np
+import tensorflow as tf
+
+
+class Overloaded(Exception):
+  '''the request queue stayed full'''
+
+
+class ServingStats(object):
+
+  def __init__(self, window=100000):
+    '''
+    Args
+      window: latencies kept for the percentiles, the most recent ones
+    '''
+    self.lock = threading.Lock()
+    self.latency = collections.deque(maxlen=window)
+    self.batch_sizes = collections.Counter()
+    self.num_requests = 0
+    self.num_rejected = 0
+
+  def add_batch(self, latencies):
+    with self.lock:
+      self.latency.extend(latencies)
+      self.batch_sizes[len(latencies)] += 1
+      self.num_requests += len(latencies)
+
+  def add_rejected(self):
+    with self.lock:
+      self.num_rejected += 1
+
+  def summary(self):
+    '''dict of the request counts, latency percentiles in ms and the
+    histogram of batch size => batches'''
+    with self.lock:
+      latency = np.array(self.latency) * 1000
+      batch_sizes = dict(self.batch_sizes)
+      num_requests, num_rejected = self.num_requests, self.num_rejected
+    percentile = lambda q: float(np.percentile(latency, q)) if len(latency) else 0.
+    num_batches = sum(batch_sizes.values())
+    return {'requests': num_requests, 'rejected': num_rejected,
+            'batches': num_batches,
+            'mean_batch_size': num_requests / max(num_batches, 1),
+            'latency_ms_p50': percentile(50), 'latency_ms_p99': percentile(99),
+            'batch_size_hist': {str(k): batch_sizes[k]
+                                  for k in sorted(batch_sizes)}}
+
+
+Request = collections.namedtuple('Request', 'features reply enqueued')
+
+
+class MicroBatcher(object):
+
+  def __init__(self, session, inputs, outputs, max_batch_size=64,
+               max_latency_ms=5., queue_size=1024, stats=None,
+               value_ranges=None):
+    '''
+    Args
+      inputs, outputs: dicts of name => tensor of the signature
+      max_latency_ms: longest wait of the first request of a batch for
+                      the others
+      value_ranges: dict of input name => (low, high) of its values, high
+                    excluded, like the vocab size of the word ids
+    '''
+    self.session = session
+    self.inputs = inputs
+    self.outputs = outputs
+    self.value_ranges = value_ranges or {}
+    self.max_batch_size = max_batch_size
+    self.max_latency = max_latency_ms / 1000.
+    self.queue = queue.Queue(maxsize=queue_size)
+    self.stats = stats or ServingStats()
+    self._thread = None
+    self._stop = object()
+    self._stopping = False
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, name='micro_batcher')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    '''serves the queued requests, then stops'''
+    self.queue.put(self._stop)
+    self._thread.join()
+
+  def submit(self, features, reply, timeout=None):
+    '''
+    Args
+      reply: called from the batcher thread with the outputs of the request
+      timeout: secs to wait for room in the queue, None waits as long as
+               needed
+    '''
+    try:
+      self.queue.put(Request(features, reply, time.time()), timeout=timeout)
+    except queue.Full:
+      self.stats.add_rejected()
+      raise Overloaded()
+
+  def check(self, features):
+    '''
+    Returns
+      dict of input name => array of the request `features`
+    Raises
+      ValueError when an input of the signature is missing, has a wrong
+      type or rank, or values out of range: ids past `value_ranges`, a
+      `length` longer than the sequences or entities past the `length`
+    '''
+    if not isinstance(features, dict):
+      raise ValueError('features is not an object')
+    missing = [name for name in self.inputs if name not in features]
+    if missing:
+      raise ValueError('missing inputs %s' % ', '.join(sorted(missing)))
+    arrays = {}
+    for name, tensor in self.inputs.items():
+      try:
+        arrays[name] = np.asarray(features[name], tensor.dtype.as_numpy_dtype)
+      except (TypeError, ValueError):
+        raise ValueError('input %s is not a %s array' %
+                         (name, tensor.dtype.name))
+      rank = tensor.shape.ndims
+      if rank is not None and arrays[name].ndim != rank - 1:
+        raise ValueError('input %s has rank %d, not %d' %
+                         (name, arrays[name].ndim, rank - 1))
+    for name, (low, high) in self.value_ranges.items():
+      values = arrays.get(name)
+      if values is not None and values.size and (
+          values.min() < low or values.max() >= high):
+        raise ValueError('input %s is out of range [%d, %d)' %
+                         (name, low, high))
+    if 'length' in arrays:
+      check_length(arrays, self.inputs)
+    return arrays
+
+  def _gather(self):
+    '''the requests of the next batch, None once stopped'''
+    if self._stopping:
+      return None
+    first = self.queue.get()
+    if first is self._stop:
+      return None
+    batch = [first]
+    deadline = first.enqueued + self.max_latency
+    while len(batch) < self.max_batch_size:
+      wait = deadline - time.time()
+      try:
+        if wait > 0:
+          request = self.queue.get(timeout=wait)
+        else:
+          # late already, only take what is queued
+          request = self.queue.get_nowait()
+      except queue.Empty:
+        break
+      if request is self._stop:
+        # stop after this batch
+        self._stopping = True
+        break
+      batch.append(request)
+    return batch
+
+  def _run(self):
+    while True:
+      batch = self._gather()
+      if batch is None:
+        return
+      try:
+        values = self.session.run(self.outputs, self.feed(batch))
+      except Exception as e:
+        tf.logging.error('batch of %d failed: %s' % (len(batch), e))
+        values = {'error': [str(e)]*len(batch)}
+      now = time.time()
+      for i, request in enumerate(batch):
+        try:
+          request.reply({k: v[i] for k, v in values.items()})
+        except Exception as e:
+          # e.g. the client of the request went away
+          tf.logging.warning('reply failed: %s' % e)
+      self.stats.add_batch([now - r.enqueued for r in batch])
+
+  def feed(self, batch):
+    return {tensor: pad_stack([r.features[name] for r in batch],
+                              tensor.dtype.as_numpy_dtype)
+              for name, tensor in self.inputs.items()}
+
+
+def check_length(arrays, inputs):
+  '''the `length` of a request fits its sequences and its `ent_pos`'''
+  length = arrays['length']
+  if length.ndim != 0:
+    return
+  # inputs of variable length, padded by pad_stack()
+  sequences = [name for name, tensor in inputs.items()
+                 if tensor.shape.ndims == 2 and tensor.shape[1].value is None]
+  for name in sequences:
+    if not 0 < length <= len(arrays[name]):
+      raise ValueError('length %d does not fit input %s of %d' %
+                       (length, name, len(arrays[name])))
+  ent_pos = arrays.get('ent_pos')
+  if ent_pos is not None and ent_pos.size and (
+      ent_pos.min() < 0 or ent_pos.max() >= length):
+    raise ValueError('ent_pos is out of the length %d' % length)
+
+def pad_stack(values, dtype):
+  '''one array of `values`, zero padded to the largest shape'''
+  arrays = [np.asarray(v, dtype) for v in values]
+  shape = np.max([a.shape for a in arrays], axis=0) if arrays[0].ndim else []
+  batch = np.zeros([len(arrays)] + list(shape), dtype)
+  for i, a in enumerate(arrays):
+    batch[(i,) + tuple(slice(0, n) for n in a.shape)] = a
+  return batch
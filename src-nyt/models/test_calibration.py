@@ -0,0 +1,30 @@
+import numpy as np
+from models.calibration import *
+
+# run from src-nyt: python -m models.test_calibration
+
+rng = np.random.RandomState(0)
+num_examples, num_classes = 20000, 19
+
+# labels drawn from softmax(z), the model is over-confident by 2.5
+z = rng.normal(scale=2., size=[num_examples, num_classes])
+probs = softmax(z)
+labels = np.array([rng.choice(num_classes, p=p) for p in probs])
+logits = 2.5 * z
+
+temperature = fit_temperature(logits, labels)
+print('fitted T %.3f, over-scaled by 2.5' % temperature)
+assert abs(temperature - 2.5) < 0.1
+assert nll(logits, labels, temperature) < nll(logits, labels)
+
+report = calibrate(logits, labels)
+print(report)
+assert report['fit_examples'] + report['examples'] == num_examples
+assert report['ece_calibrated'] < 0.02 < report['ece']
+
+# ece of a fixed case: confidence 0.9 but half of them right
+probs = np.array([[0.9, 0.1], [0.9, 0.1], [0.2, 0.8], [0.4, 0.6]])
+labels = np.array([0, 1, 1, 1])
+# bins: 0.9 twice (acc 0.5), 0.8 (acc 1), 0.6 (acc 1)
+expected = (abs(1.8 - 1) + abs(0.8 - 1) + abs(0.6 - 1)) / 4
+assert np.isclose(expected_calibration_error(probs, labels), expected)
@@ -0,0 +1,52 @@
+import numpy as np
+from quantize import *
+
+# run from models/, numpy only
+
+rng = np.random.RandomState(0)
+
+# word embedding, one scale per row, the second row all zeros
+embed = rng.normal(size=[50, 300]).astype(np.float32)
+embed[1] = 0.
+q = quantize_int8(embed, axis=0)
+assert q.values.dtype == np.int8 and q.scale.shape == (50, 1)
+assert q.scale[1, 0] == 1. and not q.values[1].any()
+err = np.abs(dequantize(q) - embed)
+# rounding error of half a step, the max of each row is exact
+assert np.all(err <= q.scale / 2 + 1e-6)
+assert np.all(np.abs(q.values).max(axis=1)[embed.any(axis=1)] == 127)
+print('embed max abs error %.2e, %.3f%% of max|x|' %
+      (err.max(), 100 * np.max(err / (127 * q.scale))))
+
+# conv kernel [width, in, out], one scale per output channel, the third zero
+kernel = rng.normal(scale=0.05, size=[3, 310, 230]).astype(np.float32)
+kernel[..., 2] = 0.
+q = quantize_int8(kernel, axis=-1)
+assert q.scale.shape == (1, 1, 230) and q.scale[0, 0, 2] == 1.
+assert not q.values[..., 2].any() and not dequantize(q)[..., 2].any()
+assert np.all(np.abs(dequantize(q) - kernel) <= q.scale / 2 + 1e-6)
+
+# all zeros, nothing to divide by
+q = quantize_int8(np.zeros([4, 5]), axis=-1)
+assert np.all(q.scale == 1.) and np.all(dequantize(q) == 0.)
+
+weights = {'embed': quantize_int8(embed, axis=0),
+           'kernel': quantize_int8(kernel, axis=-1),
+           'dense': QuantizedWeight(kernel[0].astype(np.float16), None)}
+float_bytes, q_bytes = quantized_bytes(weights)
+print('%d bytes as float32, %d quantized' % (float_bytes, q_bytes))
+assert q_bytes < float_bytes / 2
+
+# drift of a linear classifier over the embedding, logits and predictions
+# of the dequantized weights against the float32 ones
+dense = rng.normal(scale=0.05, size=[300, 19]).astype(np.float32)
+ids = rng.randint(0, 50, size=[2000, 20])
+features = embed[ids].mean(axis=1)
+logits = features.dot(dense)
+q_features = dequantize(quantize_int8(embed, axis=0))[ids].mean(axis=1)
+q_logits = q_features.dot(dequantize(quantize_int8(dense, axis=-1)))
+agree = np.mean(np.argmax(logits, 1) == np.argmax(q_logits, 1))
+drift = np.abs(q_logits - logits).max() / np.abs(logits).max()
+print('prediction agreement %.4f, max logit drift %.2e of max|logit|' %
+      (agree, drift))
+assert agree > 0.99 and drift < 0.02
@@ -0,0 +1,184 @@
+'''
+Batch inference of a trained CNNModel on new sentences.
+
+  python predict.py --dataset=semeval --input_file=sentences.txt \
+      --output_file=predictions.txt --top_k=3
+
+The input format is described in inputs/raw_text.py. Worker processes
+tokenize and encode the next window of lines while the model runs the
+current one; each window is sorted by length and cut into large batches so
+that little padding is computed. One line is written per input line, in
+input order
+
+  line_no <tab> relation <tab> relation:prob relation:prob ...
+
+with the `top_k` most probable relations and their probabilities,
+temperature scaled once calibrate.py ran, lines whose entities could not be
+found get `-`. Throughput is logged in sentences/sec.
+'''
+import os
+import sys
+import time
+import itertools
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+
+from inputs import dataset, raw_text, utils
+from models import cnn_model
+import config as config_lib
+
+flags = tf.app.flags
+flags.DEFINE_enum('dataset', 'semeval', ['semeval', 'nyt'],
+                  'hparams and relations of the trained model')
+flags.DEFINE_string('input_file', None, 'sentences with marked entities')
+flags.DEFINE_string('output_file', 'data/generated/predictions.txt',
+                    'where the predictions are written')
+flags.DEFINE_integer('predict_batch_size', 1000, 'sentences per batch')
+flags.DEFINE_integer('window_size', 50000,
+                     'lines read, encoded and sorted by length at a time')
+flags.DEFINE_integer('top_k', 3, 'most probable relations written per line')
+flags.DEFINE_integer('num_workers', 0,
+                     'encoding processes, 0 uses all the CPUs')
+flags.DEFINE_integer('chunk_size', 500, 'lines per task sent to a worker')
+FLAGS = tf.app.flags.FLAGS
+tf.logging.set_verbosity(tf.logging.INFO)
+
+_vocab = None
+_max_len = None
+
+
+def init_worker(vocab, max_len):
+  global _vocab, _max_len
+  _vocab = vocab
+  _max_len = max_len
+
+def encode_line(line):
+  return raw_text.encode_line(line, _vocab.vocab2id, _vocab.unk_id, _max_len)
+
+def encoded_windows(pool, input_file):
+  '''lists of encoded lines, the workers encode the next window while the
+  current one is classified'''
+  with open(input_file) as f:
+    pending = None
+    while True:
+      lines = list(itertools.islice(f, FLAGS.window_size))
+      if not lines:
+        break
+      job = pool.map_async(encode_line, lines, FLAGS.chunk_size)
+      if pending is not None:
+        yield pending.get()
+      pending = job
+    if pending is not None:
+      yield pending.get()
+
+def length_batches(examples, batch_size):
+  '''indices of the encoded examples, sorted by length, by batch'''
+  ids = [i for i, ex in enumerate(examples) if ex is not None]
+  ids.sort(key=lambda i: examples[i][0])
+  for start in range(0, len(ids), batch_size):
+    yield ids[start:start+batch_size]
+
+def pad_batch(examples):
+  n = max(ex[0] for ex in examples)
+  arrays = [np.zeros([len(examples), n], np.int64) for _ in range(3)]
+  for i, (length, _, sentence, pos1, pos2) in enumerate(examples):
+    for array, values in zip(arrays, [sentence, pos1, pos2]):
+      array[i, :length] = values
+  labels = np.zeros([len(examples)], np.int64)
+  lengths = np.array([ex[0] for ex in examples], np.int32)
+  ent_pos = np.array([ex[1] for ex in examples], np.int32)
+  return (labels, lengths, ent_pos) + tuple(arrays)
+
+def input_placeholders():
+  '''fed like a batch of RCRecordData, the labels are not used'''
+  return (tf.placeholder(tf.int64, [None], name='label'),
+          tf.placeholder(tf.int32, [None], name='length'),
+          tf.placeholder(tf.int32, [None, 4], name='ent_pos'),
+          tf.placeholder(tf.int64, [None, None], name='sentence'),
+          tf.placeholder(tf.int64, [None, None], name='pos1'),
+          tf.placeholder(tf.int64, [None, None], name='pos2'))
+
+def predict(session, inputs, top_k, windows, relations, out_file):
+  '''
+  Args
+    top_k: tensors of the top-k probabilities and relation ids
+  Returns
+    number of sentences classified
+  '''
+  probs, ids = top_k
+  start_time = time.time()
+  line_no, num_sents = 0, 0
+  for examples in windows:
+    top_probs = [None]*len(examples)
+    top_ids = [None]*len(examples)
+    for batch_ids in length_batches(examples, FLAGS.predict_batch_size):
+      batch = pad_batch([examples[i] for i in batch_ids])
+      batch_probs, batch_top = session.run([probs, ids],
+                                           dict(zip(inputs, batch)))
+      for i, p, k in zip(batch_ids, batch_probs, batch_top):
+        top_probs[i], top_ids[i] = p, k
+
+    for p, k in zip(top_probs, top_ids):
+      line_no += 1
+      if k is None:
+        out_file.write('%d\t-\n' % line_no)
+        continue
+      num_sents += 1
+      top = ' '.join('%s:%.4f' % (relations[r], x) for r, x in zip(k, p))
+      out_file.write('%d\t%s\t%s\n' % (line_no, relations[k[0]], top))
+
+    duration = time.time() - start_time
+    tf.logging.info('%d lines, %.0f sentences/sec' %
+                    (line_no, num_sents / max(duration, 1e-6)))
+  return num_sents
+
+def main(_):
+  config = config_lib.get_config()
+  embed = dataset.Embed(config.out_dir, config.trimmed_embed300_file, config.vocab_file)
+  ini_word_embed = embed.load_embedding()
+  vocab = dataset.Vocab(config.out_dir, config.vocab_file)
+  vocab.vocab2id # loaded once, before the workers fork
+
+  if FLAGS.dataset == 'semeval':
+    hparams = config_lib.semeval_hparams()
+    relations = utils.load_relations(os.path.join(config.semeval_dir,
+                                          config.semeval_relations_file))
+  else:
+    hparams = config_lib.nyt_hparams()
+    relations = utils.load_relation2id(os.path.join(config.nyt_dir,
+                                          config.nyt_relations_file))
+  hparams.top_k = FLAGS.top_k
+
+  # forked before the session starts its threads
+  pool = multiprocessing.Pool(FLAGS.num_workers or None, init_worker,
+                              (vocab, hparams.max_len))
+  with tf.Graph().as_default():
+    inputs = input_placeholders()
+    m_valid = cnn_model.build_valid_model(hparams, ini_word_embed, inputs)
+    top_k = (m_valid.tensors['top_probs'], m_valid.tensors['top_ids'])
+
+    init_op = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
+    sess_config = tf.ConfigProto()
+    sess_config.gpu_options.allow_growth = True
+
+    with tf.Session(config=sess_config) as sess:
+      sess.run(init_op)
+      m_valid.restore(sess)
+
+      start_time = time.time()
+      with open(FLAGS.output_file, 'w') as f:
+        windows = encoded_windows(pool, FLAGS.input_file)
+        num_sents = predict(sess, inputs, top_k, windows, relations, f)
+      duration = time.time() - start_time
+  pool.close()
+  pool.join()
+
+  print('%d sentences in %.1f secs, %.0f sentences/sec' %
+        (num_sents, duration, num_sents / max(duration, 1e-6)))
+  sys.stdout.flush()
+
+if __name__ == '__main__':
+  flags.mark_flag_as_required('input_file')
+  tf.app.run()
@@ -0,0 +1,101 @@
+'''
+Accuracy drift of the post-training weight quantization, see
+models/quantize.py.
+
+  python quantize.py
+  python export.py --quantize=int8 --export_dir=exported/semeval-int8
+
+Restores the best checkpoint into the SemEval and the NYT valid models and
+scores both test sets with the float32 weights, then with the word
+embedding in int8 and the kernels in int8, then in float16. Prints, and
+writes to quantize.json in the model dir, the accuracy, the SemEval
+macro-F1, their drift and the share of predictions left unchanged, with
+the bytes of the quantized weights.
+'''
+import os
+import sys
+import json
+import tensorflow as tf
+
+from inputs import dataset, rc_dataset, utils
+from models import cnn_model
+from models.quantize import (KERNEL_MODES, quantize_weights, quantized_bytes,
+                             dequantize, read_values, load_values)
+import config as config_lib
+
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def scores(session, models):
+  '''dict of dataset => EvalResult'''
+  return {name: m_valid.evaluate(session, test_iter, relations)
+            for name, (m_valid, test_iter, relations) in models.items()}
+
+def drift(base, result):
+  report = {'acc': result.acc*100, 'acc_drift': (result.acc - base.acc)*100,
+            'same_pred': (result.pred == base.pred).mean()*100}
+  if result.macro_f1 is not None:
+    report['f1'] = result.macro_f1*100
+    report['f1_drift'] = (result.macro_f1 - base.macro_f1)*100
+  return report
+
+def main(_):
+  config = config_lib.get_config()
+  embed = dataset.Embed(config.out_dir, config.trimmed_embed300_file, config.vocab_file)
+  ini_word_embed = embed.load_embedding()
+  semeval_data = rc_dataset.RCRecordData(config.out_dir,
+                config.semeval_train_record, config.semeval_test_record)
+  nyt_data = rc_dataset.RCRecordData(config.out_dir,
+                config.nyt_train_record, config.nyt_test_record)
+  relations = utils.load_relations(os.path.join(config.semeval_dir,
+                                        config.semeval_relations_file))
+
+  with tf.Graph().as_default():
+    models = {}
+    for name, data, hparams, rels in [
+        ('semeval', semeval_data, config_lib.semeval_hparams(), relations),
+        ('nyt', nyt_data, config_lib.nyt_hparams(), None)]:
+      test_iter = data.test_data(1, hparams.batch_size)
+      m_valid = cnn_model.build_valid_model(hparams, ini_word_embed,
+                                            test_iter.get_next())
+      models[name] = (m_valid, test_iter, rels)
+
+    init_op = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
+    with tf.Session() as sess:
+      sess.run(init_op)
+      for m_valid, _, _ in models.values():
+        m_valid.restore(sess)
+      base = scores(sess, models)
+      report = {'float32': {name: drift(base[name], base[name])
+                              for name in base}}
+
+      for mode in KERNEL_MODES:
+        weights = quantize_weights(sess, kernels=mode)
+        float_values = read_values(sess, weights)
+        load_values(sess, {k: dequantize(w) for k, w in weights.items()})
+        results = scores(sess, models)
+        load_values(sess, float_values)
+
+        float_bytes, q_bytes = quantized_bytes(weights)
+        report['int8 embed, %s kernels' % mode] = dict(
+            {name: drift(base[name], results[name]) for name in results},
+            bytes=q_bytes, float32_bytes=float_bytes)
+
+  for mode, values in report.items():
+    print(mode)
+    if 'bytes' in values:
+      print('  weights %.1f MB, float32 %.1f MB' %
+            (values['bytes'] / 2.**20, values['float32_bytes'] / 2.**20))
+    for name in models:
+      r = values[name]
+      line = '  %-8s acc %.2f (%+.2f)' % (name, r['acc'], r['acc_drift'])
+      if 'f1' in r:
+        line += ' f1 %.2f (%+.2f)' % (r['f1'], r['f1_drift'])
+      print(line + ' same pred %.2f%%' % r['same_pred'])
+  with open(os.path.join(m_valid.save_dir, 'quantize.json'), 'w') as f:
+    json.dump(report, f, indent=2)
+  sys.stdout.flush()
+
+if __name__ == '__main__':
+  tf.app.run()
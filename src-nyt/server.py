@@ -0,0 +1,250 @@
+'''
+Local inference server of a model exported by export.py.
+
+  python server.py --export_dir=exported/semeval                  # stdin
+  python server.py --export_dir=exported/semeval --socket_path=/tmp/rc.sock
+
+Requests and replies are JSON lines, read from stdin and written to stdout,
+or exchanged over a unix socket, many connections at once. A request holds
+a sentence in one of the formats of inputs/raw_text.py, or the encoded
+inputs of the `classify` signature
+
+  {"id": 7, "sentence": "The <e1>company</e1> fabricates <e2>chairs</e2> ."}
+  {"id": 8, "features": {"length": 3, "ent_pos": [0, 0, 2, 2], ...}}
+  {"stats": true}
+
+and gets
+
+  {"id": 7, "relation": "Product-Producer(e2,e1)", "top": [[relation, prob], ..]}
+  {"id": 8, "error": "overloaded"}
+  {"requests": .., "latency_ms_p50": .., "latency_ms_p99": ..,
+   "batch_size_hist": {"1": .., "2": .., ..}, ..}
+
+Concurrent requests are run in micro-batches, see models/serving.py. When
+the queue is full a socket request waits `queue_timeout_secs` and is then
+rejected as overloaded, stdin is simply read no faster than it is served.
+The stats are also logged every `stats_interval_secs` and at exit.
+'''
+import os
+import sys
+import json
+import threading
+import socketserver
+import numpy as np
+import tensorflow as tf
+
+from inputs import dataset, raw_text, utils
+from models.export import load_classifier
+from models.serving import MicroBatcher, Overloaded
+import config as config_lib
+
+flags = tf.app.flags
+flags.DEFINE_enum('dataset', 'semeval', ['semeval', 'nyt'],
+                  'hparams and relations of the exported model')
+flags.DEFINE_string('export_dir', 'exported/semeval', 'written by export.py')
+flags.DEFINE_string('socket_path', '',
+                    'unix socket to listen on, empty serves stdin')
+flags.DEFINE_integer('max_batch_size', 64, 'requests per batch')
+flags.DEFINE_float('max_latency_ms', 5.,
+                   'longest wait of a request for the others of its batch')
+flags.DEFINE_integer('queue_size', 1024, 'requests waiting for a batch')
+flags.DEFINE_float('queue_timeout_secs', 0.1,
+                   'wait for room in the queue before rejecting a request')
+flags.DEFINE_integer('top_k', 3, 'most probable relations of a reply, at '
+                     'most the top_k of the export')
+flags.DEFINE_integer('stats_interval_secs', 60,
+                     'seconds between the stats logs, 0 logs them at exit')
+FLAGS = tf.app.flags.FLAGS
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+class RelationService(object):
+  '''turns request lines into micro-batched requests and their replies'''
+
+  def __init__(self, batcher, vocab, max_len, relations, top_k):
+    self.batcher = batcher
+    self.vocab = vocab
+    self.max_len = max_len
+    self.relations = relations
+    self.top_k = top_k
+
+  def features(self, request):
+    '''
+    Raises
+      ValueError for encoded inputs that do not fit the signature, or a
+      sentence that is not a string
+    '''
+    if 'features' in request:
+      return self.batcher.check(request['features'])
+    sentence = request.get('sentence', '')
+    if not isinstance(sentence, str):
+      raise ValueError('sentence is not a string')
+    encoded = raw_text.encode_line(sentence,
+                                   self.vocab.vocab2id, self.vocab.unk_id,
+                                   self.max_len)
+    if encoded is None:
+      return None
+    return dict(zip(['length', 'ent_pos', 'sentence', 'pos1', 'pos2'],
+                    encoded))
+
+  def reply(self, request_id, outputs):
+    if 'error' in outputs:
+      return {'id': request_id, 'error': outputs['error']}
+    if 'top_ids' not in outputs:
+      reply = {k: np.asarray(v).tolist() for k, v in outputs.items()}
+      reply['id'] = request_id
+      return reply
+    # computed in-graph, calibrated
+    top = zip(outputs['top_ids'][:self.top_k], outputs['top_probs'])
+    top = [[self.relations[int(k)], round(float(p), 4)] for k, p in top]
+    return {'id': request_id, 'relation': top[0][0], 'top': top}
+
+  def handle(self, line, respond, timeout=None):
+    '''parses the request `line` and passes its reply to `respond`, now or
+    later from the batcher thread'''
+    try:
+      request = json.loads(line)
+    except ValueError:
+      respond({'error': 'not json'})
+      return
+    if not isinstance(request, dict):
+      respond({'error': 'not a json object'})
+      return
+    if request.get('stats'):
+      respond(self.batcher.stats.summary())
+      return
+
+    request_id = request.get('id')
+    try:
+      features = self.features(request)
+    except ValueError as e:
+      respond({'id': request_id, 'error': str(e)})
+      return
+    if features is None:
+      respond({'id': request_id, 'error': 'entities not found'})
+      return
+    try:
+      self.batcher.submit(features,
+          lambda outputs: respond(self.reply(request_id, outputs)), timeout)
+    except Overloaded:
+      respond({'id': request_id, 'error': 'overloaded'})
+
+
+class JsonLineWriter(object):
+  '''thread safe writer of the replies, counts the ones still due'''
+
+  def __init__(self, out_file):
+    self.out_file = out_file
+    self.lock = threading.Condition()
+    self.pending = 0
+
+  def expect(self):
+    with self.lock:
+      self.pending += 1
+
+  def write(self, reply):
+    line = json.dumps(reply) + '\n'
+    with self.lock:
+      try:
+        self.out_file.write(line)
+        self.out_file.flush()
+      finally:
+        # a reply lost to a closed connection is no longer due
+        self.pending -= 1
+        self.lock.notify_all()
+
+  def wait(self):
+    '''until every expected reply is written'''
+    with self.lock:
+      while self.pending > 0:
+        self.lock.wait()
+
+def serve_lines(service, in_file, writer, timeout=None):
+  for line in in_file:
+    if not line.strip():
+      continue
+    writer.expect()
+    service.handle(line, writer.write, timeout)
+  writer.wait()
+
+def serve_stdin(service):
+  out_file = sys.stdout
+  # replies only on stdout
+  sys.stdout = sys.stderr
+  serve_lines(service, sys.stdin, JsonLineWriter(out_file))
+
+class UTF8Writer(object):
+  def __init__(self, out_file):
+    self.out_file = out_file
+
+  def write(self, text):
+    self.out_file.write(text.encode('utf-8'))
+
+  def flush(self):
+    self.out_file.flush()
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn,
+                          socketserver.UnixStreamServer):
+  daemon_threads = True
+
+def serve_socket(service, socket_path):
+  class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+      in_file = (line.decode('utf-8') for line in self.rfile)
+      writer = JsonLineWriter(UTF8Writer(self.wfile))
+      serve_lines(service, in_file, writer, FLAGS.queue_timeout_secs)
+
+  if os.path.exists(socket_path):
+    os.remove(socket_path)
+  server = ThreadingUnixServer(socket_path, Handler)
+  tf.logging.info('listening on %s' % socket_path)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    os.remove(socket_path)
+
+def log_stats(stats, interval_secs, stopped):
+  while not stopped.wait(interval_secs):
+    tf.logging.info('stats %s' % json.dumps(stats.summary()))
+
+def main(_):
+  config = config_lib.get_config()
+  vocab = dataset.Vocab(config.out_dir, config.vocab_file)
+  if FLAGS.dataset == 'semeval':
+    hparams = config_lib.semeval_hparams()
+    relations = utils.load_relations(os.path.join(config.semeval_dir,
+                                          config.semeval_relations_file))
+  else:
+    hparams = config_lib.nyt_hparams()
+    relations = utils.load_relation2id(os.path.join(config.nyt_dir,
+                                          config.nyt_relations_file))
+
+  session, inputs, outputs = load_classifier(FLAGS.export_dir)
+  # word and position ids past their embeddings
+  value_ranges = {'sentence': (0, len(vocab.vocab)),
+                  'pos1': (0, hparams.pos_num), 'pos2': (0, hparams.pos_num)}
+  batcher = MicroBatcher(session, inputs, outputs, FLAGS.max_batch_size,
+                         FLAGS.max_latency_ms, FLAGS.queue_size,
+                         value_ranges=value_ranges)
+  service = RelationService(batcher, vocab, hparams.max_len, relations,
+                            FLAGS.top_k)
+  batcher.start()
+
+  stopped = threading.Event()
+  if FLAGS.stats_interval_secs:
+    threading.Thread(target=log_stats, daemon=True,
+        args=(batcher.stats, FLAGS.stats_interval_secs, stopped)).start()
+  if FLAGS.socket_path:
+    serve_socket(service, FLAGS.socket_path)
+  else:
+    serve_stdin(service)
+  stopped.set()
+  batcher.stop()
+  session.close()
+  tf.logging.info('stats %s' % json.dumps(batcher.stats.summary()))
+
+if __name__ == '__main__':
+  tf.app.run()
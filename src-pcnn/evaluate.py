@@ -0,0 +1,98 @@
+'''
+Continuous evaluation of the checkpoints written by main.py.
+
+  python main.py --inline_eval=False &
+  python evaluate.py
+
+Waits for new checkpoints in the model dir and scores each on the SemEval
+test set in its own process, on a few CPU threads next to the trainer. The
+best one is marked in best_eval.json, CheckpointManager never retires it and
+BaseModel.restore() loads it.
+'''
+import os
+import sys
+import tensorflow as tf
+
+from inputs import dataset, semeval_v2
+from models import cnn_model
+from models.checkpoint import read_best_eval, mark_best_eval, verify_embeddings
+
+flags = tf.app.flags
+
+# must match the trainer, they select the model dir and the graph
+flags.DEFINE_integer("word_dim", 300, "word embedding size")
+flags.DEFINE_integer("num_epochs", 50, "number of epochs")
+flags.DEFINE_integer("batch_size", 100, "batch size")
+flags.DEFINE_boolean('is_adv', False, 'set True to use adv training')
+
+flags.DEFINE_integer('eval_threads', 2, 'CPU threads of the evaluator')
+flags.DEFINE_integer('eval_interval_secs', 10,
+                     'minimum seconds between two evaluations')
+flags.DEFINE_integer('eval_timeout_secs', 3600,
+                     'stop after this long without a new checkpoint')
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def checkpoint_step(ckpt_path):
+  return int(ckpt_path.rsplit('-', 1)[-1])
+
+def evaluate_checkpoints(sess, m_valid, test_iter):
+  relations = semeval_v2.load_relations()
+  save_dir = m_valid.save_dir
+  verify_embeddings(save_dir, m_valid.embed_refs)
+  writer = tf.summary.FileWriter(os.path.join(save_dir, 'eval'))
+  best = read_best_eval(save_dir)
+  best_acc = best['metric'] if best else 0.
+
+  for ckpt_path in tf.contrib.training.checkpoints_iterator(save_dir,
+                      FLAGS.eval_interval_secs, FLAGS.eval_timeout_secs):
+    try:
+      m_valid.saver.restore(sess, ckpt_path)
+    except tf.errors.NotFoundError:
+      # retired by the trainer before we got to it
+      tf.logging.warning('%s is gone, skipped' % ckpt_path)
+      continue
+
+    step = checkpoint_step(ckpt_path)
+    result = m_valid.evaluate(sess, test_iter, relations)
+    acc = result.acc
+    writer.add_summary(tf.Summary(value=[
+        tf.Summary.Value(tag='valid_acc', simple_value=acc),
+        tf.Summary.Value(tag='valid_f1', simple_value=result.macro_f1)]), step)
+    writer.flush()
+
+    if best_acc < acc:
+      best_acc = acc
+      mark_best_eval(save_dir, ckpt_path, step, acc)
+    print('%s acc %.4f f1 %.4f best %.4f' % 
+          (ckpt_path, acc, result.macro_f1, best_acc))
+    sys.stdout.flush()
+  writer.close()
+
+def main(_):
+  vocab_mgr = dataset.VocabMgr()
+  word_embed = vocab_mgr.load_embedding()
+  semeval_record = semeval_v2.SemEvalCleanedRecordData(None)
+
+  with tf.Graph().as_default():
+    test_iter = semeval_record.test_data(1, FLAGS.batch_size)
+    model_name = 'cnn-%d-%d' % (FLAGS.word_dim, FLAGS.num_epochs)
+    m_valid = cnn_model.build_valid_model(model_name, word_embed,
+                                          test_iter.get_next(), FLAGS.is_adv)
+
+    init_op = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
+    # stay off the trainer's GPU and most of its cores
+    config = tf.ConfigProto(device_count={'GPU': 0},
+                            intra_op_parallelism_threads=FLAGS.eval_threads,
+                            inter_op_parallelism_threads=FLAGS.eval_threads)
+
+    with tf.Session(config=config) as sess:
+      sess.run(init_op)
+      evaluate_checkpoints(sess, m_valid, test_iter)
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,79 @@
+'''
+Export of the best checkpoint for serving, see models/export.py.
+
+  python export.py --export_dir=exported/semeval
+
+Rebuilds CNNModel for inference alone, restores the weights and writes the
+frozen GraphDef and the SavedModel with the `classify` signature
+
+  inputs   length [batch], ent_pos [batch, 4], sentence, pos1, pos2
+           [batch, len], encoded like the SemEval records
+  outputs  logits, probs [batch, num_classes], pred [batch]
+
+then times the load of the SavedModel and a one sentence request.
+'''
+import sys
+import numpy as np
+import tensorflow as tf
+
+from inputs import dataset
+from models import cnn_model
+from models.export import export_model, time_classifier
+
+flags = tf.app.flags
+
+# must match the trainer, they select the model dir and the graph
+flags.DEFINE_integer("word_dim", 300, "word embedding size")
+flags.DEFINE_integer("num_epochs", 50, "number of epochs")
+flags.DEFINE_boolean('is_adv', False, 'set True to use adv training')
+
+flags.DEFINE_string('export_dir', 'exported/semeval',
+                    'where the frozen graph and the SavedModel are written')
+flags.DEFINE_integer('timed_requests', 100,
+                     'requests timed after the export, 0 skips the timing')
+FLAGS = tf.app.flags.FLAGS
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def inference_inputs():
+  return {'length': tf.placeholder(tf.int64, [None], name='length'),
+          'ent_pos': tf.placeholder(tf.int64, [None, 4], name='ent_pos'),
+          'sentence': tf.placeholder(tf.int64, [None, None], name='sentence'),
+          'pos1': tf.placeholder(tf.int64, [None, None], name='pos1'),
+          'pos2': tf.placeholder(tf.int64, [None, None], name='pos2')}
+
+def example_request(length=20):
+  '''one sentence, its entities at the second and the second last word'''
+  pos = np.arange(length)
+  return {'length': np.array([length], np.int64),
+          'ent_pos': np.array([[1, 1, length-2, length-2]], np.int64),
+          'sentence': np.ones([1, length], np.int64),
+          'pos1': np.clip(pos - 1, -60, 60)[None] + 61,
+          'pos2': np.clip(pos - length + 2, -60, 60)[None] + 61}
+
+def main(_):
+  vocab_mgr = dataset.VocabMgr()
+  word_embed = vocab_mgr.load_embedding()
+  model_name = 'cnn-%d-%d' % (FLAGS.word_dim, FLAGS.num_epochs)
+
+  with tf.Graph().as_default():
+    inputs = inference_inputs()
+    m_infer = cnn_model.build_inference_model(model_name, word_embed,
+                  [inputs[k] for k in ['length', 'ent_pos', 'sentence',
+                                       'pos1', 'pos2']], FLAGS.is_adv)
+    init_op = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
+    with tf.Session() as sess:
+      sess.run(init_op)
+      m_infer.restore(sess)
+      export_model(sess, inputs, m_infer.tensors, FLAGS.export_dir)
+
+  if FLAGS.timed_requests:
+    startup, p50, p99 = time_classifier(FLAGS.export_dir, example_request(),
+                                        FLAGS.timed_requests)
+    print('load %.2f secs, request p50 %.2f ms p99 %.2f ms' %
+          (startup, p50*1000, p99*1000))
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -286,10 +286,20 @@ class RecordDataset(Dataset):
   def padded_shapes(self):
     raise NotImplementedError
 
-  def train_data(self, epoch, batch_size):
+  def train_data(self, epoch, batch_size, seed=None, skip_batches=0,
+                 num_shards=1, shard_index=0):
+    '''
+    Args:
+      seed: shuffle seed, the same seed gives the same batch order
+      skip_batches: batches already consumed by an interrupted run
+      num_shards, shard_index: read every num_shards-th record starting at 
+                               shard_index, one shard per training replica
+    '''
     if self.train_record_file:
       return self._read_records(self.train_record_file, epoch, batch_size, 
-                                shuffle=True)
+                                shuffle=True, seed=seed, 
+                                skip_batches=skip_batches,
+                                num_shards=num_shards, shard_index=shard_index)
 
   def test_data(self, epoch, batch_size):
     if self.test_record_file:
@@ -301,7 +311,8 @@ class RecordDataset(Dataset):
       return self._read_records(self.unsup_record_file, epoch, batch_size, 
                                 shuffle=True)
 
-  def _read_records(self, filename, epoch, batch_size, shuffle=True):
+  def _read_records(self, filename, epoch, batch_size, shuffle=True, 
+                    seed=None, skip_batches=0, num_shards=1, shard_index=0):
     '''read TFRecord file to get batch tensors for tensorflow models
 
     Returns:
@@ -309,13 +320,18 @@ class RecordDataset(Dataset):
     '''
     with tf.device('/cpu:0'):
       dataset = tf.data.TFRecordDataset([filename])
+      if num_shards > 1:
+        dataset = dataset.shard(num_shards, shard_index)
       # Parse the record into tensors
       dataset = dataset.map(self.parse_example)
       dataset = dataset.repeat(epoch)
       if shuffle:
-        dataset = dataset.shuffle(buffer_size=1000)
+        dataset = dataset.shuffle(buffer_size=1000, seed=seed)
       
       dataset = dataset.padded_batch(batch_size, self.padded_shapes())
+      if skip_batches:
+        # replays the seeded stream up to where the interrupted run stopped
+        dataset = dataset.skip(skip_batches)
       
       if shuffle:
         iterator = dataset.make_one_shot_iterator()
@@ -92,12 +92,17 @@ class SemEvalCleanedRecordData(dataset.RecordDataset):
     return ([], [], [4], [None], [None], [None])
 
 
-def write_results(predictions):
+def load_relations():
+  '''relation names by label id'''
   id2relation = []
   with open(os.path.join(DATA_DIR, LABEL_FILE)) as f:
     for id, line in enumerate(f):
       rel = line.strip()
       id2relation.append(rel)
+  return id2relation
+
+def write_results(predictions):
+  id2relation = load_relations()
   
   start_no = 8001
   with open(os.path.join(OUT_DIR, RESULTS_FILE), 'w') as f:
@@ -6,6 +6,9 @@ import numpy as np
 
 from inputs import  dataset, nyt2010, semeval_v2
 from models import cnn_model
+from models.checkpoint import new_train_state, resume_point
+from models.profiler import profiled
+from models.metrics import MetricsLogger
 
 # tf.set_random_seed(0)
 # np.random.seed(0)
@@ -15,56 +18,138 @@ flags = tf.app.flags
 flags.DEFINE_integer("word_dim", 300, "word embedding size")
 flags.DEFINE_integer("num_epochs", 50, "number of epochs")
 flags.DEFINE_integer("batch_size", 100, "batch size")
+flags.DEFINE_integer("steps_per_run", 1, 
+                     "training steps run in-graph per session.run")
+flags.DEFINE_integer("num_towers", 1, 
+                     "data-parallel replicas, each gets batch_size/num_towers "
+                     "examples of its own record shard")
 
 flags.DEFINE_boolean('is_adv', False, 'set True to use adv training')
 flags.DEFINE_boolean('is_test', False, 'set True to test')
+flags.DEFINE_boolean('resume', False, 
+                     'continue the interrupted run saved in the model dir')
+flags.DEFINE_integer('ckpt_freq', 0, 
+                     'training steps between the unscored mid-epoch '
+                     'checkpoints a resumed run restarts from, 0 saves at '
+                     'the end of the epochs only')
+flags.DEFINE_boolean('inline_eval', True, 
+                     'validate after every epoch, set False when evaluate.py '
+                     'runs next to the trainer')
+flags.DEFINE_integer('profile_steps', 0, 
+                     'training steps traced by the profiler, 0 disables it')
+flags.DEFINE_integer('profile_start', 10, 'training steps before the trace')
+flags.DEFINE_integer('profile_top_n', 20, 'ops printed after the trace')
+flags.DEFINE_string('profile_dir', 'profile/', 
+                    'where the timeline and the op reports are written')
 
 FLAGS = tf.app.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
-def train_semeval(sess, m_train, m_valid, test_iter):
-  best_acc, best_epoch = 0., 0
+def run_train_steps(sess, m_train, num_steps):
+  '''runs `num_steps` training steps, FLAGS.steps_per_run at a time
+
+  Returns
+    summed loss and accuracy of the steps
+  '''
+  k = FLAGS.steps_per_run
+  sum_loss, sum_acc = 0., 0.
+  if k > 1:
+    fetches = [m_train.tensors['n_steps_loss'], m_train.tensors['n_steps_acc']]
+    for _ in range(num_steps // k):
+      loss, acc = sess.run(fetches)
+      sum_loss += k*loss
+      sum_acc += k*acc
+    num_steps %= k
+
+  fetches = [m_train.train_ops['train_loss'], 
+             m_train.tensors['loss'], m_train.tensors['acc']]
+  for _ in range(num_steps):
+    _, loss, acc = sess.run(fetches)
+    sum_loss += loss
+    sum_acc += acc
+  return sum_loss, sum_acc
+
+def train_semeval(sess, m_train, m_valid, test_iter, state, train_iters):
+  '''
+  Args
+    state: train state from new_train_state() or of the resumed checkpoint,
+           updated in place and saved with every checkpoint
+    train_iters: one training iterator per replica, for the input stall 
+                 breakdown
+  '''
+  best_acc, best_epoch = state['best_metric'], state['best_step']
+  relations = semeval_v2.load_relations()
+  step_size = FLAGS.batch_size // FLAGS.num_towers * FLAGS.num_towers
+  metrics = MetricsLogger(os.path.join(m_train.save_dir, 'metrics'), 
+                          step_size, FLAGS.steps_per_run, 
+                          [m_train.tensors.get('n_steps_loss')],
+                          start_step=state['batches'], 
+                          inputs={'semeval_train': train_iters})
+  train_sess = profiled(metrics.wrap(sess), FLAGS.profile_dir, 
+                        FLAGS.profile_start, FLAGS.profile_steps, 
+                        FLAGS.profile_top_n)
   start_time = time.time()
   orig_begin_time = start_time
 
-  for epoch in range(FLAGS.num_epochs):
-    sess.run([test_iter.initializer])
-
-    # train SemEval
+  for epoch in range(state['epoch'], FLAGS.num_epochs):
+    # train SemEval, a resumed run may stop mid-epoch
+    epoch_end = 80*(epoch+1)
+    num_steps = epoch_end - state['batches']
+    train_start = time.time()
     sem_loss, sem_acc = 0., 0.
-    for batch in range(80):
-      train_op = m_train.train_ops['train_loss']
-      fetches = [train_op, m_train.tensors['loss'], m_train.tensors['acc']]
-      _, loss, acc = sess.run(fetches)
+    while state['batches'] < epoch_end:
+      steps = epoch_end - state['batches']
+      if FLAGS.ckpt_freq > 0:
+        steps = min(steps, FLAGS.ckpt_freq - state['batches'] % FLAGS.ckpt_freq)
+      loss, acc = run_train_steps(train_sess, m_train, steps)
       sem_loss += loss
       sem_acc += acc
+      state['batches'] += steps
+      if state['batches'] < epoch_end:
+        m_train.save(sess, state['batches'], None, state)
+    examples_per_sec = num_steps * step_size / (time.time() - train_start)
+    state['epoch'] = epoch + 1
 
-    sem_loss /= 80
-    sem_acc /= 80
+    sem_loss /= num_steps
+    sem_acc /= num_steps
 
     # epoch duration
     now = time.time()
     duration = now - start_time
     start_time = now
 
-    # valid accuracy
-    sem_valid_acc = 0.
-    for batch in range(28):
-      acc = sess.run(m_valid.tensors['acc'])
-      sem_valid_acc += acc
-    sem_valid_acc /= 28
+    if not FLAGS.inline_eval:
+      # evaluate.py scores the checkpoint
+      m_train.save(sess, state['batches'], None, state)
+      metrics.log(epoch=epoch, loss=sem_loss, acc=sem_acc, epoch_secs=duration)
+      print("Epoch %d sem %.2f %.2f time %.2f %.0f examples/sec" % 
+               (epoch, sem_loss, sem_acc, duration, examples_per_sec))
+      sys.stdout.flush()
+      continue
+
+    # valid accuracy and macro-F1, one pass over the test set
+    result = m_valid.evaluate(sess, test_iter, relations)
+    sem_valid_acc = result.acc
 
     if best_acc < sem_valid_acc:
       best_acc = sem_valid_acc
       best_epoch = epoch
-      m_train.save(sess, epoch)
+      state['best_metric'], state['best_step'] = best_acc, best_epoch
+    # every epoch, so that an interrupted run can resume
+    m_train.save(sess, state['batches'], sem_valid_acc, state)
+    metrics.log(epoch=epoch, loss=sem_loss, acc=sem_acc, 
+                valid_acc=sem_valid_acc, valid_f1=result.macro_f1,
+                epoch_secs=duration)
     
-    print("Epoch %d sem %.2f %.2f %.4f time %.2f" % 
-             (epoch, sem_loss, sem_acc, sem_valid_acc, duration))
+    print("Epoch %d sem %.2f %.2f %.4f f1 %.4f time %.2f %.0f examples/sec" % 
+             (epoch, sem_loss, sem_acc, sem_valid_acc, result.macro_f1, 
+              duration, examples_per_sec))
     sys.stdout.flush()
   
+  m_train.wait_for_checkpoints()
+  metrics.close()
   duration = time.time() - orig_begin_time
   duration /= 3600
   print('Done training, best_epoch: %d, best_acc: %.4f' % (best_epoch, best_acc))
@@ -73,26 +158,10 @@ def train_semeval(sess, m_train, m_valid, test_iter):
 
 def test(sess, m_valid, test_iter):
   m_valid.restore(sess)
-  sess.run([test_iter.initializer])
-  acc_tenser = m_valid.tensors['acc']
-  pred_tensor = m_valid.tensors['pred']
-
-  acc_all = 0.
-  pred_all = []
-  for batch in range(28):
-    acc, pred = sess.run([acc_tenser, pred_tensor])
-    acc_all += acc
-    pred_all.append(pred)
-  acc_all /= 28
-
-  print('acc: %.4f' % acc_all)
-  # print(type(pred_all[0]))
-  # print(pred_all[0].shape)
-  pred_all = np.concatenate(pred_all)
-  # print(type(pred_all))
-  # print(pred_all.shape)
-  # exit()
-  semeval_v2.write_results(pred_all)
+  result = m_valid.evaluate(sess, test_iter, semeval_v2.load_relations())
+
+  print('acc: %.4f macro-f1: %.4f' % (result.acc, result.macro_f1))
+  semeval_v2.write_results(result.pred)
 
 def main(_):
   vocab_mgr = dataset.VocabMgr()
@@ -100,19 +169,35 @@ def main(_):
   # nyt_record = nyt2010.NYT2010CleanedRecordData(None)
   semeval_record = semeval_v2.SemEvalCleanedRecordData(None)
 
+  model_name = 'cnn-%d-%d' % (FLAGS.word_dim, FLAGS.num_epochs)
+  checkpoint = None
+  if FLAGS.resume and not FLAGS.is_test:
+    checkpoint = resume_point(os.path.join(FLAGS.logdir, model_name))
+  state = checkpoint['train_state'] if checkpoint else new_train_state()
+
   with tf.Graph().as_default():
-    train_iter = semeval_record.train_data(FLAGS.num_epochs, FLAGS.batch_size)
+    # one record shard per replica, `batches` counts steps so every shard 
+    # skips the same number of batches
+    tower_batch_size = FLAGS.batch_size // FLAGS.num_towers
+    train_iters = [semeval_record.train_data(FLAGS.num_epochs, tower_batch_size,
+                                           seed=state['seed'], 
+                                           skip_batches=state['batches'],
+                                           num_shards=FLAGS.num_towers,
+                                           shard_index=i)
+                     for i in range(FLAGS.num_towers)]
     test_iter = semeval_record.test_data(1, FLAGS.batch_size)
     # unsup_iter = nyt_record.unsup_data(FLAGS.num_epochs, FLAGS.batch_size)
                                           
-    model_name = 'cnn-%d-%d' % (FLAGS.word_dim, FLAGS.num_epochs)
-    train_data = train_iter.get_next()
+    train_data = [it.get_next() for it in train_iters]
     test_data = test_iter.get_next()
     # unsup_data = unsup_iter.get_next()
     m_train, m_valid = cnn_model.build_train_valid_model(
                           model_name, word_embed,
                           train_data, test_data, None,
                           FLAGS.is_adv, FLAGS.is_test)
+    if FLAGS.steps_per_run > 1 and not FLAGS.is_test:
+      with tf.name_scope('Train'):
+        m_train.build_train_n_steps(train_iters, FLAGS.steps_per_run)
 
     init_op = tf.group(tf.global_variables_initializer(),
                         tf.local_variables_initializer())# for file queue
@@ -129,7 +214,11 @@ def main(_):
       if FLAGS.is_test:
         test(sess, m_valid, test_iter)
       else:
-        train_semeval(sess, m_train, m_valid, test_iter)
+        if checkpoint:
+          m_train.resume(sess, checkpoint)
+          print('resume from %s, epoch %d batch %d' % 
+                (checkpoint['path'], state['epoch'], state['batches']))
+        train_semeval(sess, m_train, m_valid, test_iter, state, train_iters)
 
 if __name__ == '__main__':
   tf.app.run()
@@ -14,6 +14,7 @@ import tensorflow as tf
 
 def scale_l2(x, eps=1e-3):
     # scale over the full batch
+    x = tf.cast(x, tf.float32)
     return eps * tf.nn.l2_normalize(x, dim=[0, 1, 2])
 
 def mask_by_length(t, length):
@@ -40,15 +41,28 @@ def normalize_embed(self, emb, vocab_freqs):
     stddev = tf.sqrt(1e-6 + var)
     return (emb - mean) / stddev
 
-def adv_example(inputs, loss):
+def adv_example(inputs, loss, loss_scale=None):
+    '''
+    Args
+      loss_scale: the dynamic loss scale of a float16 graph; the gradient
+                  is taken of the scaled loss, so that per-element gradients
+                  of the batch mean do not flush to zero in half precision,
+                  and unscaled in float32
+    '''
+    if loss_scale is not None:
+        loss = loss * loss_scale
     grad, = tf.gradients(
         loss,
         inputs,
         aggregation_method=tf.AggregationMethod.EXPERIMENTAL_ACCUMULATE_N)
-    grad = tf.stop_gradient(grad)
+    grad = tf.cast(tf.stop_gradient(grad), tf.float32)
+    if loss_scale is not None:
+        grad = grad / loss_scale
     perturb = scale_l2(grad)
 
-    return inputs + perturb
+    # the perturbation is far below half precision resolution, so the
+    # adversarial pass runs in float32
+    return tf.cast(inputs, tf.float32) + perturb
 
 def kl_divergence_with_logits(q_logit, p_logit):
     # https://github.com/takerum/vat_tf
@@ -62,6 +76,7 @@ def virtual_adversarial_loss(logits, length, sentence, pos1, pos2, pcnn_mask, lo
                              lexical=None, num_iter=1, small_coef=1e-6):
     # Stop gradient of logits. See https://arxiv.org/abs/1507.00677 for details.
     logits = tf.stop_gradient(logits)
+    sentence = tf.cast(sentence, tf.float32)
 
     # Initialize perturbation with random noise.
     d_sent = tf.random_normal(shape=tf.shape(sentence))
@@ -1,14 +1,20 @@
 import os
+import weakref
 import tensorflow as tf
 from tensorflow.python.framework import ops
+from models.checkpoint import *
 
 flags = tf.app.flags
 flags.DEFINE_string("logdir", "saved_models/", "where to save the model")
+flags.DEFINE_enum("precision", "float32", ["float32", "float16"],
+                  "dtype of the conv/dense math, trainable weights stay float32")
 
 FLAGS = tf.app.flags.FLAGS
 
 
 class BaseModel(object):
+  # sha1 of the frozen embeddings, see models/checkpoint.py
+  embed_refs = {}
 
   def set_saver(self, save_dir):
     '''
@@ -16,16 +22,37 @@ class BaseModel(object):
       save_dir: relative path to FLAGS.logdir
     '''
     # shared between train and valid model instance
-    self.saver = tf.train.Saver(var_list=None)
+    self.saver = tf.train.Saver(var_list=saveable_variables())
     self.save_dir = os.path.join(FLAGS.logdir, save_dir)
     self.save_path = os.path.join(self.save_dir, "model.ckpt")
+    self.ckpt_manager = None
 
   def restore(self, session):
-    ckpt = tf.train.get_checkpoint_state(self.save_dir)
-    self.saver.restore(session, ckpt.model_checkpoint_path)
+    verify_embeddings(self.save_dir, self.embed_refs)
+    self.saver.restore(session, best_checkpoint(self.save_dir))
 
-  def save(self, session, global_step):
-    self.saver.save(session, self.save_path, global_step)
+  def resume(self, session, checkpoint):
+    '''restores an interrupted run, optimizer slots and global step included
+
+    Args
+      checkpoint: entry returned by resume_point()
+    '''
+    verify_embeddings(self.save_dir, self.embed_refs)
+    saver = tf.train.Saver(var_list=saveable_variables())
+    saver.restore(session, checkpoint['path'])
+    self.ckpt_manager = CheckpointManager(self.save_dir, 
+                            saveable_variables(), self.embed_refs)
+
+  def save(self, session, global_step, metric=None, train_state=None):
+    '''snapshots the variables, the files are written in the background'''
+    if self.ckpt_manager is None:
+      self.ckpt_manager = CheckpointManager(self.save_dir, 
+                              saveable_variables(), self.embed_refs)
+    self.ckpt_manager.save(session, global_step, metric, train_state)
+
+  def wait_for_checkpoints(self):
+    if self.ckpt_manager is not None:
+      self.ckpt_manager.wait()
 
 
 def conv_block_v2(inputs, kernel_size, num_filters, name, training, 
@@ -43,19 +70,145 @@ def conv_block_v2(inputs, kernel_size, num_filters, name, training,
       conv_out = conv_out + shortcut
     return conv_out
 
-def optimize(loss, lrn_rate, max_norm=None, decay_steps=None):
+def masked_max_pool(inputs, length):
+  '''global max pooling over the first `length` steps of each sequence
+
+  Args
+    inputs: [batch, len, dim]
+    length: [batch]
+  Returns
+    [batch, dim]
+  '''
+  mask = tf.sequence_mask(length, tf.shape(inputs)[1]) # (batch, len)
+  mask = tf.tile(tf.expand_dims(mask, axis=-1), [1, 1, tf.shape(inputs)[2]])
+  # padded positions never win the max
+  neg_inf = tf.ones_like(inputs) * inputs.dtype.min
+  return tf.reduce_max(tf.where(mask, inputs, neg_inf), axis=1)
+
+def compute_dtype():
+  return tf.as_dtype(FLAGS.precision)
+
+def float32_master_getter(getter, *args, **kwargs):
+  '''custom getter for reduced precision training
+
+  Trainable variables are stored in float32 and cast to the requested dtype
+  on read, so the optimizer always updates float32 master weights.
+  '''
+  dtype = kwargs.get('dtype')
+  if not kwargs.get('trainable', True) or dtype in (None, tf.float32):
+    return getter(*args, **kwargs)
+  kwargs['dtype'] = tf.float32
+  return tf.cast(getter(*args, **kwargs), dtype)
+
+_loss_scale_managers = weakref.WeakKeyDictionary()
+
+def loss_scale_manager():
+  '''the dynamic loss scale of the default graph, shared by the optimizer 
+  and the adversarial gradients, None unless the math runs in float16'''
+  if compute_dtype() != tf.float16:
+    return None
+  graph = tf.get_default_graph()
+  if graph not in _loss_scale_managers:
+    # top level, so the train and the eval graphs name it alike
+    with graph.name_scope(None):
+      _loss_scale_managers[graph] = \
+          tf.contrib.mixed_precision.ExponentialUpdateLossScaleManager(
+                init_loss_scale=2**15, incr_every_n_steps=2000)
+  return _loss_scale_managers[graph]
+
+def loss_scale():
+  '''the current loss scale tensor, None in float32'''
+  manager = loss_scale_manager()
+  if manager is None:
+    return None
+  return manager.get_loss_scale()
+
+def loss_scale_optimizer(optimizer):
+  '''dynamic loss scaling, float16 gradients underflow without it'''
+  manager = loss_scale_manager()
+  if manager is None:
+    return optimizer
+  return tf.contrib.mixed_precision.LossScaleOptimizer(optimizer, manager)
+
+def make_optimizer(lrn_rate, decay_steps=None):
+  '''Adam and the global step it increments'''
+  global_step = tf.Variable(0, name="global_step", trainable=False)
+  
+  if decay_steps is not None:
+    lrn_rate = tf.train.exponential_decay(lrn_rate, global_step, 
+                                  decay_steps, 0.95, staircase=True)
+  
+  optimizer = loss_scale_optimizer(tf.train.AdamOptimizer(lrn_rate))
+  return optimizer, global_step
+
+def average_gradients(tower_grads):
+  '''
+  Args
+    tower_grads: one list of (gradient, variable) pairs per tower, all 
+                 towers listing the same variables in the same order
+  Returns
+    list of (gradient, variable), each gradient averaged over the towers
+  '''
+  if len(tower_grads) == 1:
+    return tower_grads[0]
+
+  averaged = []
+  for grads_and_var in zip(*tower_grads):
+    var = grads_and_var[0][1]
+    grads = [g for g, _ in grads_and_var if g is not None]
+    if not grads:
+      grad = None
+    elif isinstance(grads[0], tf.IndexedSlices):
+      # embedding lookups, keep the gradient sparse
+      grad = tf.IndexedSlices(
+                tf.concat([g.values for g in grads], axis=0) / len(grads),
+                tf.concat([g.indices for g in grads], axis=0),
+                grads[0].dense_shape)
+    else:
+      grad = tf.add_n(grads) / len(grads)
+    averaged.append((grad, var))
+  return averaged
+
+def apply_gradients(optimizer, loss, global_step, max_norm=None):
+  return apply_tower_gradients(optimizer, [loss], global_step, max_norm)
+
+def apply_tower_gradients(optimizer, tower_losses, global_step, max_norm=None):
+  '''one synchronous update from the gradients averaged over the towers'''
   update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS) # for batch_norm
   with tf.control_dependencies(update_ops):
-    global_step = tf.Variable(0, name="global_step", trainable=False)
-    
-    if decay_steps is not None:
-      lrn_rate = tf.train.exponential_decay(lrn_rate, global_step, 
-                                    decay_steps, 0.95, staircase=True)
-    
-    optimizer = tf.train.AdamOptimizer(lrn_rate)
-    gradients, variables = zip(*optimizer.compute_gradients(loss))
+    tower_grads = [optimizer.compute_gradients(loss) for loss in tower_losses]
+    gradients, variables = zip(*average_gradients(tower_grads))
     
     if max_norm is not None:
       gradients, _ = tf.clip_by_global_norm(gradients, max_norm)
     train_op = optimizer.apply_gradients(zip(gradients, variables), global_step=global_step)
-    return train_op
\ No newline at end of file
+    return train_op
+
+def optimize(loss, lrn_rate, max_norm=None, decay_steps=None):
+  optimizer, global_step = make_optimizer(lrn_rate, decay_steps)
+  return apply_gradients(optimizer, loss, global_step, max_norm)
+
+def train_n_steps(step_fn, num_steps):
+  '''runs `num_steps` training steps inside one tf.while_loop
+
+  Each iteration builds a fresh step with `step_fn`, which must pull its own
+  batch (iterator.get_next()) and reuse the existing variables and optimizer.
+
+  Args
+    step_fn: returns (train_op, loss, acc) of a single step
+    num_steps: python int, steps per session.run
+  Returns
+    loss and acc averaged over the steps
+  '''
+  def cond(step, loss_sum, acc_sum):
+    return step < num_steps
+
+  def body(step, loss_sum, acc_sum):
+    train_op, loss, acc = step_fn()
+    with tf.control_dependencies([train_op]):
+      return step + 1, loss_sum + loss, acc_sum + acc
+
+  _, loss_sum, acc_sum = tf.while_loop(cond, body, 
+                      [tf.constant(0), tf.constant(0.), tf.constant(0.)],
+                      parallel_iterations=1, back_prop=False)
+  return loss_sum / num_steps, acc_sum / num_steps
\ No newline at end of file
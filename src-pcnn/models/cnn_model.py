@@ -3,6 +3,7 @@ from models.base_model import *
 from models.adv import *
 from models.focal_loss import *
 from models.residual import residual_net
+from models.evaluation import evaluate
 
 flags = tf.app.flags
 
@@ -30,19 +31,22 @@ class CNNModel(BaseModel):
     self.he_normal = tf.keras.initializers.he_normal()
     self.regularizer = tf.contrib.layers.l2_regularizer(FLAGS.l2_coef)
 
-    # embedding initialization
+    # frozen embedding is stored in the compute dtype
+    self.dtype = compute_dtype()
     self.vocab_size, self.word_dim = word_embed.shape
     self.word_embed = tf.get_variable('word_embed', 
-                                      initializer= word_embed,
-                                      dtype=tf.float32,
-                                      trainable=False)
+                          initializer=word_embed.astype(self.dtype.as_numpy_dtype),
+                          dtype=self.dtype,
+                          trainable=False)
+    self.embed_refs = {self.word_embed.op.name: array_sha1(word_embed)}
     pos_shape = [FLAGS.pos_num, FLAGS.pos_dim]  
     self.pos1_embed = tf.get_variable('pos1_embed', shape=pos_shape)
     self.pos2_embed = tf.get_variable('pos2_embed', shape=pos_shape)
 
     self.tensors = dict()
 
-    with tf.variable_scope('adv_graph'):
+    with tf.variable_scope('adv_graph', 
+                           custom_getter=float32_master_getter) as self.scope:
       self.build_semeval_graph(semeval_data)
       # self.build_nyt_graph(unsup_data)
 
@@ -54,19 +58,18 @@ class CNNModel(BaseModel):
 
     # embedding lookup
     sentence = tf.nn.embedding_lookup(self.word_embed, sentence)
-    pos1 = tf.nn.embedding_lookup(self.pos1_embed, pos1)
-    pos2 = tf.nn.embedding_lookup(self.pos2_embed, pos2)
+    pos1 = tf.cast(tf.nn.embedding_lookup(self.pos1_embed, pos1), self.dtype)
+    pos2 = tf.cast(tf.nn.embedding_lookup(self.pos2_embed, pos2), self.dtype)
 
     return labels, length, pcnn_mask, sentence, pos1, pos2
   
-  def conv_shallow(self, inputs):
+  def conv_shallow(self, inputs, length):
     conv_out = conv_block_v2(inputs, KERNEL_SIZE, NUM_FILTERS,
                             'conv_block1',training=self.is_train, 
                           initializer=self.he_normal, batch_norm=False,
                           reuse=tf.AUTO_REUSE)
 
-    pool_out = tf.layers.max_pooling1d(conv_out, MAX_LEN, MAX_LEN, padding='same')
-    pool_out = tf.squeeze(pool_out, axis=1)
+    pool_out = masked_max_pool(conv_out, length)
     return pool_out
 
   def pcnn_mask(self, length, ent_pos):
@@ -81,6 +84,9 @@ class CNNModel(BaseModel):
     m2 = tf.logical_not(tf.logical_or(m0, m1))
 
     pcnn_mask = tf.stack([m0, m1, m2], axis=-1) #(batch, len, 3)
+    # padded positions belong to no segment
+    valid = tf.expand_dims(tf.sequence_mask(length, n), axis=-1) # (batch, len, 1)
+    pcnn_mask = tf.logical_and(pcnn_mask, valid)
     pcnn_mask = tf.cast(pcnn_mask, tf.float32)
     return pcnn_mask
 
@@ -92,28 +98,32 @@ class CNNModel(BaseModel):
     # [batch, len, d] => [batch, d, len, 1]
     conv_out = tf.expand_dims(tf.transpose(conv_out, [0, 2, 1]), axis=-1) 
     # (batch, len, 3) => [batch, 1, len, 3]
-    mask = tf.expand_dims(mask, axis=1)
+    mask = tf.cast(tf.expand_dims(mask, axis=1), conv_out.dtype)
 
     pool_out = tf.reduce_max(conv_out * mask, axis=2)    # (batch, d, 3)
     pool_out = tf.reshape(pool_out, [-1, NUM_FILTERS*3]) # (batch, 3*d)
 
     return pool_out
 
-  def conv_deep(self, inputs):
+  def conv_deep(self, inputs, length):
     # FIXME auto reuse
-    return residual_net(inputs, MAX_LEN, NUM_FILTERS, self.is_train, NUM_CLASSES)
+    return residual_net(inputs, length, NUM_FILTERS, self.is_train, NUM_CLASSES)
 
   def compute_logits(self, sentence, pos1, pos2, pcnn_mask, lexical=None, regularizer=None):
+    # adversarial passes run in float32, see adv_example()
+    pos1 = tf.cast(pos1, sentence.dtype)
+    pos2 = tf.cast(pos2, sentence.dtype)
     sent_pos = tf.concat([sentence, pos1, pos2], axis=2)
-    # conv_out = self.conv_shallow(sent_pos)
-    # conv_out = self.conv_deep(sent_pos)
+    # conv_shallow() and conv_deep() pool over `length`, which only bottom()
+    # has; the pcnn mask already keeps the padded positions out of the pool
     conv_out = self.pcnn(sent_pos, pcnn_mask)
 
     conv_out = tf.layers.dropout(conv_out, FLAGS.dropout_rate, training=self.is_train)
 
     logits = tf.layers.dense(conv_out, NUM_CLASSES, name='out_dense',
                         kernel_regularizer=regularizer, reuse=tf.AUTO_REUSE)
-    return logits
+    # softmax and KL stay in float32
+    return tf.cast(logits, tf.float32)
 
   def compute_xentropy_loss(self, logits, labels):
     # Calculate Mean cross-entropy loss
@@ -125,7 +135,8 @@ class CNNModel(BaseModel):
 
     return cross_entropy
   
-  def build_semeval_graph(self, data):
+  def semeval_loss(self, data):
+    '''loss, accuracy, predictions, logits and labels of one SemEval batch'''
     labels, length, pcnn_mask, sentence, pos1, pos2 = self.bottom(data)
     sentence = tf.layers.dropout(sentence, FLAGS.dropout_rate, training=self.is_train)
 
@@ -134,7 +145,7 @@ class CNNModel(BaseModel):
     loss_xent = self.compute_xentropy_loss(logits, labels)
 
     # adv loss
-    adv_sentence = adv_example(sentence, loss_xent)
+    adv_sentence = adv_example(sentence, loss_xent, loss_scale())
     adv_logits = self.compute_logits(adv_sentence, pos1, pos2, pcnn_mask)
     loss_adv = self.compute_xentropy_loss(adv_logits, labels)
 
@@ -156,9 +167,17 @@ class CNNModel(BaseModel):
       acc = tf.cast(tf.equal(pred, labels), tf.float32)
       acc = tf.reduce_mean(acc)
 
+    loss = loss_xent + loss_adv + loss_vadv #+ loss_l2
+    return loss, acc, pred, logits, labels
+
+  def build_semeval_graph(self, data):
+    loss, acc, pred, logits, labels = self.semeval_loss(data)
+
     self.tensors['acc'] = acc
-    self.tensors['loss'] = loss_xent + loss_adv + loss_vadv #+ loss_l2
+    self.tensors['loss'] = loss
     self.tensors['pred'] = pred
+    self.tensors['logits'] = logits
+    self.tensors['labels'] = labels
 
   def build_nyt_graph(self, data):
     _, length, sentence, pos1, pos2 = self.bottom(data)
@@ -176,25 +195,109 @@ class CNNModel(BaseModel):
    
     self.tensors['unsup_loss'] = loss_vadv #+ loss_l2
 
-  def build_train_op(self):
+  def tower_losses(self, tower_data):
+    '''loss and accuracy of one replica per batch, all sharing the variables'''
+    losses, accs = [], []
+    for i, data in enumerate(tower_data):
+      with tf.name_scope('tower_%d' % i):
+        with tf.variable_scope(self.scope, reuse=True):
+          loss, acc = self.semeval_loss(data)[:2]
+      losses.append(loss)
+      accs.append(acc)
+    return losses, accs
+
+  def build_train_op(self, tower_data=()):
+    '''
+    Args
+      tower_data: batches of the extra data-parallel replicas, the update
+                  averages their gradients with the ones of this model's batch
+    '''
     if self.is_train:
       self.train_ops = dict()
-      loss = self.tensors['loss']
-      self.train_ops['train_loss'] = optimize(loss, FLAGS.lrn_rate, decay_steps=None)
+      losses, accs = self.tower_losses(tower_data)
+      losses.insert(0, self.tensors['loss'])
+      accs.insert(0, self.tensors['acc'])
+      self.optimizer, self.global_step = make_optimizer(FLAGS.lrn_rate)
+      self.train_ops['train_loss'] = apply_tower_gradients(self.optimizer, 
+                                                  losses, self.global_step)
+      if tower_data:
+        self.tensors['loss'] = tf.add_n(losses) / len(losses)
+        self.tensors['acc'] = tf.add_n(accs) / len(accs)
       # unsup_loss = self.tensors['unsup_loss']
       # self.train_ops['train_unsup_loss'] = optimize(unsup_loss, 0.1*FLAGS.lrn_rate, decay_steps=None)
 
+  def build_train_n_steps(self, data_iters, num_steps):
+    '''`num_steps` optimizer steps per session.run, each pulling its own 
+    batch from every iterator of `data_iters` (one per replica); fetch 
+    tensors['n_steps_loss'], ['n_steps_acc']
+    '''
+    def train_step():
+      losses, accs = self.tower_losses([it.get_next() for it in data_iters])
+      train_op = apply_tower_gradients(self.optimizer, losses, 
+                                       self.global_step)
+      return train_op, tf.add_n(losses) / len(losses), tf.add_n(accs) / len(accs)
+
+    with tf.name_scope('train_n_steps'):
+      loss, acc = train_n_steps(train_step, num_steps)
+    self.tensors['n_steps_loss'] = loss
+    self.tensors['n_steps_acc'] = acc
+
+  def evaluate(self, session, test_iter, relations=None):
+    '''one pass over the whole test set
+
+    Returns
+      EvalResult with the predictions, probabilities, accuracy and, given the
+      relation names, the SemEval macro-F1
+    '''
+    return evaluate(session, test_iter, self.tensors, relations)
+
+
+class CNNInferenceModel(CNNModel):
+  '''the logits of unlabeled batches alone, without loss, adversarial branch
+  or train op, for export'''
+
+  def build_semeval_graph(self, data):
+    '''
+    Args
+      data: (length, ent_pos, sentence, pos1, pos2), a batch without labels
+    '''
+    _, length, pcnn_mask, sentence, pos1, pos2 = self.bottom((None,) + tuple(data))
+    logits = self.compute_logits(sentence, pos1, pos2, pcnn_mask)
+
+    self.tensors['logits'] = tf.identity(logits, name='logits')
+    self.tensors['probs'] = tf.nn.softmax(logits, name='probs')
+    self.tensors['pred'] = tf.argmax(logits, axis=1, name='pred')
+
 def build_train_valid_model(model_name, word_embed, 
                             train_data, test_data, unsup_data,
                             is_adv, is_test):
+  '''
+  Args
+    train_data: list of training batches, one per data-parallel replica
+  '''
   with tf.name_scope("Train"):
     with tf.variable_scope('CNNModel', reuse=None):
-      m_train = CNNModel(word_embed, train_data, unsup_data, is_adv, is_train=True)
+      m_train = CNNModel(word_embed, train_data[0], unsup_data, is_adv, is_train=True)
       m_train.set_saver(model_name)
       if not is_test:
-        m_train.build_train_op()
+        m_train.build_train_op(train_data[1:])
   with tf.name_scope('Valid'):
     with tf.variable_scope('CNNModel', reuse=True):
       m_valid = CNNModel(word_embed, test_data, unsup_data, is_adv, is_train=False)
       m_valid.set_saver(model_name)
   return m_train, m_valid
+
+def build_valid_model(model_name, word_embed, test_data, is_adv):
+  '''the valid model alone, for evaluating checkpoints in another process'''
+  with tf.name_scope('Valid'):
+    with tf.variable_scope('CNNModel', reuse=None):
+      m_valid = CNNModel(word_embed, test_data, None, is_adv, is_train=False)
+      m_valid.set_saver(model_name)
+  return m_valid
+
+def build_inference_model(model_name, word_embed, inputs, is_adv):
+  '''the model to export, variables named like the trained one'''
+  with tf.variable_scope('CNNModel'):
+    m_infer = CNNInferenceModel(word_embed, inputs, None, is_adv, is_train=False)
+    m_infer.set_saver(model_name)
+  return m_infer
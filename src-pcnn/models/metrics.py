@@ -0,0 +1,219 @@
+'''
+Training metrics written to TensorBoard and to a JSONL file.
+
+  metrics = MetricsLogger('saved_models/cnn/metrics', examples_per_step=100)
+  train_sess = metrics.wrap(sess)    # times every training session.run
+  ...
+  metrics.log(epoch=epoch, loss=loss, valid_acc=acc)
+
+Every `log_every` steps and on each log() call a record is written with
+  steps/sec, examples/sec    over the steps since the previous record
+  step_ms_p50/p90/p99        latency percentiles of one session.run
+  input_wait_frac            share of the step spent in IteratorGetNext,
+                             sampled from a traced run every `trace_every`,
+                             input_wait_frac/<name> per watched dataset
+  host_frac                  share of wall time spent outside session.run
+  peak_rss_mb                peak resident memory of the process
+plus the scalars passed to log(). metrics.jsonl holds one json object per
+record, so runs of the different models can be compared with a few lines
+of pandas.
+
+A record whose input wait is above `stall_threshold` also logs a warning:
+the model is starved by the input pipeline rather than bound by compute.
+'''
+import os
+import json
+import time
+import resource
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.util import nest
+
+
+class MetricsLogger(object):
+
+  def __init__(self, log_dir, examples_per_step, steps_per_run=1,
+               n_step_fetches=None, log_every=100, trace_every=50, 
+               start_step=0, inputs=None, stall_threshold=0.2):
+    '''
+    Args
+      examples_per_step: training examples consumed by one step
+      steps_per_run: steps done by one run of the in-graph loop, see 
+                     build_train_n_steps
+      n_step_fetches: tensors of that loop, a session.run fetching any of 
+                      them counts `steps_per_run` steps, any other run one
+      log_every: steps between the automatic records, 0 disables them
+      trace_every: session.run calls between the input wait samples
+      start_step: step of a resumed run
+      inputs: dict of dataset name => iterator, or list of iterators (one 
+              per replica), the input wait is broken down by these names
+      stall_threshold: input wait fraction that logs a warning
+    '''
+    self.log_dir = log_dir
+    self.examples_per_step = examples_per_step
+    self.steps_per_run = steps_per_run
+    self.n_step_fetches = set(n_step_fetches or [])
+    self.log_every = log_every
+    self.trace_every = trace_every
+    self.inputs = inputs or {}
+    self.stall_threshold = stall_threshold
+    self._get_next_names = None # op name => dataset name
+
+    tf.gfile.MakeDirs(log_dir)
+    self.writer = tf.summary.FileWriter(log_dir)
+    self.jsonl = tf.gfile.GFile(os.path.join(log_dir, 'metrics.jsonl'), 'a')
+
+    self.step = start_step
+    self.num_runs = 0
+    self._reset()
+
+  def _reset(self):
+    self.interval_start = time.time()
+    self.interval_steps = 0
+    self.run_secs = []   # wall time of each session.run
+    self.wait_fracs = [] # dataset name => IteratorGetNext share, per trace
+
+  def wrap(self, session):
+    return _TimedSession(session, self)
+
+  def run(self, session, fetches, feed_dict=None, options=None,
+          run_metadata=None):
+    sample = (options is None and run_metadata is None and
+              self.trace_every > 0 and self.num_runs % self.trace_every == 0)
+    if sample:
+      options = tf.RunOptions(trace_level=tf.RunOptions.SOFTWARE_TRACE)
+      run_metadata = tf.RunMetadata()
+
+    start = time.time()
+    results = session.run(fetches, feed_dict, options, run_metadata)
+    secs = time.time() - start
+
+    self.run_secs.append(secs)
+    if sample:
+      if self._get_next_names is None:
+        self._get_next_names = get_next_ops(session.graph, self.inputs)
+      waits = input_wait(run_metadata, self._get_next_names)
+      self.wait_fracs.append({name: wait / max(secs, 1e-6) 
+                                for name, wait in waits.items()})
+    self.num_runs += 1
+
+    prev_step = self.step
+    num_steps = self.run_steps(fetches)
+    self.step += num_steps
+    self.interval_steps += num_steps
+    if self.log_every and self.step // self.log_every > prev_step // self.log_every:
+      self.log()
+    return results
+
+  def run_steps(self, fetches):
+    '''training steps done by one session.run of `fetches`'''
+    if any(f in self.n_step_fetches for f in nest.flatten(fetches)):
+      return self.steps_per_run
+    return 1
+
+  def log(self, **scalars):
+    '''writes a record with the throughput since the previous record and
+    `scalars`, e.g. loss or validation accuracy'''
+    now = time.time()
+    record = dict(scalars)
+    if self.interval_steps:
+      elapsed = max(now - self.interval_start, 1e-6)
+      steps_per_sec = self.interval_steps / elapsed
+      record['steps_per_sec'] = steps_per_sec
+      record['examples_per_sec'] = steps_per_sec * self.examples_per_step
+      p50, p90, p99 = np.percentile(self.run_secs, [50, 90, 99]) * 1000
+      record.update(step_ms_p50=p50, step_ms_p90=p90, step_ms_p99=p99)
+      record['host_frac'] = max(0., 1 - sum(self.run_secs) / elapsed)
+      if self.wait_fracs:
+        record.update(self._input_wait_record())
+    record['peak_rss_mb'] = peak_rss_mb()
+    record = {k: float(v) for k, v in record.items()}
+
+    summary = tf.Summary(value=[tf.Summary.Value(tag=k, simple_value=v)
+                                  for k, v in sorted(record.items())])
+    self.writer.add_summary(summary, self.step)
+    self.writer.flush()
+
+    record.update(step=self.step, time=now)
+    self.jsonl.write(json.dumps(record, sort_keys=True) + '\n')
+    self.jsonl.flush()
+
+    self._reset()
+    return record
+
+  def _input_wait_record(self):
+    names = sorted(set(name for fracs in self.wait_fracs for name in fracs))
+    num = len(self.wait_fracs)
+    record = {}
+    for name in names:
+      frac = sum(fracs.get(name, 0.) for fracs in self.wait_fracs) / num
+      record['input_wait_frac/%s' % name] = min(1., frac)
+    total = min(1., sum(sum(fracs.values()) for fracs in self.wait_fracs) / num)
+    record['input_wait_frac'] = total
+
+    if total > self.stall_threshold:
+      breakdown = ', '.join('%s %.0f%%' % 
+                    (name, 100*record['input_wait_frac/%s' % name])
+                    for name in names)
+      tf.logging.warning('input stall at step %d: %.0f%% of the step waits '
+                         'on get_next (%s)' % (self.step, 100*total, breakdown))
+    return record
+
+  def close(self):
+    self.writer.close()
+    self.jsonl.close()
+
+
+def get_next_ops(graph, inputs):
+  '''maps the IteratorGetNext ops of `graph` to the dataset names of `inputs`,
+  also the ones built inside the in-graph training loop'''
+  resources = {}
+  for name, iterators in inputs.items():
+    if not isinstance(iterators, (list, tuple)):
+      iterators = [iterators]
+    for iterator in iterators:
+      resources[iterator._iterator_resource.op.name] = name
+
+  names = {}
+  for op in graph.get_operations():
+    if not op.type.startswith('IteratorGetNext'):
+      continue
+    source = op.inputs[0].op
+    while source.type in ('Enter', 'Identity') and source.inputs:
+      source = source.inputs[0].op
+    names[op.name] = resources.get(source.name, 'other')
+  return names
+
+def input_wait(run_metadata, get_next_names):
+  '''seconds the traced run spent waiting for each input pipeline
+
+  Returns
+    dict of dataset name => seconds
+  '''
+  waits = {}
+  for dev_stats in run_metadata.step_stats.dev_stats:
+    for node in dev_stats.node_stats:
+      name = get_next_names.get(node.node_name)
+      if name is not None:
+        waits[name] = waits.get(name, 0.) + node.all_end_rel_micros / 1e6
+  return waits
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class _TimedSession(object):
+  '''session whose run() goes through the logger, everything else is
+  forwarded to the wrapped session'''
+
+  def __init__(self, session, logger):
+    self._session = session
+    self._logger = logger
+
+  def run(self, fetches, feed_dict=None, options=None, run_metadata=None):
+    return self._logger.run(self._session, fetches, feed_dict,
+                            options, run_metadata)
+
+  def __getattr__(self, name):
+    return getattr(self._session, name)
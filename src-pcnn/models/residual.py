@@ -33,6 +33,7 @@ from __future__ import division
 from __future__ import print_function
 
 import tensorflow as tf
+from models.base_model import masked_max_pool
 
 
 def batch_norm_relu(inputs, is_training, data_format, decay=0.997, epsilon=1e-5):
@@ -215,6 +216,9 @@ def residual_net(inputs, length, filters, is_training, num_classes, resnet_size=
   """ResNet v2 models.
 
   Args:
+    inputs: A tensor of size [batch, length, channels].
+    length: A tensor of size [batch], the true length of each sequence. The
+      final max pooling only covers these positions.
     resnet_size: A single integer for the size of the ResNet model.
     num_classes: The number of possible classes for image classification.
     data_format: The input format ('channels_last', 'channels_first', or None).
@@ -253,13 +257,8 @@ def residual_net(inputs, length, filters, is_training, num_classes, resnet_size=
   #     data_format=data_format)
 
   inputs = batch_norm_relu(inputs, is_training, data_format)
-  inputs = tf.layers.max_pooling1d(
-      inputs=inputs, pool_size=length, strides=length, padding='SAME',
-      data_format=data_format)
+  inputs = masked_max_pool(inputs, length)
   inputs = tf.identity(inputs, 'final_max_pool')
-  # print(inputs.shape)
-  # exit()
-  inputs = tf.squeeze(inputs, axis=1)
   # inputs = tf.reshape(inputs, [-1, 64])
 
   # inputs = tf.layers.dense(inputs=inputs, units=num_classes)
@@ -0,0 +1,28 @@
+import numpy as np
+from evaluation import *
+
+# run from models/, the same evaluation.py is copied to src-nyt and src-tag-ent
+
+relations = ['Other', 'Cause-Effect(e1,e2)', 'Cause-Effect(e2,e1)',
+             'Component-Whole(e1,e2)', 'Component-Whole(e2,e1)',
+             'Entity-Origin(e1,e2)']
+labels = np.array([1, 1, 2, 3, 4, 0, 0])
+pred   = np.array([1, 2, 2, 3, 0, 5, 0])
+logits = np.eye(len(relations))[pred]
+
+result = EvalResult({'logits': logits, 'labels': labels}, relations)
+
+# Cause-Effect: 2 right of 3 gold, 3 predicted (a wrong direction is still
+# a Cause-Effect prediction); Component-Whole: 1 right of 2 gold, 1 predicted;
+# Entity-Origin has no gold example and is not averaged, as in scorer.pl
+expected = {'Cause-Effect': 2/3, 'Component-Whole': 2/3}
+print(result.relation_f1, result.macro_f1)
+assert sorted(result.relation_f1) == sorted(expected)
+for name, f1 in expected.items():
+  assert np.isclose(result.relation_f1[name], f1)
+assert np.isclose(result.macro_f1, 2/3)
+assert np.isclose(result.acc, 4/7)
+
+# nothing but Other in the gold labels
+result = EvalResult({'logits': logits[:1], 'labels': np.array([0])}, relations)
+assert result.relation_f1 == {} and result.macro_f1 == 0.
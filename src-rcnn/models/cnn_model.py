@@ -11,6 +11,7 @@ flags.DEFINE_integer("num_hops", 1, "hop numbers of entity attention")
 flags.DEFINE_float("l2_coef", 0.01, "l2 loss coefficient")
 flags.DEFINE_float("dropout_rate", 0.3, "dropout probability")
 flags.DEFINE_float("lrn_rate", 0.001, "learning rate")
+flags.DEFINE_boolean("fused_lstm", False, "use LSTMBlockFusedCell for the bi-lstm")
 
 FLAGS = flags.FLAGS
 
@@ -77,9 +78,23 @@ class CNNModel(BaseModel):
       lstm_fw_cell = tf.contrib.rnn.BasicLSTMCell(num_units=num_filters1, state_is_tuple=True)
       lstm_bw_cell = tf.contrib.rnn.BasicLSTMCell(num_units=num_filters1, state_is_tuple=True)
       
-      _X = tf.unstack(X, num=seq_len, axis=1)
-      outputs, state_fw, state_bw = tf.contrib.rnn.static_bidirectional_rnn(cell_fw=lstm_fw_cell, cell_bw=lstm_bw_cell, inputs = _X, dtype=tf.float32)
-      outputs = tf.stack(outputs, axis=1)
+      if FLAGS.fused_lstm:
+        # same variable names as static_bidirectional_rnn, one op per direction
+        _X = tf.transpose(X, [1, 0, 2]) # (time, batch, dim)
+        with tf.variable_scope('bidirectional_rnn'):
+          with tf.variable_scope('fw'):
+            cell = tf.contrib.rnn.LSTMBlockFusedCell(num_filters1, name='basic_lstm_cell')
+            outputs_fw, _ = cell(_X, dtype=tf.float32)
+          with tf.variable_scope('bw'):
+            cell = tf.contrib.rnn.LSTMBlockFusedCell(num_filters1, name='basic_lstm_cell')
+            outputs_bw, _ = cell(tf.reverse(_X, axis=[0]), dtype=tf.float32)
+            outputs_bw = tf.reverse(outputs_bw, axis=[0])
+        outputs = tf.concat([outputs_fw, outputs_bw], axis=-1)
+        outputs = tf.transpose(outputs, [1, 0, 2])
+      else:
+        _X = tf.unstack(X, num=seq_len, axis=1)
+        outputs, state_fw, state_bw = tf.contrib.rnn.static_bidirectional_rnn(cell_fw=lstm_fw_cell, cell_bw=lstm_bw_cell, inputs = _X, dtype=tf.float32)
+        outputs = tf.stack(outputs, axis=1)
       
       h1_rnn = tf.expand_dims(outputs, -1)            
 
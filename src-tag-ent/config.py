@@ -7,13 +7,17 @@ def _get_hparams():
     batch_size             = 100,
     word_embed_size        = 300, 
     tune_word_embed        = False,
+    precision              = "float32", # or "float16"
     hidden_size            = 300,
+    fused_lstm             = False,
     num_tags               = 9,
     num_classes            = 10,
     l2_scale               = 0.001,
     dropout_rate           = 0.5,
     learning_rate          = 0.001,
-    max_norm               = None
+    max_norm               = None,
+    steps_per_run          = 1, # training steps run in-graph per session.run
+    ckpt_freq              = 0, # batches between the unscored mid-epoch checkpoints, 0 saves at the end of the epochs only
     )
   
   return hparams
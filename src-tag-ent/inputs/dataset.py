@@ -296,10 +296,16 @@ class RecordDataset(Dataset):
   def padded_shapes(self):
     raise NotImplementedError
 
-  def train_data(self, epoch, batch_size):
+  def train_data(self, epoch, batch_size, seed=None, skip_batches=0):
+    '''
+    Args:
+      seed: shuffle seed, the same seed gives the same batch order
+      skip_batches: batches already consumed by an interrupted run
+    '''
     if self.train_record_file:
       return self._read_records(self.train_record_file, epoch, batch_size, 
-                                shuffle=True)
+                                shuffle=True, seed=seed, 
+                                skip_batches=skip_batches)
 
   def test_data(self, epoch, batch_size):
     if self.test_record_file:
@@ -311,7 +317,8 @@ class RecordDataset(Dataset):
       return self._read_records(self.unsup_record_file, epoch, batch_size, 
                                 shuffle=True)
 
-  def _read_records(self, filename, epoch, batch_size, shuffle=True):
+  def _read_records(self, filename, epoch, batch_size, shuffle=True, 
+                    seed=None, skip_batches=0):
     '''read TFRecord file to get batch tensors for tensorflow models
 
     Returns:
@@ -323,9 +330,12 @@ class RecordDataset(Dataset):
       dataset = dataset.map(self.parse_example)
       dataset = dataset.repeat(epoch)
       if shuffle:
-        dataset = dataset.shuffle(buffer_size=1000)
+        dataset = dataset.shuffle(buffer_size=1000, seed=seed)
       
       dataset = dataset.padded_batch(batch_size, self.padded_shapes())
+      if skip_batches:
+        # replays the seeded stream up to where the interrupted run stopped
+        dataset = dataset.skip(skip_batches)
       
       if shuffle:
         iterator = dataset.make_one_shot_iterator()
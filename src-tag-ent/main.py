@@ -6,6 +6,9 @@ import numpy as np
 
 from inputs import  dataset, semeval_v2
 from models import rnn_model
+from models.checkpoint import new_train_state, resume_point
+from models.profiler import profiled
+from models.metrics import MetricsLogger
 import config as config_lib
 
 # tf.set_random_seed(0)
@@ -13,37 +16,90 @@ import config as config_lib
 
 flags = tf.app.flags
 flags.DEFINE_boolean('test', False, 'set True to test')
+flags.DEFINE_boolean('resume', False, 
+                     'continue the interrupted run saved in the model dir')
+flags.DEFINE_integer('profile_steps', 0, 
+                     'training steps traced by the profiler, 0 disables it')
+flags.DEFINE_integer('profile_start', 10, 'training steps before the trace')
+flags.DEFINE_integer('profile_top_n', 20, 'ops printed after the trace')
+flags.DEFINE_string('profile_dir', 'profile/', 
+                    'where the timeline and the op reports are written')
 FLAGS = tf.app.flags.FLAGS
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
-def train_semeval(config, session, m_train, m_valid, test_iter, vocab_tags):
-  best_acc, best_epoch = 0., 0
+def train_semeval(config, session, m_train, m_valid, test_iter, vocab_tags, 
+                  state, train_iter, relations=None):
+  '''
+  Args
+    state: train state from new_train_state() or of the resumed checkpoint,
+           updated in place and saved with every checkpoint
+    train_iter: for the input stall breakdown
+    relations: relation names by label id, for the macro-F1
+  '''
+  best_acc, best_epoch = state['best_metric'], state['best_step']
+  metrics = MetricsLogger(os.path.join(m_train.save_dir, 'metrics'), 
+                          config.hparams.batch_size, m_train.steps_per_run,
+                          m_train.tensors.get('n_steps'),
+                          start_step=state['batches'],
+                          inputs={'semeval_train': train_iter})
+  train_session = profiled(metrics.wrap(session), FLAGS.profile_dir, 
+                           FLAGS.profile_start, FLAGS.profile_steps, 
+                           FLAGS.profile_top_n)
   start_time = time.time()
   orig_begin_time = start_time
   
-  for epoch in range(config.hparams.num_epochs):
-    loss, tags_acc, rel_acc = m_train.train_epoch(session, 80)
+  ckpt_freq = config.hparams.ckpt_freq
+  for epoch in range(state['epoch'], config.hparams.num_epochs):
+    # a resumed run may stop mid-epoch
+    epoch_end = 80*(epoch+1)
+    # each entry: (num batches, mean loss, mean tag acc, mean rel acc)
+    chunks = []
+    while state['batches'] < epoch_end:
+      num_batches = epoch_end - state['batches']
+      if ckpt_freq > 0:
+        num_batches = min(num_batches, ckpt_freq - state['batches'] % ckpt_freq)
+      chunks.append((num_batches,) + 
+                    m_train.train_epoch(train_session, num_batches))
+      state['batches'] += num_batches
+      if state['batches'] < epoch_end:
+        m_train.save(session, state['batches'], None, state)
+    weights, losses, tags_accs, rel_accs = zip(*chunks)
+    loss, tags_acc, rel_acc = [np.average(x, weights=weights) 
+                                 for x in (losses, tags_accs, rel_accs)]
+    state['epoch'] = epoch + 1
     train_msg = 'train loss %.2f tags_acc %.2f rel_acc %.2f' % (loss, tags_acc, rel_acc)
+    scalars = dict(loss=loss, tags_acc=tags_acc, rel_acc=rel_acc)
 
     # epoch duration
     now = time.time()
     duration = now - start_time
     start_time = now
 
-    # valid accuracy
-    tags_acc, f1, rel_acc = m_valid.evaluate(session, test_iter, 28, vocab_tags.vocab2id)
-    test_msg = 'test tag_acc %.2f f1 %.2f rel_acc %.2f' % (tags_acc, f1, rel_acc)
+    # valid accuracy, one pass over the test set
+    result = m_valid.evaluate(session, test_iter, vocab_tags.vocab2id, relations)
+    tags_acc, f1, rel_acc = (100*result.tag_acc, 100*result.chunk_f1, 
+                             100*result.acc)
+    rel_f1 = 100*result.macro_f1 if relations else 0.
+    test_msg = 'test tag_acc %.2f f1 %.2f rel_acc %.2f rel_f1 %.2f' % (
+                  tags_acc, f1, rel_acc, rel_f1)
 
     if best_acc < rel_acc:
       best_acc = rel_acc
       best_epoch = epoch
-      m_train.save(session, epoch)
+      state['best_metric'], state['best_step'] = best_acc, best_epoch
+    # every epoch, so that an interrupted run can resume
+    m_train.save(session, state['batches'], rel_acc, state)
+    metrics.log(epoch=epoch, valid_tags_acc=tags_acc, valid_f1=f1, 
+                valid_rel_acc=rel_acc, valid_rel_f1=rel_f1, 
+                epoch_secs=duration, **scalars)
     
     print("Epoch %d %s %s time %.2f" % 
              (epoch, train_msg, test_msg, duration))
     sys.stdout.flush()
   
+  m_train.wait_for_checkpoints()
+  metrics.close()
   duration = time.time() - orig_begin_time
   duration /= 3600
   print('Done training, best_epoch: %d, best_acc: %.4f' % (best_epoch, best_acc))
@@ -53,9 +109,9 @@ def train_semeval(config, session, m_train, m_valid, test_iter, vocab_tags):
 def test(session, m_valid, test_iter, vocab_tags):
   
   m_valid.restore(session)
-  preds, tags = m_valid.evaluate(session, test_iter, 28, vocab_tags.vocab2id, return_pred=True)
-  preds = [vocab_tags.decode(x) for x in preds]
-  tags = [vocab_tags.decode(x) for x in tags]
+  result = m_valid.evaluate(session, test_iter, vocab_tags.vocab2id)
+  preds = [vocab_tags.decode(x[:n]) for x, n in zip(result.pred_tags, result.lengths)]
+  tags = [vocab_tags.decode(x[:n]) for x, n in zip(result.tags, result.lengths)]
   # print(len(tags))
   # print(tags[0])
 
@@ -78,10 +134,19 @@ def main(_):
         config.out_dir, config.semeval_train_record, config.semeval_test_record)
   
   vocab_tags = dataset.Label(config.semeval_dir, config.semeval_tags_file)
+  vocab_relations = dataset.Label(config.semeval_dir, config.semeval_relations_file)
   
 
+  checkpoint = None
+  if FLAGS.resume and not FLAGS.test:
+    checkpoint = resume_point(os.path.join(config.logdir, config.save_dir))
+  state = checkpoint['train_state'] if checkpoint else new_train_state()
+
   with tf.Graph().as_default():
-    train_iter = semeval_record.train_data(config.hparams.num_epochs, config.hparams.batch_size)
+    train_iter = semeval_record.train_data(config.hparams.num_epochs, 
+                                           config.hparams.batch_size,
+                                           seed=state['seed'],
+                                           skip_batches=state['batches'])
     test_iter = semeval_record.test_data(1, config.hparams.batch_size)
 
                                           
@@ -90,6 +155,9 @@ def main(_):
 
     m_train, m_valid = rnn_model.build_train_valid_model(config, 
                                           ini_word_embed, train_data, test_data)
+    if config.hparams.steps_per_run > 1 and not FLAGS.test:
+      with tf.name_scope('Train'):
+        m_train.build_train_n_steps(train_iter, config.hparams.steps_per_run)
 
     init_op = tf.group(tf.global_variables_initializer(),
                         tf.local_variables_initializer())# for file queue
@@ -119,7 +187,12 @@ def main(_):
       if FLAGS.test:
         test(sess, m_valid, test_iter, vocab_tags)
       else:
-        train_semeval(config, sess, m_train, m_valid, test_iter, vocab_tags)
+        if checkpoint:
+          m_train.resume(sess, checkpoint)
+          print('resume from %s, epoch %d batch %d' % 
+                (checkpoint['path'], state['epoch'], state['batches']))
+        train_semeval(config, sess, m_train, m_valid, test_iter, vocab_tags, 
+                      state, train_iter, vocab_relations.vocab)
 
 if __name__ == '__main__':
   tf.app.run()
@@ -182,6 +182,35 @@ class TagLSTMCell(tf.contrib.rnn.BasicLSTMCell):
 
 
 def decode(inputs, state, lengths, hidden_size):
+  '''run the TagLSTMCell decoder over the encoder outputs
+
+  The decoder is teacher-forced by the encoder: no step consumes a previous
+  sample, so every step input is known up front and a single dynamic_rnn
+  replaces dynamic_decode with its per-step helper callbacks and tf.cond.
+
+  Args
+    inputs: [max_len, batch, dim], time major encoder outputs
+    state: TagLSTMStateTuple, initial decoder state
+    lengths: [batch]
+  Returns
+    [batch, max_len, hidden_size], zeros past `lengths`
+  '''
+  lengths = tf.cast(lengths, tf.int32)
+
+  cell = TagLSTMCell(hidden_size, name='decode_cell')
+
+  # keep the input schedule of the former CustomHelper: steps 0 and 1 both
+  # read inputs[0], step t > 0 reads inputs[t-1]
+  dec_inputs = tf.concat([inputs[:1], inputs[:-1]], axis=0)
+
+  # scope 'decoder' keeps the variable names dynamic_decode created
+  outputs, _ = tf.nn.dynamic_rnn(cell, dec_inputs, sequence_length=lengths,
+                                 initial_state=state, time_major=True,
+                                 scope='decoder')
+  return tf.transpose(outputs, [1, 0, 2])
+
+def decode_with_helper(inputs, state, lengths, hidden_size):
+  '''reference implementation of `decode` on top of dynamic_decode'''
   # inputs = tf.transpose(inputs, [1, 0, 2]) # (max_len, batch, dim)
   lengths = tf.cast(lengths, tf.int32)
 
@@ -1,66 +1,112 @@
 import os
 import numpy as np
 import tensorflow as tf
+from models.checkpoint import *
 # from models.adv import *
 # from models.attention import *
 from models.decode import *
 from models.focal_loss import focal_loss
+from models.evaluation import evaluate
 
 class BaseModel(object):
+  # sha1 of the frozen embeddings, see models/checkpoint.py
+  embed_refs = {}
+
   def __init__(self, config, ini_word_embed, batched_data, is_train):
     self.is_train = is_train
     self.config = config
     self.hparams = config.hparams
 
-    # embedding initialization
-    self.word_embed = tf.get_variable('word_embed', initializer= ini_word_embed,
-                      dtype=tf.float32, trainable=self.hparams.tune_word_embed)
+    # embedding initialization, a frozen embedding is stored in the 
+    # compute dtype
+    self.dtype = tf.as_dtype(self.hparams.precision)
+    if self.hparams.tune_word_embed:
+      self.word_embed = tf.get_variable('word_embed', initializer= ini_word_embed,
+                        dtype=tf.float32, trainable=True)
+    else:
+      self.word_embed = tf.get_variable('word_embed', 
+                        initializer=ini_word_embed.astype(self.dtype.as_numpy_dtype),
+                        dtype=self.dtype, trainable=False)
+      self.embed_refs = {self.word_embed.op.name: array_sha1(ini_word_embed)}
     
     self.tensors = dict()
+    self.steps_per_run = 1
 
     initializer = tf.keras.initializers.he_normal()
     self.regularizer = tf.contrib.layers.l2_regularizer(self.hparams.l2_scale)
 
-    with tf.variable_scope('model_graph', initializer=initializer):
+    with tf.variable_scope('model_graph', initializer=initializer,
+                           custom_getter=float32_master_getter) as self.scope:
       self.build_graph(batched_data)
     
     self.set_saver()
 
   def set_saver(self):
     # shared between train and valid model instance
-    self.saver = tf.train.Saver(var_list=None)
+    self.saver = tf.train.Saver(var_list=saveable_variables())
     self.save_dir = os.path.join(self.config.logdir, self.config.save_dir)
     self.save_path = os.path.join(self.save_dir, "model.ckpt")
+    self.ckpt_manager = None
 
   def restore(self, session):
-    ckpt = tf.train.get_checkpoint_state(self.save_dir)
-    self.saver.restore(session, ckpt.model_checkpoint_path)
-
-  def save(self, session, global_step):
-    self.saver.save(session, self.save_path, global_step)
+    verify_embeddings(self.save_dir, self.embed_refs)
+    self.saver.restore(session, best_checkpoint(self.save_dir))
+
+  def resume(self, session, checkpoint):
+    '''restores an interrupted run, optimizer slots and global step included
+
+    Args
+      checkpoint: entry returned by resume_point()
+    '''
+    verify_embeddings(self.save_dir, self.embed_refs)
+    saver = tf.train.Saver(var_list=saveable_variables())
+    saver.restore(session, checkpoint['path'])
+    self.ckpt_manager = CheckpointManager(self.save_dir, 
+                            saveable_variables(), self.embed_refs)
+
+  def save(self, session, global_step, metric=None, train_state=None):
+    '''snapshots the variables, the files are written in the background'''
+    if self.ckpt_manager is None:
+      self.ckpt_manager = CheckpointManager(self.save_dir, 
+                              saveable_variables(), self.embed_refs)
+    self.ckpt_manager.save(session, global_step, metric, train_state)
+
+  def wait_for_checkpoints(self):
+    if self.ckpt_manager is not None:
+      self.ckpt_manager.wait()
 
   def optimize(self, loss, lrn_rate, max_norm=None, decay_steps=None):
+    self.global_step = tf.Variable(0, name="global_step", trainable=False)
+    
+    if decay_steps is not None:
+      lrn_rate = tf.train.exponential_decay(lrn_rate, self.global_step, 
+                                    decay_steps, 0.95, staircase=True)
+    
+    self.optimizer = tf.train.AdamOptimizer(lrn_rate)
+    if self.dtype == tf.float16:
+      self.optimizer = loss_scale_optimizer(self.optimizer)
+    train_op, norm = self.apply_gradients(loss, max_norm)
+    if norm is not None:
+      self.tensors['norm'] = norm
+    return train_op
+
+  def apply_gradients(self, loss, max_norm=None):
     update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS) # for batch_norm
     with tf.control_dependencies(update_ops):
-      global_step = tf.Variable(0, name="global_step", trainable=False)
-      
-      if decay_steps is not None:
-        lrn_rate = tf.train.exponential_decay(lrn_rate, global_step, 
-                                      decay_steps, 0.95, staircase=True)
-      
-      optimizer = tf.train.AdamOptimizer(lrn_rate)
-      gradients, variables = zip(*optimizer.compute_gradients(loss))
+      gradients, variables = zip(*self.optimizer.compute_gradients(loss))
       
+      norm = None
       if max_norm is not None:
         gradients, norm = tf.clip_by_global_norm(gradients, max_norm)
-        self.tensors['norm'] = norm
-      train_op = optimizer.apply_gradients(zip(gradients, variables), global_step=global_step)
-      return train_op
+      train_op = self.optimizer.apply_gradients(zip(gradients, variables), 
+                                                global_step=self.global_step)
+      return train_op, norm
 
 class RNNModel(BaseModel):
 
   def embed_layer(self, sentence):
     sentence = tf.nn.embedding_lookup(self.word_embed, sentence)
+    sentence = tf.cast(sentence, self.dtype)
     sentence = tf.layers.dropout(sentence, self.hparams.dropout_rate, 
                                  training=self.is_train)
 
@@ -70,13 +116,19 @@ class RNNModel(BaseModel):
     inputs = tf.transpose(inputs, [1, 0, 2]) # time_major, (time, batch, dim)
 
     with tf.variable_scope("bi-lstm-encoder"):
-      cell_fw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
-                                        use_peepholes=True, name='en_cell_fw')
-      cell_bw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
-                                        use_peepholes=True, name='en_cell_bw')
-      bi_output, bi_state = tf.nn.bidirectional_dynamic_rnn(
-                          cell_fw, cell_bw, inputs, sequence_length=lengths, 
-                          dtype=tf.float32, time_major=True)
+      if self.hparams.fused_lstm:
+        bi_output, bi_state = fused_bidirectional_rnn(
+                          self.hparams.hidden_size, inputs, lengths, 
+                          use_peephole=True, 
+                          fw_name='en_cell_fw', bw_name='en_cell_bw')
+      else:
+        cell_fw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
+                                          use_peepholes=True, name='en_cell_fw')
+        cell_bw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
+                                          use_peepholes=True, name='en_cell_bw')
+        bi_output, bi_state = tf.nn.bidirectional_dynamic_rnn(
+                            cell_fw, cell_bw, inputs, sequence_length=lengths, 
+                            dtype=self.dtype, time_major=True)
       en_output = tf.concat(bi_output, axis=-1)
       en_output = tf.layers.dropout(en_output, self.hparams.dropout_rate, 
                                  training=self.is_train)
@@ -96,14 +148,15 @@ class RNNModel(BaseModel):
       r = self.attention(tf.transpose(en_output, [1, 0, 2]), 'att')
       logits_rel = tf.layers.dense(r, self.hparams.num_classes)
 
-    return logits_tag, logits_rel
+    # softmax stays in float32
+    return tf.cast(logits_tag, tf.float32), tf.cast(logits_rel, tf.float32)
   
   def attention(self, inputs, name, reuse=None):
     H = inputs
     hidden_size = inputs.shape.as_list()[-1]
     with tf.variable_scope(name, reuse=reuse):
         M = tf.nn.tanh(H) # b,n,d
-        w = tf.get_variable('w-att',[1, hidden_size])
+        w = tf.get_variable('w-att',[1, hidden_size], dtype=H.dtype)
         batch_size = tf.shape(H)[0]
         alpha = tf.matmul(tf.tile(tf.expand_dims(w, 0), [batch_size, 1, 1]),
                         M, transpose_b=True)
@@ -126,7 +179,8 @@ class RNNModel(BaseModel):
 
     return tf.reduce_mean(entropy_label) #tf.reduce_mean(entropy_tags) + 
   
-  def build_graph(self, data):
+  def compute_loss(self, data):
+    '''loss and prediction tensors of one batch'''
     (labels, lengths, sentence, tags) = data
     sentence = self.embed_layer(sentence)
    
@@ -145,81 +199,89 @@ class RNNModel(BaseModel):
       acc = tf.cast(tf.equal(pred_rel, labels), tf.float32)
       acc = tf.reduce_mean(acc)
 
-    self.tensors['loss'] = loss_xent #+ loss_adv + loss_l2
-    self.tensors['pred_tags'] = pred_tags
-    self.tensors['pred_rel'] = pred_rel
-    self.tensors['rel_acc'] = acc
-    self.tensors['lengths'] = lengths
-    self.tensors['labels'] = labels
-    self.tensors['tags'] = tags
+      # token accuracy over the valid steps of each sentence
+      mask = tf.sequence_mask(lengths, tf.shape(tags)[1], dtype=tf.float32)
+      tag_hits = tf.cast(tf.equal(pred_tags, tf.cast(tags, pred_tags.dtype)), 
+                         tf.float32)
+      tag_acc = tf.reduce_sum(tag_hits*mask, 1) / tf.reduce_sum(mask, 1)
+      tag_acc = tf.reduce_mean(tag_acc)
+
+    return {'loss': loss_xent, #+ loss_adv + loss_l2
+            'pred_tags': pred_tags,
+            'pred_rel': pred_rel,
+            'logits': logits_rel,
+            'rel_acc': acc,
+            'tag_acc': tag_acc,
+            'lengths': lengths,
+            'labels': labels,
+            'tags': tags}
 
+  def build_graph(self, data):
+    self.tensors.update(self.compute_loss(data))
     self.maybe_build_train_op()
 
+  def build_train_n_steps(self, data_iter, num_steps):
+    '''run `num_steps` optimizer steps per session.run inside a tf.while_loop,
+    each step pulls its own batch from `data_iter`; train_epoch() then only
+    fetches the averaged loss and accuracies once per `num_steps` batches
+    '''
+    def body(step, loss_sum, tag_acc_sum, rel_acc_sum):
+      with tf.variable_scope(self.scope, reuse=True):
+        tensors = self.compute_loss(data_iter.get_next())
+      train_op, _ = self.apply_gradients(tensors['loss'])
+      with tf.control_dependencies([train_op]):
+        return (step + 1, loss_sum + tensors['loss'], 
+                tag_acc_sum + tensors['tag_acc'], 
+                rel_acc_sum + tensors['rel_acc'])
+
+    with tf.name_scope('train_n_steps'):
+      zero = tf.constant(0.)
+      _, loss_sum, tag_acc_sum, rel_acc_sum = tf.while_loop(
+                  lambda step, *_: step < num_steps, body, 
+                  [tf.constant(0), zero, zero, zero],
+                  parallel_iterations=1, back_prop=False)
+    self.tensors['n_steps'] = [loss_sum / num_steps, tag_acc_sum / num_steps, 
+                               rel_acc_sum / num_steps]
+    self.steps_per_run = num_steps
+
   def train_epoch(self, session, num_batches_per_epoch):
     if not self.is_train:
       return
 
-    moving_loss, moving_tag_acc, moving_rel_acc = [], [], []
-    for batch in range(num_batches_per_epoch):
+    # each entry: (num batches, mean loss, mean tag acc, mean rel acc)
+    moving = []
+    num_runs, num_single = 0, num_batches_per_epoch
+    if self.steps_per_run > 1:
+      num_runs, num_single = divmod(num_batches_per_epoch, self.steps_per_run)
+    for _ in range(num_runs):
+      loss, tag_acc, rel_acc = session.run(self.tensors['n_steps'])
+      moving.append((self.steps_per_run, loss, tag_acc, rel_acc))
+
+    for batch in range(num_single):
       train_op = self.train_ops['train_loss']
-      fetches = [train_op, self.tensors['lengths'], self.tensors['tags'], 
-          self.tensors['pred_tags'], self.tensors['rel_acc'],
-          self.tensors['loss']
-                ]
-      _, lengths, tags, pred_tags, rel_acc, loss = session.run(fetches)
-      
-      moving_loss.append(loss)
-      for lab, lab_pred, length in zip(tags, pred_tags, lengths):
-        lab      = lab[:length]
-        lab_pred = lab_pred[:length]
-        acc = np.mean(np.equal(lab, lab_pred))
-        moving_tag_acc.append(acc)
-      
-      moving_rel_acc.append(rel_acc)
+      fetches = [train_op, self.tensors['loss'], self.tensors['tag_acc'], 
+                 self.tensors['rel_acc']]
+      _, loss, tag_acc, rel_acc = session.run(fetches)
+      moving.append((1, loss, tag_acc, rel_acc))
     
-    return np.mean(moving_loss), np.mean(moving_tag_acc)*100, np.mean(moving_rel_acc)*100
-
-  def evaluate(self, session, test_ds_iter, num_batches, vocab_tags, return_pred=False):
+    weights, loss, tag_acc, rel_acc = zip(*moving)
+    mean = lambda x: np.average(x, weights=weights)
+    return mean(loss), mean(tag_acc)*100, mean(rel_acc)*100
+
+  def evaluate(self, session, test_ds_iter, vocab_tags, relations=None):
+    '''one pass over the whole test set
+
+    Args
+      vocab_tags: dict of tag => id
+      relations: relation names by label id, for the SemEval macro-F1
+    Returns
+      EvalResult with the relation and tag predictions, the relation 
+      accuracy, the token accuracy and the chunk F1 of the tags
+    '''
     if self.is_train:
       return
 
-    session.run(test_ds_iter.initializer)
-
-    tags_acc = []
-    rel_accs = []
-    pred_result = []
-    tags_result = []
-    correct_preds, total_correct, total_preds = 0., 0., 0.
-    for batch in range(num_batches):
-      fetches = [self.tensors['pred_tags'], self.tensors['lengths'], 
-                 self.tensors['tags'], self.tensors['rel_acc']]
-      preds, lengths, tags, rel_acc = session.run(fetches)
-      for lab, lab_pred, length in zip(tags, preds, lengths):
-        lab      = lab[:length]
-        lab_pred = lab_pred[:length]
-        acc = np.mean(np.equal(lab, lab_pred))
-        tags_acc.append(acc)
-        pred_result.append(lab_pred)
-        tags_result.append(lab)
-        rel_accs.append(rel_acc)
-
-        lab_chunks      = set(get_chunks(lab, vocab_tags))
-        lab_pred_chunks = set(get_chunks(lab_pred, vocab_tags))
-
-        correct_preds += len(lab_chunks & lab_pred_chunks)
-        total_preds   += len(lab_pred_chunks)
-        total_correct += len(lab_chunks)
-
-    p   = correct_preds / total_preds if correct_preds > 0 else 0
-    r   = correct_preds / total_correct if correct_preds > 0 else 0
-    f1  = 2 * p * r / (p + r) if correct_preds > 0 else 0
-    tags_acc = np.mean(tags_acc)
-    rel_accs = np.mean(rel_accs)
-
-    if return_pred:
-      return pred_result, tags_result
-
-    return 100*tags_acc, 100*f1, 100*rel_accs
+    return evaluate(session, test_ds_iter, self.tensors, relations, vocab_tags)
 
   def maybe_build_train_op(self):
     if not self.is_train:
@@ -229,67 +291,56 @@ class RNNModel(BaseModel):
     loss = self.tensors['loss']
     self.train_ops['train_loss'] = self.optimize(loss, self.hparams.learning_rate)
       
-def get_chunks(seq, tags, default_tag='O'):
-  """Given a sequence of tags, group entities and their position
-
-  Args:
-      seq: [4, 4, 0, 0, ...] sequence of labels
-      tags: dict["O"] = 4
-
-  Returns:
-      list of (chunk_type, chunk_start, chunk_end)
-
-  Example:
-      seq = [4, 5, 0, 3]
-      tags = {"B-PER": 4, "I-PER": 5, "B-LOC": 3}
-      result = [("PER", 0, 2), ("LOC", 3, 4)]
-
-  """
-  default = tags[default_tag]
-  idx_to_tag = {idx: tag for tag, idx in tags.items()}
-  chunks = []
-  chunk_type, chunk_start = None, None
-  for i, tok in enumerate(seq):
-    # End of a chunk 1
-    if tok == default and chunk_type is not None:
-      # Add a chunk.
-      chunk = (chunk_type, chunk_start, i)
-      chunks.append(chunk)
-      chunk_type, chunk_start = None, None
-
-    # End of a chunk + start of a chunk!
-    elif tok != default:
-      tok_chunk_class, tok_chunk_type = get_chunk_type(tok, idx_to_tag)
-      if chunk_type is None:
-        chunk_type, chunk_start = tok_chunk_type, i
-      elif tok_chunk_type != chunk_type or tok_chunk_class == "B":
-        chunk = (chunk_type, chunk_start, i)
-        chunks.append(chunk)
-        chunk_type, chunk_start = tok_chunk_type, i
-    else:
-      pass
-
-  # end condition
-  if chunk_type is not None:
-    chunk = (chunk_type, chunk_start, len(seq))
-    chunks.append(chunk)
-
-  return chunks
-
-def get_chunk_type(tok, idx_to_tag):
-    """
-    Args:
-        tok: id of token, ex 4
-        idx_to_tag: dictionary {4: "B-PER", ...}
-
-    Returns:
-        tuple: "B", "PER"
-
-    """
-    tag_name = idx_to_tag[tok]
-    tag_class = tag_name.split('-')[0]
-    tag_type = tag_name.split('-')[1]
-    return tag_class, tag_type
+def fused_bidirectional_rnn(num_units, inputs, lengths, use_peephole=False,
+                            fw_name=None, bw_name=None, scope=None):
+  '''drop-in for `tf.nn.bidirectional_dynamic_rnn` built on LSTMBlockFusedCell
+
+  The whole sequence runs in a single fused kernel per direction instead of
+  a while_loop over LSTMCell. Variables are created under the same scopes as
+  `bidirectional_dynamic_rnn` ('bidirectional_rnn/fw/<fw_name>/kernel', ...)
+  and the gate layout matches LSTMCell, so checkpoints are interchangeable.
+
+  Args
+    inputs: [time, batch, dim], time major
+    lengths: [batch]
+  Returns
+    (outputs_fw, outputs_bw), (state_fw, state_bw), time major outputs and
+    LSTMStateTuple final states
+  '''
+  with tf.variable_scope(scope or 'bidirectional_rnn'):
+    with tf.variable_scope('fw'):
+      cell_fw = tf.contrib.rnn.LSTMBlockFusedCell(num_units, 
+                                   use_peephole=use_peephole, name=fw_name)
+      outputs_fw, state_fw = cell_fw(inputs, dtype=inputs.dtype, 
+                                     sequence_length=lengths)
+
+    with tf.variable_scope('bw'):
+      cell_bw = tf.contrib.rnn.LSTMBlockFusedCell(num_units, 
+                                   use_peephole=use_peephole, name=bw_name)
+      inputs_rev = tf.reverse_sequence(inputs, lengths, seq_axis=0, batch_axis=1)
+      outputs_bw, state_bw = cell_bw(inputs_rev, dtype=inputs.dtype, 
+                                     sequence_length=lengths)
+      outputs_bw = tf.reverse_sequence(outputs_bw, lengths, seq_axis=0, batch_axis=1)
+
+  return (outputs_fw, outputs_bw), (state_fw, state_bw)
+
+def float32_master_getter(getter, *args, **kwargs):
+  '''custom getter for reduced precision training
+
+  Trainable variables are stored in float32 and cast to the requested dtype
+  on read, so the optimizer always updates float32 master weights.
+  '''
+  dtype = kwargs.get('dtype')
+  if not kwargs.get('trainable', True) or dtype in (None, tf.float32):
+    return getter(*args, **kwargs)
+  kwargs['dtype'] = tf.float32
+  return tf.cast(getter(*args, **kwargs), dtype)
+
+def loss_scale_optimizer(optimizer):
+  '''dynamic loss scaling, float16 gradients underflow without it'''
+  manager = tf.contrib.mixed_precision.ExponentialUpdateLossScaleManager(
+                init_loss_scale=2**15, incr_every_n_steps=2000)
+  return tf.contrib.mixed_precision.LossScaleOptimizer(optimizer, manager)
 
 def build_train_valid_model(config, ini_word_embed, train_data, test_data):
   with tf.name_scope("Train"):
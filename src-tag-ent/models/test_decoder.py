@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 from decode import *
 
@@ -6,7 +7,7 @@ from decode import *
 
 
 batch = 4
-max_len = 10
+max_len = 7
 dim = 2
 hidden_size = 3
 
@@ -18,10 +19,21 @@ h = tf.zeros([batch, hidden_size])
 state = TagLSTMStateTuple(c, h, tf.zeros_like(c))
 
 output = decode(inputs, state, lengths, hidden_size)
+vars_rnn = tf.trainable_variables()
+
+# reference decoder on dynamic_decode, sharing the same weights
+ref_output = decode_with_helper(inputs, state, lengths, hidden_size)
+vars_ref = [v for v in tf.trainable_variables() if v not in vars_rnn]
+copy_op = tf.group(*[ref.assign(v) for v, ref in zip(vars_rnn, vars_ref)])
 
 with tf.Session() as sess:
   sess.run(tf.global_variables_initializer())
-
-  t = sess.run(output)
-  print(t.shape)
-  # print(t)
\ No newline at end of file
+  sess.run(copy_op)
+
+  t, t_ref, n = sess.run([output, ref_output, lengths])
+  print(t.shape, t_ref.shape)
+  for i, length in enumerate(n):
+    # positions past the length are not used by the model
+    assert np.allclose(t[i, :length], t_ref[i, :length], atol=1e-6)
+  print('max diff %g' % max(np.abs(t[i, :l] - t_ref[i, :l]).max() 
+                             for i, l in enumerate(n)))
@@ -8,6 +8,7 @@ def _get_hparams():
     word_embed_size        = 300, 
     tune_word_embed        = False,
     hidden_size            = 300,
+    fused_lstm             = False,
     num_tags               = 81,
     l2_scale               = 0.001,
     dropout_rate           = 0.5,
@@ -66,13 +66,21 @@ class RNNModel(BaseModel):
   
   def compute_logits(self, inputs, lengths):
     with tf.variable_scope("bi-lstm-encoder"):
-      cell_fw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
-                                        use_peepholes=True, name='en_cell_fw')
-      cell_bw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
-                                        use_peepholes=True, name='en_cell_bw')
-      bi_output, bi_state = tf.nn.bidirectional_dynamic_rnn(
-                          cell_fw, cell_bw, inputs, 
-                          sequence_length=lengths, dtype=tf.float32)
+      if self.hparams.fused_lstm:
+        inputs_tm = tf.transpose(inputs, [1, 0, 2]) # time_major, (time, batch, dim)
+        bi_output, bi_state = fused_bidirectional_rnn(
+                            self.hparams.hidden_size, inputs_tm, lengths, 
+                            use_peephole=True, 
+                            fw_name='en_cell_fw', bw_name='en_cell_bw')
+        bi_output = [tf.transpose(x, [1, 0, 2]) for x in bi_output]
+      else:
+        cell_fw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
+                                          use_peepholes=True, name='en_cell_fw')
+        cell_bw = tf.contrib.rnn.LSTMCell(self.hparams.hidden_size, 
+                                          use_peepholes=True, name='en_cell_bw')
+        bi_output, bi_state = tf.nn.bidirectional_dynamic_rnn(
+                            cell_fw, cell_bw, inputs, 
+                            sequence_length=lengths, dtype=tf.float32)
       en_output = tf.concat(bi_output, axis=-1)
       en_output = tf.layers.dropout(en_output, self.hparams.dropout_rate, 
                                  training=self.is_train)
@@ -200,6 +208,39 @@ class RNNModel(BaseModel):
     loss = self.tensors['loss']
     self.train_ops['train_loss'] = self.optimize(loss, self.hparams.learning_rate)
       
+def fused_bidirectional_rnn(num_units, inputs, lengths, use_peephole=False,
+                            fw_name=None, bw_name=None, scope=None):
+  '''drop-in for `tf.nn.bidirectional_dynamic_rnn` built on LSTMBlockFusedCell
+
+  The whole sequence runs in a single fused kernel per direction instead of
+  a while_loop over LSTMCell. Variables are created under the same scopes as
+  `bidirectional_dynamic_rnn` ('bidirectional_rnn/fw/<fw_name>/kernel', ...)
+  and the gate layout matches LSTMCell, so checkpoints are interchangeable.
+
+  Args
+    inputs: [time, batch, dim], time major
+    lengths: [batch]
+  Returns
+    (outputs_fw, outputs_bw), (state_fw, state_bw), time major outputs and
+    LSTMStateTuple final states
+  '''
+  with tf.variable_scope(scope or 'bidirectional_rnn'):
+    with tf.variable_scope('fw'):
+      cell_fw = tf.contrib.rnn.LSTMBlockFusedCell(num_units, 
+                                   use_peephole=use_peephole, name=fw_name)
+      outputs_fw, state_fw = cell_fw(inputs, dtype=tf.float32, 
+                                     sequence_length=lengths)
+
+    with tf.variable_scope('bw'):
+      cell_bw = tf.contrib.rnn.LSTMBlockFusedCell(num_units, 
+                                   use_peephole=use_peephole, name=bw_name)
+      inputs_rev = tf.reverse_sequence(inputs, lengths, seq_axis=0, batch_axis=1)
+      outputs_bw, state_bw = cell_bw(inputs_rev, dtype=tf.float32, 
+                                     sequence_length=lengths)
+      outputs_bw = tf.reverse_sequence(outputs_bw, lengths, seq_axis=0, batch_axis=1)
+
+  return (outputs_fw, outputs_bw), (state_fw, state_bw)
+
 def get_chunks(seq, tags, default_tag='O'):
   """Given a sequence of tags, group entities and their position
 
@@ -9,6 +9,7 @@ from inputs import fudan
 # from inputs import imdb
 # from inputs import semeval
 from models import mtl_model
+from models.profiler import profiled
 # tf.set_random_seed(0)
 # np.random.seed(0)
 
@@ -21,6 +22,12 @@ flags.DEFINE_integer("batch_size", 16, "batch size")
 flags.DEFINE_boolean('adv', False, 'set True to adv training')
 flags.DEFINE_boolean('test', False, 'set True to test')
 flags.DEFINE_boolean('build_data', False, 'set True to generate data')
+flags.DEFINE_integer('profile_steps', 0, 
+                     'training steps traced by the profiler, 0 disables it')
+flags.DEFINE_integer('profile_start', 10, 'training steps before the trace')
+flags.DEFINE_integer('profile_top_n', 20, 'ops printed after the trace')
+flags.DEFINE_string('profile_dir', 'profile/', 
+                    'where the timeline and the op reports are written')
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -67,6 +74,8 @@ def train(sess, m_train, m_valid):
   orig_begin_time = start_time
 
   n_task = len(m_train.tensors)
+  train_sess = profiled(sess, FLAGS.profile_dir, FLAGS.profile_start, 
+                        FLAGS.profile_steps, FLAGS.profile_top_n)
   for epoch in range(FLAGS.num_epochs):
     all_loss, all_acc = 0., 0.
     for batch in range(82):
@@ -74,7 +83,7 @@ def train(sess, m_train, m_valid):
         acc, loss = m_train.tensors[i]
         train_op = m_train.train_ops[i]
         train_fetch = [train_op, loss, acc]
-        _, loss, acc = sess.run(train_fetch)
+        _, loss, acc = train_sess.run(train_fetch)
         all_loss += loss
         all_acc += acc
 
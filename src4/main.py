@@ -9,6 +9,7 @@ from inputs import fudan
 # from inputs import imdb
 # from inputs import semeval
 from models import mtl_model
+from models.profiler import profiled
 # from models import cnn_model
 # tf.set_random_seed(0)
 # np.random.seed(0)
@@ -22,6 +23,12 @@ flags.DEFINE_integer("batch_size", 16, "batch size")
 flags.DEFINE_boolean('test', False, 'set True to test')
 flags.DEFINE_boolean('build_data', False, 'set True to generate data')
 flags.DEFINE_boolean('adv', False, 'set True to use adv training')
+flags.DEFINE_integer('profile_steps', 0, 
+                     'training steps traced by the profiler, 0 disables it')
+flags.DEFINE_integer('profile_start', 10, 'training steps before the trace')
+flags.DEFINE_integer('profile_top_n', 20, 'ops printed after the trace')
+flags.DEFINE_string('profile_dir', 'profile/', 
+                    'where the timeline and the op reports are written')
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -58,6 +65,8 @@ def train(sess, m_train, m_valid, test_iter):
   train_fetch = [m_train.train, m_train.loss, m_train.acc, m_train.adv_acc]
   
   best_acc, best_step= 0., 0
+  train_sess = profiled(sess, FLAGS.profile_dir, FLAGS.profile_start, 
+                        FLAGS.profile_steps, FLAGS.profile_top_n)
   start_time = time.time()
   orig_begin_time = start_time
 
@@ -66,7 +75,7 @@ def train(sess, m_train, m_valid, test_iter):
 
     all_loss, all_acc, all_adv_acc = 0., 0., 0.
     for batch in range(1386):
-      _, loss, acc, adv_acc = sess.run(train_fetch)
+      _, loss, acc, adv_acc = train_sess.run(train_fetch)
       all_loss += loss
       all_acc += acc
       all_adv_acc += adv_acc